@@ -2,143 +2,190 @@ from parser import Node, Nonterminal, Terminal, ASTNode
 
 # N.B. "ast" also name-conflicts with pdb
 
-# wrap the rule to AST builder lookup and call in one
+# Build the AST of a parse tree. Every node's AST is built from the values of
+# its children: Tokens for terminals, and for nonterminals whatever the
+# builder for their rule in RULE_TO_AST made of theirs (the AST, or a Token
+# for the rules that only name an operator). The tree is walked in post-order
+# with an explicit stack rather than by recursion, so how deeply the source
+# nests is bounded by memory and not by the interpreter's recursion limit.
 def to_ast(nonterminal):
-    return RULE_TO_AST[nonterminal.rule_name](nonterminal)
-
-# AST builders
-
-# generic AST builder for binary expressions whose nonterminal trees have have
-# (eventual) children in an alternating sequence of left-expression, op,
-# right-expression as a result of rules of the form <expr> { <op> <expr> }
-def _ast_binary_expr(nonterminal):
-    return __ast_binary_expr_list(nonterminal.children)
-
-# rather than modify the nonterminal by deleting children, this helper takes a
-# children list as argument and recursively builds the tree (left-associatively
-# corresponds to starting at the end of the expression tail list)
-def __ast_binary_expr_list(nodes):
-    assert(len(nodes) > 0)
-
-    if len(nodes) == 1:
-        return to_ast(nodes[0])
-    else:
-        # we have a non-empty repetition of binary expression tails (the <op> <expr> part) to deal with, recursively
-        root = to_ast(nodes[-1])
-        root.children.insert(0, __ast_binary_expr_list(nodes[:-1]))
-        return root
-
-# for a single <expr_tail> rule, return a tree rooted w/ the operator
-def _ast_binary_tail(nonterminal):
-    # each rule must be <op> <expr>
-    assert(len(nonterminal.children) == 2)
-    # for rules of this type, the first child should be the operator
-    assert(isinstance(nonterminal.children[0], Terminal))
-
-    return ASTNode(name=nonterminal.children[0].token.value,
-                   children=[to_ast(nonterminal.children[1])])
-
-def _ast_unary_expr(nonterminal):
-    assert(len(nonterminal.children) == 1 or len(nonterminal.children) == 2)
-
-    # if this rule was parsed as a single <postfix_expr>, delegate to its to_ast() 
-    if len(nonterminal.children) == 1:
-        # TODO: remove a lot of these asserts to avoid setting the grammar in stone,
-        # I'm just using them for debug-assisting for initial implementation
-        assert(nonterminal.children[0].rule_name == "postfix_expression")
-        return to_ast(nonterminal.children[0])
-
-    else:
-        # return a tree with the unary op as root and the rest as child
-        # TODO: this lacks distinguishing between prefix and postfix "++"
-        assert(nonterminal.children[0].rule_name == "unary_op")
-        # TODO: here's a good example of where we lose some parsing work
-        # (e.g. we have a rule that multiplexes all unary operators and get rid
-        # of that distinction by taking only its str() representation in the
-        # AST) that could be useful for mapping 3AC instructions based on the
-        # specific unary operator
-        return ASTNode(name=nonterminal.children[0].children[0].token.value,
-                       children=[to_ast(nonterminal.children[1])])
-    
-def _ast_postfix_expr(nonterminal):
-    if len(nonterminal.children) == 1:
-        return to_ast(nonterminal.children[0])
-    else:
-        # TODO: for right now, let's just not support postfix expressions (array
-        # indexing, function parameter lists, etc)
-        pass
-
-def _ast_primary_expr(nonterminal):
-    if len(nonterminal.children) == 1 and nonterminal.children[0].token.typename == "identifier":
-        return ASTNode(name="id: " + nonterminal.children[0].token.value)
-    elif len(nonterminal.children) == 1:
-        return ASTNode(name=nonterminal.children[0].token.value)
-    elif len(nonterminal.children) == 3:
-        assert(nonterminal.children[0].token.value == '(' and nonterminal.children[2].token.value == ')')
-        return to_ast(nonterminal.children[1])
+    builders = RULE_TO_AST
+    # the nodes being built, with the values of their children so far and an
+    # iterator over the rest
+    stack = []
+    node = nonterminal
+    values = []
+    children = iter(node.children)
+    while True:
+        for child in children:
+            # most nodes in a chain of rules that only have one child
+            # themselves pass its value straight up
+            while len(child.children) == 1 and child.rule_name not in _BUILT_FROM_ONE:
+                child = child.children[0]
+            if type(child) is Terminal:
+                values.append(child.token)
+            elif child.rule_name in _LEFT_OUT:
+                values.append(None)
+            elif len(child.children) == 1 and type(child.children[0]) is Terminal:
+                # an identifier or literal: built here, without a trip
+                # through the stack
+                values.append(builders[child.rule_name]([child.children[0].token]))
+            else:
+                stack.append((node, values, children))
+                node = child
+                values = []
+                children = iter(child.children)
+                break
+        else:
+            value = builders.get(node.rule_name, _ast_default)(values)
+            if not stack:
+                return value
+            node, values, children = stack.pop()
+            values.append(value)
+
+# AST builders, from the values of a nonterminal's children (see to_ast())
+
+# generic AST builder for binary expressions whose nonterminal trees have
+# children in an alternating sequence of left-expression, op, right-expression
+# as a result of rules of the form <expr> { <op> <expr> }: the tails come as
+# (op, right-expression) pairs, folded left-associatively onto the first
+# operand in one pass from left to right, one node per operator
+def _ast_binary_expr(values):
+    operands = iter(values)
+    root = next(operands)
+    for op, right in operands:
+        root = action_binary_expr(op, root, right)
+    return root
+
+# for a single <expr_tail> rule, the operator's Token and the AST of its right
+# operand, for _ast_binary_expr to hang its left operand on
+def _ast_binary_tail(values):
+    # each rule must be <op> <expr>, the operator a terminal
+    assert(len(values) == 2)
+
+    op, right = values
+    return op, right
+
+def _ast_unary_expr(values):
+    assert(len(values) == 1 or len(values) == 2)
+
+    # if this rule was parsed as a single <postfix_expr>, it's that
+    if len(values) == 1:
+        return values[0]
+
+    # return a tree with the unary op as root and the rest as child
+    # TODO: this lacks distinguishing between prefix and postfix "++"
+    # TODO: here's a good example of where we lose some parsing work
+    # (e.g. we have a rule that multiplexes all unary operators and get rid
+    # of that distinction by taking only its str() representation in the
+    # AST) that could be useful for mapping 3AC instructions based on the
+    # specific unary operator
+    return action_unary_expr(values)
+
+def _ast_primary_expr(values):
+    if len(values) == 1 and values[0].typename == "identifier":
+        return action_identifier(values)
+    elif len(values) == 1:
+        return action_literal(values)
+    elif len(values) == 3:
+        assert(values[0].value == '(' and values[2].value == ')')
+        return action_parenthesized(values)
     else:
-        assert(len(nonterminal.children) == 1 or len(nonterminal.children) == 3)
+        assert(len(values) == 1 or len(values) == 3)
 
-def _ast_assignment_expr(nonterminal):
-    if len(nonterminal.children) == 1:
-        return to_ast(nonterminal.children[0])
-    elif len(nonterminal.children) == 3:
+def _ast_assignment_expr(values):
+    if len(values) == 1:
+        return values[0]
+    elif len(values) == 3:
         # TODO (1): same as TODO 1 in _ast_unary_expr()
-        return ASTNode(name=nonterminal.children[1].children[0].token.value,
-                       children=[to_ast(nonterminal.children[0]),
-                                 to_ast(nonterminal.children[2])])
+        return action_assignment_expr(values)
     else:
         # TODO: raise some kind of error
-        assert(len(nonterminal.children) == 1 or len(nonterminal.children) == 3)
-
-def _ast_expression(nonterminal):
-    if len(nonterminal.children) == 1:
-        return to_ast(nonterminal.children[0])
-    else:
-        # TODO: we probably shouldn't support <expr>, <expr>, ... <expr>; 
-        return ASTNode(name="<expression sequence>",
-                       children=[to_ast(c) for c in nonterminal.children])
-
-def _ast_expression_statement(nonterminal):
-    if len(nonterminal.children) == 1:
-        assert(nonterminal.children[0].token.value == ';')
-        return None
-
-    return to_ast(nonterminal.children[0])
-
-def _ast_compound_statement(nonterminal):
-    assert(len(nonterminal.children) >= 2 and nonterminal.children[0].token.value == '{' and nonterminal.children[-1].token.value == '}')
-    c = []
-    for child in nonterminal.children[1:-1]:
-        # declaration AST builders will (I think) return None
-        t = to_ast(child)
-        if t is not None:
-            c.append(t)
-    return ASTNode(name="<compound statement>", children=c)
+        assert(len(values) == 1 or len(values) == 3)
 
 # TODO: do we want to include function declarations in the AST when they're part
 # of definitions? Or just use the symbol table to map to a function's
 # statement sequence in the AST?
-def _ast_function_definition(nonterminal):
-    # for now disregard function declarations
-    return to_ast(nonterminal.children[1])
+
+# declarations don't make it into the AST (yet), so to_ast() doesn't look
+# inside them
+def _ast_declaration(values):
+    return None
+
+# nor does it look inside postfix expressions proper (the ones with more than
+# one child; see action_postfix_expr), which have no AST either
+_LEFT_OUT = frozenset(["declaration", "function_decl", "postfix_expression"])
 
 # generic function for single nonterminals which may be pruned from the AST
 # n.b. also works for single nonterminals with trailing, ignorable stuff
-def _ast_nonterminal(nonterminal):
-    return to_ast(nonterminal.children[0])
+def _ast_nonterminal(values):
+    return values[0]
+
+# the rules whose builders don't just pass the value of a single child through
+_BUILT_FROM_ONE = frozenset(["primary_expression", "expression_statement",
+                             "compound_statement", "function_definition",
+                             "declaration", "function_decl", "program"])
+
+# the rules without a builder of their own (the ones that only name an
+# operator, parameter lists, postfix tails...): a single value passes through
+# and anything else leaves nothing in the AST
+def _ast_default(values):
+    if len(values) == 1:
+        return values[0]
+    return None
+
+# Semantic actions, for parsing straight to an AST without a parse tree (see
+# parser.Reduction; grammar.py attaches these to its reductions). The values of
+# the parts a reduction matched are the same as those of the children of its
+# node in the parse tree, so the builders above share them.
+
+def action_identifier(values):
+    return ASTNode(name="id: " + values[0].value)
+
+def action_literal(values):
+    return ASTNode(name=values[0].value)
+
+def action_parenthesized(values):
+    return values[1]
+
+def action_postfix_expr(values):
+    # TODO: for right now, let's just not support postfix expressions (array
+    # indexing, function parameter lists, etc)
+    if len(values) == 1:
+        return values[0]
+    return None
+
+def action_unary_expr(values):
+    return ASTNode(name=values[0].value, children=[values[1]])
+
+# for PrecedenceRule: one binary operator applied to the AST of its left and
+# right operands
+def action_binary_expr(op, left, right):
+    return ASTNode(name=op.value, children=[left, right])
+
+def action_assignment_expr(values):
+    return ASTNode(name=values[1].value, children=[values[0], values[2]])
+
+def action_expression(values):
+    if len(values) == 1:
+        return values[0]
+    return ASTNode(name="<expression sequence>", children=values[::2])
+
+def action_expression_statement(values):
+    # just the ';', or the expression and the ';'
+    if len(values) == 1:
+        return None
+    return values[0]
 
-def _ast_program(nonterminal):
-    # empty root node to hold everything
-    c = []
+def action_compound_statement(values):
+    return ASTNode(name="<compound statement>",
+                   children=[v for v in values[1:-1] if v is not None])
 
-    for child in nonterminal.children:
-        assert(isinstance(child, Nonterminal) and child.rule_name == "top_level_decl")
-        t = to_ast(child)
-        if t is not None:
-            c.append(t)
-            
-    return ASTNode(name="", children=c)
+def action_function_definition(values):
+    return values[1]
+
+def action_program(values):
+    return ASTNode(name="", children=[v for v in values if v is not None])
 
 RULE_TO_AST = {
     "multiplicative_expression" : _ast_binary_expr,
@@ -162,15 +209,16 @@ RULE_TO_AST = {
     "logical_or_expression" : _ast_binary_expr,
     "logical_or_tail" : _ast_binary_tail,
     "unary_expression" : _ast_unary_expr,
-    "postfix_expression" : _ast_postfix_expr,
+    "postfix_expression" : action_postfix_expr,
     "primary_expression" : _ast_primary_expr,
     "assignment_expression" : _ast_assignment_expr,
-    "expression" : _ast_expression,
-    "expression_statement" : _ast_expression_statement,
+    "expression" : action_expression,
+    "expression_statement" : action_expression_statement,
     "statement" : _ast_nonterminal,
-    "compound_statement" : _ast_compound_statement,
-    "function_definition" : _ast_function_definition,
+    "compound_statement" : action_compound_statement,
+    "function_definition" : action_function_definition,
+    "declaration" : _ast_declaration,
+    "function_decl" : _ast_declaration,
     "top_level_decl" : _ast_nonterminal,
-    "program" : _ast_program,
+    "program" : action_program,
 }
-
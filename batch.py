@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import tokenizer
+from grammar import program
+from parser import parse
+from parser_compiler import load_compiled_parser
+import lalr
+import dfa_lexer
+import vectorized_lexer
+from abstract_syntax_tree import to_ast
+import compile_cache
+from tolkien import value_scope
+
+# Compiling many files in one go. Each worker process imports the grammar,
+# compiles the token regex and loads the chosen lexer and parser backends once,
+# then compiles whole files one after another; every file's output goes to its
+# own files, and what happened to each is collected into a summary at the end.
+
+# The lexer (for tokenizer.tokenize) and parse function (tokens -> parse tree)
+# of the backends main.py's --lexer and --parser name.
+def load_backends(lexer_name, parser_name):
+	if lexer_name == "dfa":
+		lexer = dfa_lexer.load_lexer()
+	elif lexer_name == "vectorized":
+		lexer = vectorized_lexer.VectorizedLexer()
+	else:
+		lexer = None
+	if parser_name == "compiled":
+		parse_tokens = load_compiled_parser().parse
+	elif parser_name == "lalr":
+		parse_tokens = partial(lalr.parse, lalr.load_tables())
+	else:
+		parse_tokens = partial(parse, program)
+	return lexer, parse_tokens
+
+# What compiling one file came to: the time spent in each stage (None for the
+# ones it didn't get to), and the error that stopped it, if any.
+class FileResult:
+	def __init__(self, path):
+		self.path = path
+		self.num_tokens = None
+		self.lex_time = None
+		self.parse_time = None
+		self.ast_time = None
+		self.error = None
+		self.cached = False
+
+# the backends and compile cache, in a worker process
+_lexer = None
+_parse_tokens = None
+_cache = None
+
+def _init_worker(lexer_name, parser_name, cache_dir):
+	global _lexer, _parse_tokens, _cache
+	_lexer, _parse_tokens = load_backends(lexer_name, parser_name)
+	_cache = None if cache_dir is None else compile_cache.CompileCache(cache_dir, lexer_name=lexer_name, parser_name=parser_name)
+
+# Where output of the given kind ('tokens', 'tree' or 'ast') for path goes:
+# next to it, or in output_dir if there is one.
+def output_path(path, kind, output_dir=None):
+	if output_dir is not None:
+		path = os.path.join(output_dir, os.path.basename(path))
+	return f"{path}.{kind}"
+
+# Compile path with the worker's backends, writing the outputs asked for.
+def _compile_file(path, outputs, output_dir, tokens_only):
+	result = FileResult(path)
+	try:
+		# nothing of the file's outlives this, so neither do the texts of
+		# its tokens in the intern table
+		with value_scope():
+			t0 = time.perf_counter()
+			with open(path) as f:
+				source = f.read()
+			cached = None if _cache is None else _cache.load(source)
+			if cached is not None and cached[1] is None and "tree" in outputs:
+				# stored by a compile that went straight to the AST
+				cached = None
+			if cached is not None:
+				result.cached = True
+				tokens, parse_tree, abstract_syntax_tree = cached
+			else:
+				tokens = tokenizer.tokenize(source, lexer=_lexer)
+				t1 = time.perf_counter()
+				result.lex_time = t1 - t0
+			result.num_tokens = len(tokens)
+			if "tokens" in outputs:
+				with open(output_path(path, "tokens", output_dir), "w") as f:
+					for token in tokens:
+						f.write(f"{token.typename} l:{token.line} c:{token.col} --- {token}\n")
+			if tokens_only:
+				return result
+
+			if cached is None:
+				t1 = time.perf_counter()
+				parse_tree = _parse_tokens(tokens)
+				t2 = time.perf_counter()
+				result.parse_time = t2 - t1
+				abstract_syntax_tree = None
+				try:
+					abstract_syntax_tree = to_ast(parse_tree)
+				finally:
+					if _cache is not None:
+						_cache.store(source, tokens, parse_tree, abstract_syntax_tree)
+				result.ast_time = time.perf_counter() - t2
+			elif abstract_syntax_tree is None:
+				abstract_syntax_tree = to_ast(parse_tree)
+			if "tree" in outputs:
+				with open(output_path(path, "tree", output_dir), "w") as f:
+					f.write(str(parse_tree))
+			if "ast" in outputs:
+				with open(output_path(path, "ast", output_dir), "w") as f:
+					f.write(str(abstract_syntax_tree))
+	except KeyboardInterrupt:
+		raise
+	except BaseException as e:
+		result.error = f"{type(e).__name__}: {e}"
+	return result
+
+# Compile every file in paths in jobs worker processes (in this one if jobs is
+# 1), and return their FileResults in the same order. outputs is a collection
+# of the kinds of output to write for each file. With a cache_dir, files are
+# looked up in (and added to) the compile cache there.
+def compile_files(paths, lexer_name="regex", parser_name="backtracking", jobs=1, outputs=(), output_dir=None, tokens_only=False, cache_dir=None):
+	compile_file = partial(_compile_file, outputs=frozenset(outputs), output_dir=output_dir, tokens_only=tokens_only)
+	if jobs <= 1:
+		_init_worker(lexer_name, parser_name, cache_dir)
+		return [compile_file(path) for path in paths]
+	with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(lexer_name, parser_name, cache_dir)) as pool:
+		return list(pool.map(compile_file, paths))
+
+# A table of the time each file took in each stage and how it ended, and the
+# totals.
+def format_summary(results, wall_time):
+	seconds = lambda t: "-" if t is None else f"{t:.3f}"
+	width = max([len("file")] + [len(r.path) for r in results])
+	lines = [f"{'file':<{width}}  {'tokens':>8}  {'lex s':>8}  {'parse s':>8}  {'ast s':>8}  status"]
+	failed = 0
+	for r in results:
+		if r.error is not None:
+			failed += 1
+		num_tokens = "-" if r.num_tokens is None else r.num_tokens
+		if r.error is not None:
+			status = r.error.splitlines()[0]
+		else:
+			status = "ok (cached)" if r.cached else "ok"
+		lines.append(f"{r.path:<{width}}  {num_tokens:>8}  {seconds(r.lex_time):>8}  {seconds(r.parse_time):>8}  {seconds(r.ast_time):>8}  {status}")
+	busy = sum((r.lex_time or 0) + (r.parse_time or 0) + (r.ast_time or 0) for r in results)
+	lines.append(f"{len(results)} files, {failed} failed, {wall_time:.2f}s wall, {busy:.2f}s compiling")
+	return "\n".join(lines)
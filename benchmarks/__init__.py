@@ -0,0 +1,2 @@
+# Benchmarks of the compiler's stages on generated programs; run them with
+# python -m benchmarks from the repository root.
@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import sys
+from benchmarks.generator import generate_program
+from benchmarks.harness import WORKLOADS, DEPTHS, CHAIN_LENGTHS, EDIT_SIZES, run_benchmarks, compare, check_edits, format_report
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+def main():
+	parser = argparse.ArgumentParser(description="Time tokenizing, parsing and building the AST of generated C programs, and measure the memory of their parse trees.")
+	parser.add_argument("--repeat", type=int, default=3, help="runs of each program; the best time counts")
+	parser.add_argument("--scale", type=float, default=1.0, help="multiply the size of every program by this")
+	parser.add_argument("--workload", action="append", choices=sorted(WORKLOADS), help="only run this workload (may be given several times)", dest="workloads")
+	parser.add_argument("--depth", type=int, action="append", help="run the nesting depth benchmark at this depth (may be given several times; default %s), before --scale" % ", ".join(map(str, DEPTHS)), dest="depths")
+	parser.add_argument("--chain-length", type=int, action="append", help="run the operator chain benchmark with this many operands (may be given several times; default %s), before --scale" % ", ".join(map(str, CHAIN_LENGTHS)), dest="chain_lengths")
+	parser.add_argument("--edit-size", type=int, action="append", help="run the edit latency benchmark on a program of this many functions (may be given several times; default %s), before --scale" % ", ".join(map(str, EDIT_SIZES)), dest="edit_sizes")
+	parser.add_argument("--json", help="write the results to this file", dest="json_path")
+	parser.add_argument("--baseline", help="compare against the results in this file and fail on a regression (default: benchmarks/baseline.json, skipped with a warning if there isn't one)")
+	parser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline file instead of comparing against it", dest="save_baseline")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="how much lower than the baseline a throughput may be, as a fraction (default 0.25)")
+	parser.add_argument("--write-sources", metavar="DIR", help="write the generated programs into DIR and exit", dest="sources_dir")
+	args = parser.parse_args()
+
+	workloads = WORKLOADS if args.workloads is None else {name: WORKLOADS[name] for name in args.workloads}
+	if args.sources_dir is not None:
+		os.makedirs(args.sources_dir, exist_ok=True)
+		for name, kwargs in workloads.items():
+			kwargs = dict(kwargs, functions=max(1, round(kwargs['functions'] * args.scale)))
+			with open(os.path.join(args.sources_dir, f"{name}.c"), "w") as f:
+				f.write(generate_program(**kwargs))
+		return
+
+	depths = DEPTHS if args.depths is None else args.depths
+	chain_lengths = CHAIN_LENGTHS if args.chain_lengths is None else args.chain_lengths
+	edit_sizes = EDIT_SIZES if args.edit_sizes is None else args.edit_sizes
+	results = run_benchmarks(workloads, args.repeat, args.scale, depths=depths, chain_lengths=chain_lengths, edit_sizes=edit_sizes, progress=lambda name: print(f"running {name}", file=sys.stderr))
+	print(format_report(results))
+	if args.json_path is not None:
+		with open(args.json_path, "w") as f:
+			json.dump(results, f, indent=1)
+
+	# an edit shouldn't take longer in a larger program, baseline or not
+	problems = check_edits(results)
+	for problem in problems:
+		print(f"REGRESSION: {problem}", file=sys.stderr)
+	if problems:
+		sys.exit(1)
+
+	baseline_path = DEFAULT_BASELINE if args.baseline is None else args.baseline
+	if args.save_baseline:
+		with open(baseline_path, "w") as f:
+			json.dump(results, f, indent=1)
+		print(f"saved the baseline to {baseline_path}", file=sys.stderr)
+	elif not os.path.exists(baseline_path):
+		# a baseline that was asked for by name has to be there
+		if args.baseline is not None:
+			sys.exit(f"error: there is no baseline at {baseline_path}")
+		print(f"warning: no baseline at {baseline_path}, so nothing was compared; make one with --save-baseline", file=sys.stderr)
+	else:
+		with open(baseline_path) as f:
+			baseline = json.load(f)
+		if baseline.get('scale') != results['scale']:
+			print(f"warning: the baseline was run at scale {baseline.get('scale')}", file=sys.stderr)
+		regressions = compare(results, baseline, args.tolerance)
+		for regression in regressions:
+			print(f"REGRESSION: {regression}", file=sys.stderr)
+		if regressions:
+			sys.exit(1)
+		print(f"no regressions against {baseline_path}", file=sys.stderr)
+
+if __name__ == "__main__":
+	main()
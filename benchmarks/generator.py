@@ -0,0 +1,89 @@
+import argparse
+import random
+
+# Random C programs in the subset grammar.py parses, at a chosen size and
+# nesting depth, for benchmarking without downloading real sources.
+
+# no shifts: the tokenizer splits << and >> (and <<=, >>=) into two tokens
+_BINARY_OPERATORS = ['+', '-', '*', '/', '%', '<', '>', '<=', '>=', '==', '!=', '&', '^', '|', '&&', '||']
+_UNARY_OPERATORS = ['-', '!', '~', '++', '--']
+_NESTING_UNARY_OPERATORS = ['-', '!', '~']
+_ASSIGNMENT_OPERATORS = ['=', '+=', '-=', '*=', '/=', '%=', '&=', '^=', '|=']
+_VARIABLES = 'abxyz'
+
+# Source of a program of functions function definitions of statements
+# expression statements each, whose expressions are up to expression_depth
+# operators deep; every function also has one expression statement wrapped in
+# nesting parentheses, one under a chain of unary_nesting unary operators, and
+# one that's a chain of chain_length operands joined by binary operators from
+# chain_operators (any of them by default).
+#
+# With ast_compatible, the program only uses what abstract_syntax_tree.py has
+# AST nodes for: no declarations (which it leaves out), function calls or
+# indexing. Otherwise
+# every function has a global variable declaration and a prototype before it
+# and a local variable declaration at the start.
+def generate_program(functions=100, statements=5, expression_depth=4, nesting=0, unary_nesting=0, chain_length=0, chain_operators=None, ast_compatible=False, seed=0):
+	rng = random.Random(seed)
+	out = []
+	for i in range(functions):
+		body = []
+		if not ast_compatible:
+			out.append(f'int g{i}, *p{i};')
+			out.append(f'int h{i}(int a, int *b);')
+			body.append('\tint q, *r;')
+		for _ in range(statements):
+			body.append(f'\t{_statement(rng, expression_depth, ast_compatible)}')
+		if nesting:
+			body.append(f'\tx = {"(" * nesting}{_expression(rng, 1, ast_compatible)}{")" * nesting};')
+		if unary_nesting:
+			# spaced, or the tokenizer would take two -s for --
+			operators = ' '.join(rng.choice(_NESTING_UNARY_OPERATORS) for _ in range(unary_nesting))
+			body.append(f'\tx = {operators} {_expression(rng, 1, ast_compatible)};')
+		if chain_length:
+			body.append(f'\tx = {_chain(rng, chain_length, chain_operators or _BINARY_OPERATORS)};')
+		out.append(f'int f{i}(int a, int b) {{\n' + '\n'.join(body) + '\n}')
+	return '\n'.join(out) + '\n'
+
+def _chain(rng, length, operators):
+	parts = [rng.choice(_VARIABLES)]
+	for _ in range(length - 1):
+		parts.append(rng.choice(operators))
+		parts.append(rng.choice(_VARIABLES))
+	return ' '.join(parts)
+
+def _statement(rng, depth, ast_compatible):
+	if rng.random() < 0.05:
+		return ';'
+	return f'{rng.choice(_VARIABLES)} {rng.choice(_ASSIGNMENT_OPERATORS)} {_expression(rng, depth, ast_compatible)};'
+
+def _expression(rng, depth, ast_compatible):
+	if depth <= 0 or rng.random() < 0.25:
+		r = rng.random()
+		if r < 0.5:
+			return rng.choice(_VARIABLES)
+		if r < 0.8:
+			return str(rng.randint(0, 99))
+		return rng.choice(_UNARY_OPERATORS) + rng.choice(_VARIABLES)
+	r = rng.random()
+	if r < 0.15:
+		return f'({_expression(rng, depth - 1, ast_compatible)})'
+	if not ast_compatible and r < 0.25:
+		return f'f{rng.randint(0, 9)}({_expression(rng, depth - 1, ast_compatible)}, {_expression(rng, depth - 1, ast_compatible)})'
+	if not ast_compatible and r < 0.3:
+		return f'{rng.choice(_VARIABLES)}[{_expression(rng, depth - 1, ast_compatible)}]'
+	return f'{_expression(rng, depth - 1, ast_compatible)} {rng.choice(_BINARY_OPERATORS)} {_expression(rng, depth - 1, ast_compatible)}'
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Write a random C program that grammar.py parses to stdout.")
+	parser.add_argument("--functions", type=int, default=100)
+	parser.add_argument("--statements", type=int, default=5, help="expression statements per function")
+	parser.add_argument("--depth", type=int, default=4, help="how many operators deep expressions go", dest="expression_depth")
+	parser.add_argument("--nesting", type=int, default=0, help="parentheses around one expression per function")
+	parser.add_argument("--unary-nesting", type=int, default=0, help="unary operators in front of one expression per function", dest="unary_nesting")
+	parser.add_argument("--chain-length", type=int, default=0, help="operands in one chain of binary operators per function", dest="chain_length")
+	parser.add_argument("--chain-operators", type=str.split, help="the binary operators the chains use, separated by spaces (default: all of them)", dest="chain_operators")
+	parser.add_argument("--ast-compatible", action="store_true", help="leave out declarations, calls and indexing, which the AST has no nodes for", dest="ast_compatible")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+	print(generate_program(**vars(args)), end='')
@@ -0,0 +1,437 @@
+import math
+import platform
+import statistics
+import time
+import tracemalloc
+import tokenizer
+from grammar import program
+from parser import parse
+from abstract_syntax_tree import to_ast
+from incremental import IncrementalParse
+from benchmarks.generator import generate_program
+
+# Timing the compiler's stages separately over generated programs: how many
+# tokens per second each stage gets through on a few kinds of program, how its
+# time grows with the size of the program, and whether that got worse since a
+# baseline run. The memory the parse tree takes up is measured too, how
+# deeply nested a program the stages get through, how they keep up with long
+# chains of binary operators, and how long an edit to a program being parsed
+# incrementally takes as the program grows.
+
+# parse_to_ast is parsing with the grammar's semantic actions, which builds the
+# AST without a parse tree: the work of parse and to_ast together
+STAGES = ('tokenize', 'parse', 'to_ast', 'parse_to_ast')
+
+# generate_program arguments of each workload, at scale 1
+WORKLOADS = {
+	# everything the grammar has: global and local declarations, prototypes,
+	# calls and indexing (which the AST has no nodes for yet)
+	'declarations': dict(functions=40, statements=5, expression_depth=4),
+	'deep_expressions': dict(functions=10, statements=5, expression_depth=7, ast_compatible=True),
+	'long_statement_lists': dict(functions=2, statements=300, expression_depth=2, ast_compatible=True),
+	'nesting': dict(functions=20, statements=2, expression_depth=2, nesting=40, ast_compatible=True),
+}
+
+# numbers of functions the scaling workload is run at, at scale 1
+SCALING_SIZES = (25, 50, 100, 200)
+SCALING_WORKLOAD = dict(statements=5, expression_depth=4, ast_compatible=True)
+
+# nesting depths the depth benchmark is run at, at scale 1, in each shape of
+# nesting: one expression in that many parentheses (a parse tree that deep, but
+# not an AST) and one behind that many unary operators (both that deep)
+DEPTHS = (1000, 10000, 100000)
+DEPTH_SHAPES = {
+	'parentheses': 'nesting',
+	'unary': 'unary_nesting',
+}
+DEPTH_STAGES = ('parse', 'to_ast', 'parse_to_ast', 'print')
+# every line of a printed tree is indented by its depth, so printing is
+# quadratic in the depth whatever does it; the AST is only printed up to this
+# depth
+PRINT_DEPTH = 10000
+
+# the binary operators of each precedence level the operator chain benchmark
+# strings together (no shifts: the tokenizer splits << and >> into two tokens)
+CHAIN_LEVELS = {
+	'multiplicative': ['*', '/', '%'],
+	'additive': ['+', '-'],
+	'relational': ['<', '>', '<=', '>='],
+	'equality': ['==', '!='],
+	'and': ['&'],
+	'xor': ['^'],
+	'or': ['|'],
+	'logical_and': ['&&'],
+	'logical_or': ['||'],
+}
+# operands in each chain, at scale 1
+CHAIN_LENGTHS = (1000, 10000)
+
+# numbers of functions the edit latency benchmark is run at, at scale 1, and
+# the generate_program arguments of the rest of its programs
+EDIT_SIZES = (50, 800)
+EDIT_WORKLOAD = dict(statements=5, expression_depth=4)
+# the function it types into, put in the middle of each program, so the same
+# declaration is parsed again whatever the size; typing digits onto the end of
+# its literal, and deleting them again, keeps the program valid throughout
+EDIT_FUNCTION = "int edited(int a) {\n\ta = 1;\n}\n"
+EDIT_KEYSTROKES = 200
+# how many times longer an edit may take in the largest program than in the
+# smallest before check_edits() fails it: the time taken by an edit shouldn't
+# depend on the size of the program
+EDIT_GROWTH_LIMIT = 2.0
+
+# Time each stage of compiling source, repeat times. Returns the number of
+# tokens and, for each stage, the best and median times; a stage that raised
+# has its error instead, and the stages that need its result are left out.
+def time_stages(source, repeat=3):
+	times = {stage: [] for stage in STAGES}
+	errors = {}
+	num_tokens = 0
+	def run(stage, f):
+		# a stage that raised once will again
+		if stage in errors:
+			return None
+		t0 = time.perf_counter()
+		try:
+			result = f()
+		except KeyboardInterrupt:
+			raise
+		# the parsers report syntax errors as bare BaseExceptions
+		except BaseException as e:
+			errors[stage] = f"{type(e).__name__}: {e}"
+			return None
+		times[stage].append(time.perf_counter() - t0)
+		return result
+	for _ in range(repeat):
+		tokens = run('tokenize', lambda: tokenizer.tokenize(source))
+		if tokens is None:
+			break
+		num_tokens = len(tokens)
+		tree = run('parse', lambda: parse(program, tokens))
+		if tree is not None:
+			run('to_ast', lambda: to_ast(tree))
+		run('parse_to_ast', lambda: parse(program, tokens, actions=True))
+
+	stages = {}
+	for stage in STAGES:
+		if stage in errors:
+			stages[stage] = {'error': errors[stage]}
+		elif times[stage]:
+			best = min(times[stage])
+			stages[stage] = {
+				'best': best,
+				'median': statistics.median(times[stage]),
+				'tokens_per_second': num_tokens / best if best > 0 else math.inf,
+			}
+	return {'tokens': num_tokens, 'stages': stages}
+
+# The memory parsing source takes, traced with tracemalloc in a run of its own
+# (tracing slows everything down): the number of nodes in the parse tree, the
+# bytes still allocated once it's built (the tree, its Tokens and anything else
+# the parse kept) and per node, and the peak while parsing. All relative to the
+# tokens, which are allocated beforehand.
+def measure_tree(source):
+	tokens = tokenizer.tokenize(source)
+	tracemalloc.start()
+	try:
+		tree = parse(program, tokens)
+		retained, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	nodes = 0
+	stack = [tree]
+	while stack:
+		node = stack.pop()
+		nodes += 1
+		stack.extend(node.children)
+	return {
+		'nodes': nodes,
+		'tree_bytes': retained,
+		'bytes_per_node': retained / nodes,
+		'peak_bytes': peak,
+	}
+
+# Time each stage of compiling source once (at these depths, once takes long
+# enough), printing the AST only with print_ast: the number of tokens and each
+# stage's time in seconds, or the error it raised, in which case the stages
+# that need its result are left out.
+def time_depth(source, print_ast=True):
+	tokens = tokenizer.tokenize(source)
+	stages = {}
+	def run(stage, f):
+		t0 = time.perf_counter()
+		try:
+			result = f()
+		except KeyboardInterrupt:
+			raise
+		except BaseException as e:
+			stages[stage] = {'error': f"{type(e).__name__}: {e}"}
+			return None
+		stages[stage] = {'seconds': time.perf_counter() - t0}
+		return result
+	tree = run('parse', lambda: parse(program, tokens))
+	ast = None if tree is None else run('to_ast', lambda: to_ast(tree))
+	# the tree mustn't be in memory twice
+	tree = None
+	run('parse_to_ast', lambda: parse(program, tokens, actions=True))
+	if ast is not None and print_ast:
+		run('print', lambda: str(ast))
+	return {'tokens': len(tokens), 'stages': stages}
+
+# Type keystrokes characters into EDIT_FUNCTION, put in the middle of source,
+# and delete them again, each an edit to an IncrementalParse. Returns the
+# number of tokens and the median and best seconds per edit.
+def time_edits(source, keystrokes=EDIT_KEYSTROKES):
+	middle = source.index('\n}\n', len(source) // 2) + 3
+	source = source[:middle] + EDIT_FUNCTION + source[middle:]
+	offset = middle + EDIT_FUNCTION.index('1;') + 1
+	incremental = IncrementalParse(source)
+	typed = keystrokes // 2
+	times = []
+	for k in range(keystrokes):
+		t0 = time.perf_counter()
+		if k < typed:
+			incremental.edit(offset + k, 0, str(k % 10))
+		else:
+			incremental.edit(offset + keystrokes - k - 1, 1, '')
+		times.append(time.perf_counter() - t0)
+	return {
+		'tokens': len(incremental.tokens),
+		'median': statistics.median(times),
+		'best': min(times),
+	}
+
+def _scaled(kwargs, scale):
+	kwargs = dict(kwargs)
+	kwargs['functions'] = max(1, round(kwargs['functions'] * scale))
+	return kwargs
+
+# Run every workload, the scaling workload at each size, the depth benchmark at
+# each depth, the operator chain benchmark at each length and the edit latency
+# benchmark at each size; scale multiplies the number of functions in all of
+# them, the depths and the lengths. Returns the results as plain data (what
+# --json and the baseline files hold).
+def run_benchmarks(workloads=WORKLOADS, repeat=3, scale=1.0, scaling_sizes=SCALING_SIZES, depths=DEPTHS, chain_lengths=CHAIN_LENGTHS, edit_sizes=EDIT_SIZES, progress=None):
+	results = {
+		'python': platform.python_version(),
+		'repeat': repeat,
+		'scale': scale,
+		'workloads': {},
+	}
+	for name, kwargs in workloads.items():
+		if progress is not None:
+			progress(name)
+		source = generate_program(**_scaled(kwargs, scale))
+		results['workloads'][name] = time_stages(source, repeat)
+		results['workloads'][name]['memory'] = measure_tree(source)
+
+	points = []
+	for size in scaling_sizes:
+		if progress is not None:
+			progress(f"scaling {size}")
+		kwargs = _scaled(dict(SCALING_WORKLOAD, functions=size), scale)
+		points.append(time_stages(generate_program(**kwargs), repeat))
+	results['scaling'] = {
+		'functions': [max(1, round(size * scale)) for size in scaling_sizes],
+		'points': points,
+		'exponents': {stage: _exponent(points, stage) for stage in STAGES},
+	}
+
+	depths = [max(1, round(depth * scale)) for depth in depths]
+	results['depth'] = {'depths': depths, 'shapes': {}}
+	for shape, argument in DEPTH_SHAPES.items():
+		points = []
+		for depth in depths:
+			if progress is not None:
+				progress(f"depth {shape} {depth}")
+			source = generate_program(functions=1, statements=0, ast_compatible=True, **{argument: depth})
+			points.append(time_depth(source, print_ast=depth <= PRINT_DEPTH))
+		results['depth']['shapes'][shape] = points
+
+	chain_lengths = [max(1, round(length * scale)) for length in chain_lengths]
+	results['chains'] = {'lengths': chain_lengths, 'levels': {}, 'exponents': {}}
+	for level, operators in CHAIN_LEVELS.items():
+		points = []
+		for length in chain_lengths:
+			if progress is not None:
+				progress(f"chain {level} {length}")
+			source = generate_program(functions=1, statements=0, chain_length=length, chain_operators=operators, ast_compatible=True)
+			points.append(time_stages(source, repeat))
+		results['chains']['levels'][level] = points
+		results['chains']['exponents'][level] = {stage: _exponent(points, stage) for stage in STAGES}
+
+	points = []
+	for size in edit_sizes:
+		if progress is not None:
+			progress(f"edits {size}")
+		kwargs = _scaled(dict(EDIT_WORKLOAD, functions=size), scale)
+		points.append(time_edits(generate_program(**kwargs)))
+	results['edits'] = {
+		'functions': [max(1, round(size * scale)) for size in edit_sizes],
+		'points': points,
+	}
+	return results
+
+# The slope of log(best time) against log(tokens) over the scaling points: 1
+# for a stage that's linear in the size of the program, 2 for quadratic.
+def _exponent(points, stage):
+	xs = []
+	ys = []
+	for point in points:
+		timing = point['stages'].get(stage, {})
+		if timing.get('best', 0) > 0:
+			xs.append(math.log(point['tokens']))
+			ys.append(math.log(timing['best']))
+	if len(xs) < 2:
+		return None
+	mean_x = sum(xs) / len(xs)
+	mean_y = sum(ys) / len(ys)
+	var = sum((x - mean_x) ** 2 for x in xs)
+	if var == 0:
+		return None
+	return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var
+
+# How the edit latency benchmark in results failed, if the median edit in its
+# largest program took more than limit times as long as in its smallest, as a
+# message (a list of it, like compare's).
+def check_edits(results, limit=EDIT_GROWTH_LIMIT):
+	points = results.get('edits', {}).get('points', [])
+	if len(points) < 2:
+		return []
+	smallest = min(points, key=lambda point: point['tokens'])
+	largest = max(points, key=lambda point: point['tokens'])
+	growth = largest['median'] / smallest['median']
+	if growth <= limit:
+		return []
+	return [f"edits: {largest['median'] * 1000:.2f} ms each in {largest['tokens']} tokens, "
+		f"{growth:.1f} times the {smallest['median'] * 1000:.2f} ms in {smallest['tokens']} (at most {limit} allowed)"]
+
+# The regressions in results against baseline: every stage of a workload or
+# operator chain whose throughput dropped by more than tolerance (a fraction),
+# or that worked in the baseline and fails now, and every stage at a nesting
+# depth that worked in the baseline and fails now, as a message.
+def compare(results, baseline, tolerance=0.25):
+	regressions = []
+	for name, old in baseline.get('workloads', {}).items():
+		new = results['workloads'].get(name)
+		if new is not None:
+			_compare_stages(name, old, new, tolerance, regressions)
+
+	old_chains = baseline.get('chains', {})
+	new_chains = results.get('chains', {})
+	for level, old_points in old_chains.get('levels', {}).items():
+		new_points = dict(zip(new_chains.get('lengths', []), new_chains.get('levels', {}).get(level, [])))
+		for length, old in zip(old_chains['lengths'], old_points):
+			new = new_points.get(length)
+			if new is not None:
+				_compare_stages(f"{level} chain of {length}", old, new, tolerance, regressions)
+
+	old_depth = baseline.get('depth', {})
+	new_depth = results.get('depth', {})
+	for shape, old_points in old_depth.get('shapes', {}).items():
+		new_points = dict(zip(new_depth.get('depths', []), new_depth.get('shapes', {}).get(shape, [])))
+		for depth, old in zip(old_depth['depths'], old_points):
+			new = new_points.get(depth)
+			if new is None:
+				continue
+			for stage, old_timing in old['stages'].items():
+				new_timing = new['stages'].get(stage, {})
+				if 'seconds' in old_timing and 'error' in new_timing:
+					regressions.append(f"{shape} nesting {depth} deep, {stage}: {new_timing['error']}")
+	return regressions
+
+# the regressions of one time_stages result against the baseline's, named name
+def _compare_stages(name, old, new, tolerance, regressions):
+	for stage, old_timing in old['stages'].items():
+		# stages that have since been removed
+		if stage not in STAGES or 'tokens_per_second' not in old_timing:
+			continue
+		new_timing = new['stages'].get(stage, {})
+		if 'tokens_per_second' not in new_timing:
+			regressions.append(f"{name} {stage}: {new_timing.get('error', 'not run')}")
+			continue
+		ratio = new_timing['tokens_per_second'] / old_timing['tokens_per_second']
+		if ratio < 1 - tolerance:
+			regressions.append(f"{name} {stage}: {new_timing['tokens_per_second']:.0f} tokens/s, "
+				f"{(1 - ratio) * 100:.0f}% below the baseline's {old_timing['tokens_per_second']:.0f}")
+
+def format_report(results):
+	lines = [f"{'workload':<22}{'tokens':>8}" + ''.join(f"{stage:>14}" for stage in STAGES) + "   (tokens/s, best of {})".format(results['repeat'])]
+	for name, result in results['workloads'].items():
+		row = f"{name:<22}{result['tokens']:>8}"
+		for stage in STAGES:
+			row += f"{_throughput(result['stages'].get(stage)):>14}"
+		lines.append(row)
+	for name, result in results['workloads'].items():
+		for stage, timing in result['stages'].items():
+			if 'error' in timing:
+				lines.append(f"{name} {stage}: {timing['error']}")
+
+	lines.append('')
+	lines.append(f"{'workload':<22}{'nodes':>10}{'tree KiB':>12}{'B/node':>10}{'peak KiB':>12}")
+	for name, result in results['workloads'].items():
+		memory = result['memory']
+		lines.append(f"{name:<22}{memory['nodes']:>10}{memory['tree_bytes'] / 1024:>12.1f}"
+			f"{memory['bytes_per_node']:>10.1f}{memory['peak_bytes'] / 1024:>12.1f}")
+
+	scaling = results['scaling']
+	lines.append('')
+	lines.append(f"{'functions':<12}{'tokens':>8}" + ''.join(f"{stage:>14}" for stage in STAGES) + "   (best seconds)")
+	for functions, point in zip(scaling['functions'], scaling['points']):
+		row = f"{functions:<12}{point['tokens']:>8}"
+		for stage in STAGES:
+			timing = point['stages'].get(stage, {})
+			row += f"{timing['best']:>14.4f}" if 'best' in timing else f"{'-':>14}"
+		lines.append(row)
+	row = f"{'exponent':<20}"
+	for stage in STAGES:
+		exponent = scaling['exponents'][stage]
+		row += f"{'-' if exponent is None else f'{exponent:.2f}':>14}"
+	lines.append(row)
+
+	depth = results.get('depth')
+	if depth is not None:
+		lines.append('')
+		lines.append(f"{'nesting':<12}{'depth':>8}{'tokens':>8}" + ''.join(f"{stage:>14}" for stage in DEPTH_STAGES) + "   (seconds)")
+		errors = []
+		for shape, points in depth['shapes'].items():
+			for d, point in zip(depth['depths'], points):
+				row = f"{shape:<12}{d:>8}{point['tokens']:>8}"
+				for stage in DEPTH_STAGES:
+					timing = point['stages'].get(stage, {})
+					row += f"{timing['seconds']:>14.4f}" if 'seconds' in timing else f"{'-':>14}"
+					if 'error' in timing:
+						errors.append(f"{shape} nesting {d} deep, {stage}: {timing['error']}")
+				lines.append(row)
+		lines.extend(errors)
+
+	chains = results.get('chains')
+	if chains is not None:
+		lines.append('')
+		lines.append(f"{'chain':<16}{'operands':>10}" + ''.join(f"{stage:>14}" for stage in STAGES) + "   (tokens/s)")
+		for level, points in chains['levels'].items():
+			for length, point in zip(chains['lengths'], points):
+				lines.append(f"{level:<16}{length:>10}" + ''.join(f"{_throughput(point['stages'].get(stage)):>14}" for stage in STAGES))
+			row = f"{'':<16}{'exponent':>10}"
+			for stage in STAGES:
+				exponent = chains['exponents'][level][stage]
+				row += f"{'-' if exponent is None else f'{exponent:.2f}':>14}"
+			lines.append(row)
+		for level, points in chains['levels'].items():
+			for length, point in zip(chains['lengths'], points):
+				for stage, timing in point['stages'].items():
+					if 'error' in timing:
+						lines.append(f"{level} chain of {length} {stage}: {timing['error']}")
+
+	edits = results.get('edits')
+	if edits is not None:
+		lines.append('')
+		lines.append(f"{'edits':<12}{'tokens':>8}{'median ms':>14}{'best ms':>14}")
+		for functions, point in zip(edits['functions'], edits['points']):
+			lines.append(f"{functions:<12}{point['tokens']:>8}{point['median'] * 1000:>14.3f}{point['best'] * 1000:>14.3f}")
+	return '\n'.join(lines)
+
+def _throughput(timing):
+	if timing is None or 'tokens_per_second' not in timing:
+		return '-'
+	return f"{timing['tokens_per_second']:.0f}"
@@ -0,0 +1,253 @@
+import base64
+import hashlib
+import json
+import os
+import sys
+import zlib
+from array import array
+from parser import ASTNode, encode_tree, decode_tree
+from parser_compiler import grammar_fingerprint
+from tolkien import TokenStream, LineIndex, intern_value, value_text
+
+# An on-disk cache of what compiling a source file produces: its tokens, parse
+# tree and AST, so compiling an unchanged file again skips all three. Compiles
+# that parse straight to the AST store no tree.
+#
+# Entries are keyed by a hash of the source, of the code that turns it into
+# those (so changing the grammar or the tokenizer makes every entry a miss) and
+# of the backends that did, one file per entry. A file is written under a
+# temporary name and renamed into place, so concurrent compiles never see a
+# partial entry, and reading an entry touches it, so when the cache grows past
+# its size bound the least recently used entries are the ones removed.
+#
+# Entries are JSON, with the token arrays and the flattened trees as base64
+# arrays of ints, rather than pickles, so that reading one from a cache
+# directory shared with others can't run code. One that doesn't decode is a
+# miss.
+#
+# Finding those takes going over the whole directory, so a CompileCache only
+# does that once the size it last found plus what it has stored since passes
+# the bound, and then removes entries until the cache is down to a quarter
+# below it; over many stores that's a few directory scans, not one per store.
+# (Another process storing entries in the meantime can take the cache past the
+# bound until one of them scans it again.)
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_DIR = os.path.join(_HERE, 'compile_cache')
+DEFAULT_MAX_BYTES = 256 << 20
+
+# the fraction of max_bytes eviction brings the cache down to
+_LOW_WATER = 0.75
+
+# everything the cached results depend on, besides the source
+_FINGERPRINT_SOURCES = ['tolkien.py', 'tokenizer.py', 'dfa_lexer.py', 'vectorized_lexer.py', 'grammar.py', 'parser.py', 'parser_compiler.py', 'lalr.py', 'parallel.py', 'abstract_syntax_tree.py', 'compile_cache.py']
+
+_SUFFIX = '.entry'
+
+# lexer_name and parser_name are the backends (main.py's --lexer and --parser)
+# whose results the cache holds: they don't always agree, so each pair has
+# entries of its own.
+class CompileCache:
+	def __init__(self, directory=DEFAULT_DIR, max_bytes=DEFAULT_MAX_BYTES, lexer_name="regex", parser_name="backtracking"):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.fingerprint = grammar_fingerprint(_FINGERPRINT_SOURCES)
+		self.backends = f'{lexer_name}\0{parser_name}\0'
+		# the size of the entries as of the last scan, plus the ones stored
+		# since; None until the first store scans the directory
+		self._size = None
+
+	def _path(self, source):
+		h = hashlib.sha256(self.fingerprint.encode())
+		h.update(self.backends.encode())
+		h.update(source.encode('utf-8', 'surrogatepass'))
+		return os.path.join(self.directory, h.hexdigest() + _SUFFIX)
+
+	# (tokens, parse tree, AST) for source if they're cached, else None. The
+	# AST is None if building it failed when the entry was stored, and the
+	# tree is None if the entry was stored without one.
+	def load(self, source):
+		path = self._path(source)
+		try:
+			with open(path, 'rb') as f:
+				entry = json.loads(zlib.decompress(f.read()))
+			tokens = _decode_tokens(source, entry['tokens'])
+			tree = None if entry['tree'] is None else decode_tree(_decode_items(entry['tree']), tokens)
+			ast = None if entry['ast'] is None else _decode_ast(_decode_items(entry['ast']))
+		except FileNotFoundError:
+			return None
+		except Exception:
+			# unreadable: truncated, written in an older format, or not an
+			# entry at all
+			return None
+		try:
+			os.utime(path)
+		except OSError:
+			pass
+		return tokens, tree, ast
+
+	# Cache the tokens, parse tree (or None) and AST (or None) of source.
+	# Failing to write the entry isn't an error.
+	def store(self, source, tokens, tree, ast):
+		entry = {
+			'tokens': _encode_tokens(tokens),
+			'tree': None if tree is None else _encode_items(encode_tree(tree)),
+			'ast': None if ast is None else _encode_items(_encode_ast(ast)),
+		}
+		path = self._path(source)
+		tmp_path = f'{path}.{os.getpid()}.tmp'
+		try:
+			os.makedirs(self.directory, exist_ok=True)
+			with open(tmp_path, 'wb') as f:
+				# trees encode to a lot of small, similar items
+				f.write(zlib.compress(json.dumps(entry, separators=(',', ':')).encode(), 1))
+				size = f.tell()
+			os.replace(tmp_path, path)
+			if self._size is None:
+				self._evict()
+			else:
+				self._size += size
+				if self._size > self.max_bytes:
+					self._evict()
+		except OSError:
+			# a cache that can't be written to is just one that misses
+			try:
+				os.remove(tmp_path)
+			except OSError:
+				pass
+
+	# If the cache is bigger than max_bytes, remove the least recently used
+	# entries until it's down to _LOW_WATER of that; either way, note how
+	# big it is.
+	def _evict(self):
+		entries = []
+		total = 0
+		with os.scandir(self.directory) as it:
+			for e in it:
+				if not e.name.endswith(_SUFFIX):
+					continue
+				try:
+					st = e.stat()
+				except FileNotFoundError:
+					continue
+				entries.append((st.st_mtime, st.st_size, e.path))
+				total += st.st_size
+		if total > self.max_bytes:
+			entries.sort()
+			for _, size, path in entries:
+				if total <= self.max_bytes * _LOW_WATER:
+					break
+				try:
+					os.remove(path)
+				except FileNotFoundError:
+					# another compile got to it first
+					pass
+				total -= size
+		self._size = total
+
+# An array as base64 of its items, little-endian.
+def _encode_array(a):
+	if sys.byteorder == 'big':
+		a = a[:]
+		a.byteswap()
+	return base64.b64encode(a.tobytes()).decode('ascii')
+
+def _decode_array(typecode, encoded):
+	a = array(typecode, base64.b64decode(encoded))
+	if sys.byteorder == 'big':
+		a.byteswap()
+	return a
+
+# A flat list of items like parser.encode_tree's or _encode_ast's, as an array
+# and a list of the names in it (a few long arrays, not many small lists,
+# which are slow to load): a token index as itself, None as -1, and a (name,
+# number of children) pair as -2 less the name's index in the list followed by
+# the number.
+def _encode_items(items):
+	names = {}
+	encoded = array('i')
+	for item in items:
+		if item is None:
+			encoded.append(-1)
+		elif isinstance(item, int):
+			encoded.append(item)
+		else:
+			name, num_children = item
+			name_index = names.get(name)
+			if name_index is None:
+				name_index = names[name] = len(names)
+			encoded.append(-2 - name_index)
+			encoded.append(num_children)
+	return {'names': list(names), 'items': _encode_array(encoded)}
+
+def _decode_items(encoded):
+	names = encoded['names']
+	items = []
+	it = iter(_decode_array('i', encoded['items']))
+	for item in it:
+		if item >= 0:
+			items.append(item)
+		elif item == -1:
+			items.append(None)
+		else:
+			items.append((names[-2 - item], next(it)))
+	return items
+
+# A TokenStream without its source: the arrays, with the value ids (which are
+# only meaningful in this process) as indexes into a list of the distinct
+# texts.
+def _encode_tokens(tokens):
+	tokens.settle()
+	distinct = {}
+	for value_id in tokens.values:
+		if value_id not in distinct:
+			distinct[value_id] = len(distinct)
+	return {
+		'kinds': _encode_array(tokens.kinds),
+		'starts': _encode_array(tokens.starts),
+		'ends': _encode_array(tokens.ends),
+		'matching': _encode_array(tokens.matching),
+		'texts': [value_text(value_id) for value_id in distinct],
+		'values': _encode_array(array('I', map(distinct.__getitem__, tokens.values))),
+		'newlines': _encode_array(tokens.lines.newlines),
+	}
+
+def _decode_tokens(source, encoded):
+	lines = LineIndex('')
+	lines.newlines = _decode_array('i', encoded['newlines'])
+	tokens = TokenStream(source, lines)
+	tokens.kinds = _decode_array('B', encoded['kinds'])
+	tokens.starts = _decode_array('i', encoded['starts'])
+	tokens.ends = _decode_array('i', encoded['ends'])
+	tokens.matching = _decode_array('i', encoded['matching'])
+	value_ids = [intern_value(text) for text in encoded['texts']]
+	tokens.values = array('I', map(value_ids.__getitem__, _decode_array('I', encoded['values'])))
+	return tokens
+
+# an AST as a flat list in preorder, like parser.encode_tree: a node as (name,
+# number of children), and None for the None children AST builders can leave
+def _encode_ast(node):
+	encoded = []
+	stack = [node]
+	while stack:
+		node = stack.pop()
+		if node is None:
+			encoded.append(None)
+		else:
+			encoded.append((node.name, len(node.children)))
+			stack.extend(reversed(node.children))
+	return encoded
+
+def _decode_ast(encoded):
+	stack = []
+	for item in reversed(encoded):
+		if item is None:
+			stack.append(None)
+			continue
+		name, num_children = item
+		children = stack[len(stack) - num_children:]
+		del stack[len(stack) - num_children:]
+		children.reverse()
+		stack.append(ASTNode(name=name, children=children))
+	return stack[0]
@@ -0,0 +1,513 @@
+import os
+import pickle
+import re
+import sys
+import time
+from parser_compiler import grammar_fingerprint
+from tolkien import TOKEN_DEFINITIONS, IGNORED_TYPES, KEYWORDS, LexError
+
+# A lexer generator: the regexes in tolkien.TOKEN_DEFINITIONS are compiled into
+# one deterministic finite automaton, so finding a token is a single pass over
+# its characters instead of re trying each alternative (and backtracking
+# through nested groups like the ('?[0-9])* of the integer literals) in turn.
+#
+# The automaton matches the longest token at each position, ties going to the
+# definition that comes first, and identifiers that are exactly a keyword are
+# reclassified afterwards. This is what the master regex does too, except that
+# it takes the first alternative that matches rather than the longest: e.g. it
+# reads 0x1F as the literal 0 followed by the identifier x1F.
+#
+# Only the regex syntax tolkien.py uses is supported:
+# - characters, escapes, ., \s and [...] classes; which characters each of
+#   these matches is decided by re itself, so the semantics are identical
+# - groups, including the (?i:...), (?s:...) and (?m:...) flag groups, |, and
+#   the *, +, ? and {n} / {n,m} quantifiers
+# - lazy quantifiers, which make the whole definition match the shortest token
+#   it can (as /\*(?s:.*?)\*/ stops at the first */)
+# - (?m:$), at the end of a definition only
+#
+# The tables are built over character classes: characters that every atom of
+# every definition treats alike share a class. They're computed for the first
+# 256 code points; any other character gets its class on first sight.
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+TABLES_PATH = os.path.join(_HERE, 'lexer_dfa.pickle')
+
+_FINGERPRINT_SOURCES = ['tolkien.py', 'dfa_lexer.py']
+
+_TABLE_CHARS = 256
+
+# regex syntax tree nodes
+_ATOM = 'atom'
+_EOL = 'eol'
+_CAT = 'cat'
+_ALT = 'alt'
+_REPEAT = 'repeat'
+
+# Parses one regex into a syntax tree of tuples:
+#   (_ATOM, index into atoms), (_EOL,), (_CAT, [nodes]), (_ALT, [nodes]),
+#   (_REPEAT, node, min, max or None)
+# atoms is shared between definitions and maps (pattern, flags) to an index.
+class _RegexParser:
+	def __init__(self, pattern, atoms):
+		self.pattern = pattern
+		self.pos = 0
+		self.atoms = atoms
+		self.lazy = False
+
+	def parse(self):
+		node = self._alternation(0)
+		if self.pos != len(self.pattern):
+			self._error("unbalanced )")
+		return node
+
+	def _error(self, message):
+		raise ValueError(f"{message} at {self.pos} in regex {self.pattern!r}")
+
+	def _peek(self):
+		if self.pos < len(self.pattern):
+			return self.pattern[self.pos]
+		return None
+
+	def _atom_node(self, pattern, flags):
+		key = (pattern, flags)
+		if key not in self.atoms:
+			self.atoms[key] = len(self.atoms)
+		return (_ATOM, self.atoms[key])
+
+	def _alternation(self, flags):
+		options = [self._sequence(flags)]
+		while self._peek() == '|':
+			self.pos += 1
+			options.append(self._sequence(flags))
+		return options[0] if len(options) == 1 else (_ALT, options)
+
+	def _sequence(self, flags):
+		items = []
+		while self._peek() not in (None, '|', ')'):
+			items.append(self._quantified(flags))
+		return (_CAT, items)
+
+	def _quantified(self, flags):
+		node = self._atom(flags)
+		while True:
+			c = self._peek()
+			if c == '*':
+				bounds = (0, None)
+			elif c == '+':
+				bounds = (1, None)
+			elif c == '?':
+				bounds = (0, 1)
+			elif c == '{':
+				end = self.pattern.find('}', self.pos)
+				if end == -1:
+					self._error("unterminated {")
+				low, comma, high = self.pattern[self.pos + 1:end].partition(',')
+				if comma:
+					bounds = (int(low), int(high) if high else None)
+				else:
+					bounds = (int(low), int(low))
+				self.pos = end
+			else:
+				return node
+			self.pos += 1
+			if self._peek() == '?':
+				self.pos += 1
+				self.lazy = True
+			if node[0] == _EOL:
+				self._error("quantified $")
+			node = (_REPEAT, node, bounds[0], bounds[1])
+
+	def _atom(self, flags):
+		c = self._peek()
+		start = self.pos
+		self.pos += 1
+		if c == '(':
+			if self._peek() == '?':
+				end = self.pattern.find(':', self.pos)
+				group_flags = self.pattern[self.pos + 1:end]
+				for flag in group_flags:
+					if flag == 'i':
+						flags |= re.IGNORECASE
+					elif flag == 's':
+						flags |= re.DOTALL
+					elif flag == 'm':
+						flags |= re.MULTILINE
+					else:
+						self._error(f"unsupported group (?{group_flags}")
+				self.pos = end + 1
+			node = self._alternation(flags)
+			if self._peek() != ')':
+				self._error("missing )")
+			self.pos += 1
+			return node
+		if c == '[':
+			# find the closing ], which can't be the first character of
+			# the class
+			if self._peek() == '^':
+				self.pos += 1
+			self.pos += 1
+			while self._peek() != ']':
+				if self._peek() is None:
+					self._error("unterminated [")
+				self.pos += 2 if self._peek() == '\\' else 1
+			self.pos += 1
+			return self._atom_node(self.pattern[start:self.pos], flags & re.IGNORECASE)
+		if c == '\\':
+			self.pos += 1
+			return self._atom_node(self.pattern[start:self.pos], flags & re.IGNORECASE)
+		if c == '.':
+			return self._atom_node('.', flags & re.DOTALL)
+		if c == '$':
+			if not flags & re.MULTILINE:
+				self._error("$ is only supported as (?m:$)")
+			return (_EOL,)
+		if c in ('*', '+', '?', '{', '^', ')', '|'):
+			self._error(f"unsupported {c}")
+		return self._atom_node(re.escape(c), flags & re.IGNORECASE)
+
+# Thompson construction of one NFA for all the definitions. Each state has a
+# list of (label, target) edges, the label being an atom index, None for an
+# epsilon edge, or _EOL for the end of line assertion.
+class _NFA:
+	def __init__(self):
+		self.edges = []
+		# state -> index of the definition it accepts
+		self.accepting = {}
+
+	def state(self):
+		self.edges.append([])
+		return len(self.edges) - 1
+
+	def build(self, node):
+		start = self.state()
+		end = self.state()
+		kind = node[0]
+		if kind == _ATOM:
+			self.edges[start].append((node[1], end))
+		elif kind == _EOL:
+			self.edges[start].append((_EOL, end))
+		elif kind == _CAT:
+			current = start
+			for item in node[1]:
+				s, e = self.build(item)
+				self.edges[current].append((None, s))
+				current = e
+			self.edges[current].append((None, end))
+		elif kind == _ALT:
+			for option in node[1]:
+				s, e = self.build(option)
+				self.edges[start].append((None, s))
+				self.edges[e].append((None, end))
+		else:
+			_, body, low, high = node
+			current = start
+			for _ in range(low):
+				s, e = self.build(body)
+				self.edges[current].append((None, s))
+				current = e
+			if high is None:
+				s, e = self.build(body)
+				self.edges[current].append((None, s))
+				self.edges[e].append((None, s))
+				self.edges[e].append((None, end))
+			else:
+				for _ in range(high - low):
+					s, e = self.build(body)
+					self.edges[current].append((None, s))
+					self.edges[current].append((None, end))
+					current = e
+			self.edges[current].append((None, end))
+		return start, end
+
+	def closure(self, states):
+		stack = list(states)
+		seen = set(states)
+		while stack:
+			for label, target in self.edges[stack.pop()]:
+				if label is None and target not in seen:
+					seen.add(target)
+					stack.append(target)
+		return frozenset(seen)
+
+# Which atoms the character c matches, as a tuple of booleans.
+def _signature(atom_regexes, c):
+	return tuple(regex.fullmatch(c) is not None for regex in atom_regexes)
+
+class DFATables:
+	def __init__(self, typenames, transitions, class_transitions, accepting, eol_accepting,
+		     skips, atoms, signatures):
+		# the definitions' typenames, in order
+		self.typenames = typenames
+		# state -> {character: next state}, for the first 256 code points
+		self.transitions = transitions
+		# state -> [next state or -1, per character class]
+		self.class_transitions = class_transitions
+		# state -> typename it accepts, or None
+		self.accepting = accepting
+		# state -> typename it accepts if the next character is a newline
+		# or there is none, or None
+		self.eol_accepting = eol_accepting
+		# state -> regex matching a run of characters that loop back to the
+		# state, or None
+		self.skips = skips
+		# (pattern, flags) of every atom, for classifying new characters
+		self.atoms = atoms
+		# atom signature -> character class
+		self.signatures = signatures
+
+def build_tables(definitions=TOKEN_DEFINITIONS):
+	atoms = {}
+	trees = []
+	lazy = []
+	for typename, pattern in definitions:
+		parser = _RegexParser(pattern, atoms)
+		trees.append(parser.parse())
+		lazy.append(parser.lazy)
+	atom_list = sorted(atoms, key=atoms.get)
+	atom_regexes = [re.compile(pattern, flags) for pattern, flags in atom_list]
+
+	# character classes
+	signatures = {}
+	char_classes = []
+	for code in range(_TABLE_CHARS):
+		sig = _signature(atom_regexes, chr(code))
+		char_classes.append(signatures.setdefault(sig, len(signatures)))
+	class_sigs = sorted(signatures, key=signatures.get)
+
+	nfa = _NFA()
+	start = nfa.state()
+	for i, tree in enumerate(trees):
+		s, e = nfa.build(tree)
+		nfa.edges[start].append((None, s))
+		nfa.accepting[e] = i
+
+	# subset construction
+	initial = nfa.closure([start])
+	dfa_states = {initial: 0}
+	pending = [initial]
+	class_transitions = []
+	accepting = []
+	eol_accepting = []
+	while pending:
+		states = pending.pop(0)
+		accepts = [nfa.accepting[s] for s in states if s in nfa.accepting]
+		accept = min(accepts) if accepts else None
+		after_eol = nfa.closure([t for s in states for label, t in nfa.edges[s] if label == _EOL])
+		for s in after_eol:
+			for label, _ in nfa.edges[s]:
+				if label is not None:
+					raise ValueError("(?m:$) is only supported at the end of a definition")
+		eol_accepts = [nfa.accepting[s] for s in after_eol if s in nfa.accepting]
+		eol_accept = min(eol_accepts) if eol_accepts else None
+		if eol_accept is not None and accept is not None and accept < eol_accept:
+			eol_accept = None
+		accepting.append(definitions[accept][0] if accept is not None else None)
+		eol_accepting.append(definitions[eol_accept][0] if eol_accept is not None else None)
+
+		row = []
+		# a lazy definition stops at its first (unconditional) match
+		if accept is not None and lazy[accept]:
+			row = [-1] * len(class_sigs)
+		else:
+			for sig in class_sigs:
+				targets = [t for s in states for label, t in nfa.edges[s]
+					   if label is not None and label != _EOL and sig[label]]
+				if not targets:
+					row.append(-1)
+					continue
+				target = nfa.closure(targets)
+				if target not in dfa_states:
+					dfa_states[target] = len(dfa_states)
+					pending.append(target)
+				row.append(dfa_states[target])
+		class_transitions.append(row)
+
+	transitions = []
+	skips = []
+	for state, row in enumerate(class_transitions):
+		transitions.append({chr(code): row[cls] for code, cls in enumerate(char_classes) if row[cls] != -1})
+		loop = [chr(code) for code, cls in enumerate(char_classes) if row[cls] == state]
+		# only worth a regex call if the state can loop over a whole run of
+		# different characters
+		if len(loop) > 1:
+			skips.append('[' + ''.join(re.escape(c) for c in loop) + ']*')
+		else:
+			skips.append(None)
+
+	return DFATables([typename for typename, _ in definitions], transitions, class_transitions,
+			 accepting, eol_accepting, skips, atom_list, signatures)
+
+# Scans source with DFATables; its scan() can be passed to tokenizer.tokenize
+# as the lexer.
+class DFALexer:
+	def __init__(self, tables):
+		self.tables = tables
+		self.atom_regexes = [re.compile(pattern, flags) for pattern, flags in tables.atoms]
+		self.skips = [re.compile(skip).match if skip is not None else None for skip in tables.skips]
+
+	# the DFA state reached from state on a character past the first 256
+	def _step_class(self, state, c):
+		sig = _signature(self.atom_regexes, c)
+		if sig not in self.tables.signatures:
+			raise Exception(f"character {c!r} isn't in any character class of the lexer tables")
+		return self.tables.class_transitions[state][self.tables.signatures[sig]]
+
+	# The longest token at pos, as (typename, end), or (None, pos) if there
+	# is none.
+	def match(self, source, pos):
+		transitions = self.tables.transitions
+		accepting = self.tables.accepting
+		eol_accepting = self.tables.eol_accepting
+		skips = self.skips
+		n = len(source)
+		state = 0
+		p = pos
+		found = None
+		end = pos
+		while True:
+			skip = skips[state]
+			if skip is not None:
+				p = skip(source, p).end()
+			typename = accepting[state]
+			if typename is not None:
+				found = typename
+				end = p
+			typename = eol_accepting[state]
+			if typename is not None and (p == n or source[p] == '\n'):
+				found = typename
+				end = p
+			if p == n:
+				break
+			c = source[p]
+			next_state = transitions[state].get(c)
+			if next_state is None:
+				if ord(c) < _TABLE_CHARS:
+					break
+				next_state = self._step_class(state, c)
+				if next_state == -1:
+					break
+			state = next_state
+			p += 1
+		return found, end
+
+	# Yields (typename, text, start) like tokenizer._scan_regex, including
+	# its error for text that isn't a token. The loop of match() is inlined
+	# here, since it runs for every token.
+	def scan(self, source, lines, pos=0):
+		transitions = self.tables.transitions
+		accepting = self.tables.accepting
+		eol_accepting = self.tables.eol_accepting
+		skips = self.skips
+		n = len(source)
+		while pos < n:
+			state = 0
+			p = pos
+			found = None
+			end = pos
+			while True:
+				skip = skips[state]
+				if skip is not None:
+					p = skip(source, p).end()
+				typename = accepting[state]
+				if typename is not None:
+					found = typename
+					end = p
+				typename = eol_accepting[state]
+				if typename is not None and (p == n or source[p] == '\n'):
+					found = typename
+					end = p
+				if p == n:
+					break
+				c = source[p]
+				next_state = transitions[state].get(c)
+				if next_state is None:
+					if ord(c) < _TABLE_CHARS:
+						break
+					next_state = self._step_class(state, c)
+					if next_state == -1:
+						break
+				state = next_state
+				p += 1
+
+			if found is None:
+				# like re.search, find where the next token starts
+				start = pos + 1
+				while start < n:
+					found, end = self.match(source, start)
+					if found is not None:
+						break
+					start += 1
+				else:
+					return
+				line, col = lines.linecol(end)
+				raise LexError(f"found something that doesn't look like a token at l:{line} c:{col}:\n"+\
+					f"{source[pos:start]}")
+			if found not in IGNORED_TYPES:
+				text = source[pos:end]
+				if found == 'identifier' and text in KEYWORDS:
+					found = 'keyword'
+				yield found, text, pos
+			pos = end
+
+# Return a DFALexer for tolkien.TOKEN_DEFINITIONS, building its tables first if
+# there's no up-to-date copy at path.
+def load_lexer(path=TABLES_PATH):
+	fingerprint = grammar_fingerprint(_FINGERPRINT_SOURCES)
+	if os.path.exists(path):
+		with open(path, 'rb') as f:
+			cached = pickle.load(f)
+		if cached.get('fingerprint') == fingerprint:
+			return DFALexer(DFATables(**cached['tables']))
+
+	tables = build_tables()
+	# write to a temporary file first so a concurrent build never reads half
+	# a table
+	tmp_path = f'{path}.{os.getpid()}.tmp'
+	with open(tmp_path, 'wb') as f:
+		pickle.dump({'fingerprint': fingerprint, 'tables': vars(tables)}, f, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp_path, path)
+	return DFALexer(tables)
+
+# Inputs the master regex is slow on, each about size characters.
+def _pathological_inputs(size):
+	return {
+		'digit separators': "int x = " + "1'" * (size // 2) + "1;\n",
+		'long identifier': "int " + "a" * size + ";\n",
+		'long string': 'char *s = "' + "ab " * (size // 3) + '";\n',
+		'long comment': "/* " + "x * y / z " * (size // 10) + "*/\n",
+	}
+
+# Throughput of tokenizing the given files and some pathological inputs, in
+# MB/s (of source characters), with each of lexers (name -> lexer argument of
+# tokenizer.tokenize); by default the master regex and the DFA.
+def benchmark(paths, lexers=None, repeat=3, size=1 << 20):
+	import tokenizer
+	if lexers is None:
+		lexers = {'regex': None, 'dfa': load_lexer()}
+	inputs = {}
+	for path in paths:
+		with open(path) as f:
+			inputs[path] = f.read()
+	inputs.update(_pathological_inputs(size))
+
+	print(f"{'input':<24} {'MB':>7}" + ''.join(f" {name + ' MB/s':>16}" for name in lexers))
+	for name, source in inputs.items():
+		rates = []
+		for lex in lexers.values():
+			best = None
+			for _ in range(repeat):
+				t = time.perf_counter()
+				tokenizer.tokenize(source, lexer=lex)
+				elapsed = time.perf_counter() - t
+				best = elapsed if best is None else min(best, elapsed)
+			rates.append(len(source) / 1e6 / best)
+		print(f"{name:<24} {len(source) / 1e6:>7.2f}" + ''.join(f" {rate:>16.2f}" for rate in rates))
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1 and sys.argv[1] == '--tables':
+		tables = load_lexer().tables
+		print(f"{len(tables.accepting)} states, {len(tables.signatures)} character classes")
+	else:
+		benchmark(sys.argv[1:])
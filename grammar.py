@@ -1,5 +1,12 @@
 from parser import Rule, Reduction, OptionalReduction, RepetitionReduction, parse
+from parser import PrecedenceRule, OperatorLevel
+from parser import compute_first_sets
 from parser import Nonterminal
+# semantic actions, for parse(..., actions=True) to build the AST with
+from abstract_syntax_tree import action_identifier, action_literal, action_parenthesized
+from abstract_syntax_tree import action_postfix_expr, action_unary_expr, action_binary_expr
+from abstract_syntax_tree import action_assignment_expr, action_expression, action_expression_statement
+from abstract_syntax_tree import action_compound_statement, action_function_definition, action_program
 from tolkien import *
 from tokenizer import tokenize
 
@@ -38,9 +45,9 @@ assignment_expression = Rule('assignment_expression')
 
 primary_expression = Rule('primary_expression')
 primary_expression.reductions += [
-    Reduction(TYPES.IDENTIFIER),
-    Reduction(TYPES.LITERAL),
-    Reduction('(', expression, ')'),
+    Reduction(TYPES.IDENTIFIER, action=action_identifier),
+    Reduction(TYPES.LITERAL, action=action_literal),
+    Reduction('(', expression, ')', action=action_parenthesized),
 ]
 
 postfix_tail = Rule('postfix_tail')
@@ -56,7 +63,7 @@ postfix_tail.reductions += [
               
 postfix_expression = Rule('postfix_expression')
 postfix_expression.reductions += [
-    Reduction(primary_expression, RepetitionReduction(postfix_tail)),
+    Reduction(primary_expression, RepetitionReduction(postfix_tail), action=action_postfix_expr),
 ]
 
 unary_op = Rule('unary_op')
@@ -74,116 +81,27 @@ unary_op.reductions += [
 unary_expression = Rule('unary_expression')
 unary_expression.reductions += [
     Reduction(postfix_expression),
-    Reduction(unary_op, unary_expression),
-]
-
-multiplicative_tail = Rule('multiplicative_tail')
-multiplicative_tail.reductions += [
-    Reduction('*', unary_expression),
-    Reduction('/', unary_expression),
-    Reduction('%', unary_expression),
-]
-
-multiplicative_expression = Rule('multiplicative_expression')
-multiplicative_expression.reductions += [
-    Reduction(unary_expression, RepetitionReduction(multiplicative_tail)),
-]
-
-additive_tail = Rule('additive_tail')
-additive_tail.reductions += [
-    Reduction('+', multiplicative_expression),
-    Reduction('-', multiplicative_expression),
-]
-
-additive_expression = Rule('additive_expression')
-additive_expression.reductions += [
-    Reduction(multiplicative_expression, RepetitionReduction(additive_tail)),
-]
-
-shift_tail = Rule('shift_tail')
-shift_tail.reductions += [
-    Reduction('<<', additive_expression),
-    Reduction('>>', additive_expression),
-]
-
-shift_expression = Rule('shift_expression')
-shift_expression.reductions += [
-    Reduction(additive_expression, RepetitionReduction(shift_tail)),
-]
-
-relational_tail = Rule('relational_tail')
-relational_tail.reductions += [
-    Reduction('<', shift_expression),
-    Reduction('>', shift_expression),
-    Reduction('<=', shift_expression),
-    Reduction('>=', shift_expression),
-]
-
-relational_expression = Rule('relational_expression')
-relational_expression.reductions += [
-    Reduction(shift_expression, RepetitionReduction(relational_tail)),
-]
-
-equality_tail = Rule('equality_tail')
-equality_tail.reductions += [
-    Reduction('==', relational_expression),
-    Reduction('!=', relational_expression),
-]
-
-equality_expression = Rule('equality_expression')
-equality_expression.reductions += [
-    Reduction(relational_expression, RepetitionReduction(equality_tail)),
-]
-
-and_tail = Rule('and_tail')
-and_tail.reductions += [
-    Reduction('&', equality_expression),
-]
-
-and_expression = Rule('and_expression')
-and_expression.reductions += [
-    Reduction(equality_expression, RepetitionReduction(and_tail)),
-]
-
-xor_tail = Rule('xor_tail')
-xor_tail.reductions += [
-    Reduction('^', and_expression),
-]
-
-xor_expression = Rule('xor_expression')
-xor_expression.reductions += [
-    Reduction(and_expression, RepetitionReduction(xor_tail)),
-]
-
-or_tail = Rule('or_tail')
-or_tail.reductions += [
-    Reduction('|', xor_expression),
-]
-
-or_expression = Rule('or_expression')
-or_expression.reductions += [
-    Reduction(xor_expression, RepetitionReduction(or_tail)),
-]
-
-logical_and_tail = Rule('logical_and_tail')
-logical_and_tail.reductions += [
-    Reduction('&&', or_expression),
-]
-
-logical_and_expression = Rule('logical_and_expression')
-logical_and_expression.reductions += [
-    Reduction(or_expression, RepetitionReduction(logical_and_tail)),
-]
-
-logical_or_tail = Rule('logical_or_tail')
-logical_or_tail.reductions += [
-    Reduction('||', logical_and_expression),
-]
-
-logical_or_expression = Rule('logical_or_expression')
-logical_or_expression.reductions += [
-    Reduction(logical_and_expression, RepetitionReduction(logical_or_tail)),
-]
+    Reduction(unary_op, unary_expression, action=action_unary_expr),
+]
+
+# All binary operators, from loosest to tightest binding. Each level matches
+# like the rule pair
+#   <*_expression> ::= <tighter expression> { <*_tail> }
+#   <*_tail> ::= <op> <tighter expression>
+# with unary_expression as the tightest operand, but is parsed in one pass by
+# precedence climbing.
+logical_or_expression = PrecedenceRule('logical_or_expression', unary_expression, [
+    OperatorLevel('logical_or_expression', 'logical_or_tail', 1, ['||']),
+    OperatorLevel('logical_and_expression', 'logical_and_tail', 2, ['&&']),
+    OperatorLevel('or_expression', 'or_tail', 3, ['|']),
+    OperatorLevel('xor_expression', 'xor_tail', 4, ['^']),
+    OperatorLevel('and_expression', 'and_tail', 5, ['&']),
+    OperatorLevel('equality_expression', 'equality_tail', 6, ['==', '!=']),
+    OperatorLevel('relational_expression', 'relational_tail', 7, ['<', '>', '<=', '>=']),
+    OperatorLevel('shift_expression', 'shift_tail', 8, ['<<', '>>']),
+    OperatorLevel('additive_expression', 'additive_tail', 9, ['+', '-']),
+    OperatorLevel('multiplicative_expression', 'multiplicative_tail', 10, ['*', '/', '%']),
+], action=action_binary_expr)
 
 assignment_op = Rule('assignment_op')
 assignment_op.reductions += [
@@ -202,16 +120,16 @@ assignment_op.reductions += [
 
 assignment_expression.reductions += [
     Reduction(logical_or_expression),
-    Reduction(unary_expression, assignment_op, assignment_expression),
+    Reduction(unary_expression, assignment_op, assignment_expression, action=action_assignment_expr),
 ]
 
 expression.reductions += [
-    Reduction(assignment_expression, RepetitionReduction(',', assignment_expression)),
+    Reduction(assignment_expression, RepetitionReduction(',', assignment_expression), action=action_expression),
 ]
 
 expression_statement = Rule('expression_statement')
 expression_statement.reductions += [
-    Reduction(OptionalReduction(expression), ';'),
+    Reduction(OptionalReduction(expression), ';', action=action_expression_statement),
 ]
 
 statement = Rule('statement')
@@ -231,7 +149,7 @@ declaration.reductions += [
 
 compound_statement = Rule('compound_statement')
 compound_statement.reductions += [
-    Reduction('{', RepetitionReduction(declaration), RepetitionReduction(statement), '}'),
+    Reduction('{', RepetitionReduction(declaration), RepetitionReduction(statement), '}', action=action_compound_statement),
 ]
 
 parameter_list = Rule('parameter_list')
@@ -246,7 +164,7 @@ function_decl.reductions += [
 
 function_definition = Rule('function_definition')
 function_definition.reductions += [
-    Reduction(function_decl, compound_statement)
+    Reduction(function_decl, compound_statement, action=action_function_definition)
 ]
 
 top_level_decl = Rule('top_level_decl')
@@ -258,7 +176,7 @@ top_level_decl.reductions += [
 
 program = Rule('program')
 program.reductions += [
-    Reduction(RepetitionReduction(top_level_decl)),
+    Reduction(RepetitionReduction(top_level_decl), action=action_program),
 ]
 
-
+compute_first_sets(program)
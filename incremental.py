@@ -0,0 +1,209 @@
+from array import array
+import tokenizer
+from tolkien import bisect_offsets, splice_offsets
+from grammar import program, top_level_decl
+from parser import parse, drive, Terminal, ASTNode
+from abstract_syntax_tree import to_ast
+
+# Incremental parsing for editors: a source file's tokens, parse tree and AST,
+# kept up to date through edits by redoing only the top-level declarations an
+# edit touches.
+#
+# The parse tree is the program Nonterminal parse() returns, whose children
+# are the top_level_decl subtrees. After an edit (re-lexed with
+# tokenizer.retokenize) the declarations overlapping the re-lexed tokens, and
+# the ones on either side in case a boundary moved, are parsed again and
+# spliced into the tree in place of the old ones; if they don't parse as a
+# run of declarations covering the same tokens, the whole file is parsed
+# again. Each declaration's AST is built only when ast() is first asked for
+# after it was parsed.
+#
+# Nothing done for an edit goes over the whole file. Each edit makes a new
+# token stream out of the arrays of the old one (see tokenizer.retokenize),
+# and the Tokens of the declarations kept only move over to it when they're
+# read (see tolkien.Token). The streams left behind are emptied, so each
+# costs a few objects rather than a copy of the source; when there are more
+# of them than tokens, all of the tree's Tokens are moved to the latest
+# stream at once, which spread over the edits that left them behind is a
+# small cost for each. The token index each declaration starts at is stored
+# the way token offsets are (see tolkien.bisect_offsets), from a gap on
+# owing a shift.
+#
+# An edit can leave text that isn't a token, like a string literal whose
+# closing quote hasn't been typed yet. The edited source is kept on its own
+# then, and the edit after it tokenizes all of it again.
+
+# placeholder for a declaration whose AST hasn't been built
+_UNBUILT = object()
+
+class IncrementalParse:
+	def __init__(self, source, lexer=None):
+		self.lexer = lexer
+		self.tokens = tokenizer.tokenize(source, lexer=lexer)
+		# the source, if it couldn't be tokenized (and tokens is None)
+		self._unlexed = None
+		# the program Nonterminal; spans[k] is the index of the first token
+		# of its k-th declaration, and spans[-1] the number of tokens, the
+		# ones from _span_gap on owing _span_shift
+		self.tree = None
+		self.spans = None
+		self._reparse()
+
+	@property
+	def source(self):
+		if self._unlexed is not None:
+			return self._unlexed
+		return self.tokens.source
+
+	# Replace deleted characters at offset with inserted, and update the
+	# tokens and parse tree (in place: the same program Nonterminal gets the
+	# new declarations). Returns the range of declarations (in the updated
+	# tree) that were parsed again.
+	#
+	# If the edited source doesn't parse, this raises like parse() does (or a
+	# tokenizer.BracketError if its brackets don't pair up); the tokens are
+	# still updated, and the tree is None until an edit makes the source
+	# parse again. If it doesn't tokenize, this raises a tokenizer.LexError;
+	# the source is still updated, and the tokens and tree are None until an
+	# edit makes it tokenize again.
+	def edit(self, offset, deleted, inserted):
+		if self._unlexed is not None:
+			return self._retokenize_all(offset, deleted, inserted)
+		try:
+			tokens, first, old_stop, new_stop = tokenizer.retokenize(self.tokens, offset, deleted, inserted, lexer=self.lexer, reuse=True)
+		except tokenizer.BracketError as e:
+			self.tokens = e.tokens
+			self.tree = None
+			raise
+		except tokenizer.LexError as e:
+			self._unlexed = e.source
+			self.tokens = self.tree = None
+			raise
+		self.tokens = tokens
+		if self.tree is None:
+			return self._reparse()
+
+		spans = self.spans
+		gap = self._span_gap
+		span_shift = self._span_shift
+		shift = new_stop - old_stop
+		num_decls = len(spans) - 1
+		# the declarations holding the tokens just before and just after
+		# the re-lexed ones, and everything in between
+		low = max(bisect_offsets(spans, gap, span_shift, first - 1) - 1, 0)
+		high = max(min(bisect_offsets(spans, gap, span_shift, old_stop) - 1, num_decls - 1), low - 1)
+		start = _span(spans, gap, span_shift, low)
+		stop = _span(spans, gap, span_shift, high + 1) + shift if high >= low else len(tokens)
+		decls = _parse_declarations(tokens, start, stop)
+		if decls is None:
+			# a boundary moved further than a declaration, or it's a
+			# syntax error: either way it takes a full parse to tell
+			return self._reparse()
+
+		self.tree.children[low:high + 1] = decls
+		self.tree.num_terminals = len(tokens)
+		splice_offsets(spans, gap, span_shift, low, high + 1, array('i', _spans(decls, start)[:-1]))
+		self._span_gap = low + len(decls)
+		self._span_shift = span_shift + shift
+		self._asts[low:high + 1] = [_UNBUILT] * len(decls)
+
+		self._streams_behind += 1
+		if self._streams_behind > len(tokens):
+			for token in _terminal_tokens(self.tree):
+				token.follow_edits()
+			self._streams_behind = 0
+		return low, low + len(decls)
+
+	# edit() for a source that couldn't be tokenized: tokenize all of the
+	# edited one
+	def _retokenize_all(self, offset, deleted, inserted):
+		source = self._unlexed
+		if not 0 <= offset <= offset + deleted <= len(source):
+			raise IndexError("edit out of range of the source")
+		source = source[:offset] + inserted + source[offset + deleted:]
+		try:
+			self.tokens = tokenizer.tokenize(source, lexer=self.lexer)
+		except tokenizer.BracketError as e:
+			self._unlexed = None
+			self.tokens = e.tokens
+			raise
+		except tokenizer.LexError:
+			self._unlexed = source
+			raise
+		self._unlexed = None
+		return self._reparse()
+
+	def _reparse(self):
+		self.tree = None
+		self.tree = parse(program, self.tokens)
+		self.spans = array('i', _spans(self.tree.children, 0))
+		self._span_gap = 0
+		self._span_shift = 0
+		self._asts = [_UNBUILT] * len(self.tree.children)
+		self._streams_behind = 0
+		return 0, len(self.tree.children)
+
+	# The AST of the program, as to_ast(self.tree) would build it, building
+	# only the declarations' ASTs that aren't built yet.
+	def ast(self):
+		children = []
+		for k, decl in enumerate(self.tree.children):
+			if self._asts[k] is _UNBUILT:
+				self._asts[k] = to_ast(decl)
+			if self._asts[k] is not None:
+				children.append(self._asts[k])
+		return ASTNode(name="", children=children)
+
+# The Tokens of the Terminals in tree.
+def _terminal_tokens(tree):
+	stack = [tree]
+	while stack:
+		node = stack.pop()
+		if type(node) is Terminal:
+			yield node.token
+		else:
+			stack += node.children
+
+# spans[k], as stored in IncrementalParse.
+def _span(spans, gap, shift, k):
+	if k < gap:
+		return spans[k]
+	return spans[k] + shift
+
+# The token index each of decls starts at, when the first starts at start,
+# followed by the index just past the last.
+def _spans(decls, start):
+	spans = [start]
+	for decl in decls:
+		spans.append(spans[-1] + decl.num_terminals)
+	return spans
+
+# The top_level_decl subtrees of a run of declarations covering exactly
+# tokens[start:stop], or None if there isn't one. Declarations are tried the
+# way a repetition of them is in a full parse, except that one reaching past
+# stop counts as not matching.
+def _parse_declarations(tokens, start, stop):
+	decls = []
+	if start == stop:
+		return decls
+	generators = [drive(top_level_decl.descend(tokens, start))]
+	positions = [start]
+	# invariant: decls holds one match for each generator but the last
+	while generators:
+		result = next(generators[-1], None)
+		if result is None:
+			generators.pop()
+			positions.pop()
+			if decls:
+				decls.pop()
+			continue
+		match, length = result
+		end = positions[-1] + length
+		if length == 0 or end > stop:
+			continue
+		decls.append(match[0])
+		if end == stop:
+			return decls
+		generators.append(drive(top_level_decl.descend(tokens, end)))
+		positions.append(end)
+	return None
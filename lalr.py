@@ -0,0 +1,420 @@
+import os
+import pickle
+import sys
+from parser import Rule, Reduction, OptionalReduction, RepetitionReduction
+from parser import PrecedenceRule, Nonterminal, Terminal, grammar_parts
+from parser_compiler import grammar_fingerprint
+from tolkien import TYPES, KINDS, intern_value
+
+# A deterministic LALR(1) backend for the grammar in grammar.py: the Rule graph
+# is flattened into plain context-free productions, LALR(1) action/goto tables
+# are built from those (and cached on disk), and a shift-reduce driver builds
+# the same Nonterminal/Terminal trees that parser.parse() returns.
+#
+# Flattening:
+# - every Reduction of a Rule becomes one production of that Rule, with nested
+#   plain Reductions spliced in
+# - OptionalReduction(x) becomes a helper nonterminal $opt ::= x | <empty>
+# - RepetitionReduction(x) becomes a helper nonterminal
+#   $rep ::= <empty> | $rep x
+# - a PrecedenceRule becomes the usual one-nonterminal-per-level cascade,
+#   whose reductions build the same nodes precedence climbing does
+#
+# Terminals are 'v:<text>' for literal terminals and 't:<typename>' for TYPES.
+# A token is looked up by its text first and by its typename only if the
+# current state has no action for the text, so e.g. 'int' is read as the type
+# name wherever one is possible. Where the backtracking parser would fall back
+# to reading it as an identifier, this backend reports a syntax error instead.
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+TABLES_PATH = os.path.join(_HERE, 'grammar_lalr.pickle')
+
+_FINGERPRINT_SOURCES = ['grammar.py', 'parser.py', 'lalr.py', 'tolkien.py']
+
+_START = '$start'
+_END = '$end'
+# lookahead placeholder used while computing lookahead propagation
+_PROPAGATE = '#'
+
+# production actions, i.e. what a reduction builds from the values of the
+# right-hand side:
+# a Nonterminal of the rule, with its (non-empty) children spliced in
+_RULE = 'rule'
+# a list of nodes for the enclosing production to splice in
+_SPLICE = 'splice'
+# the left-recursive step of a repetition: extend the list on the left
+_REPEAT = 'repeat'
+# a precedence level with no operator: the tighter operand itself
+_PASS = 'pass'
+# a precedence level with an operator: ('binary', level name, tail name,
+# right_assoc)
+_BINARY = 'binary'
+
+def _terminal(r):
+	if isinstance(r, str):
+		return 'v:' + r
+	return 't:' + r.value
+
+def _is_terminal(symbol):
+	return symbol.startswith('v:') or symbol.startswith('t:') or symbol == _END
+
+class _GrammarFlattener:
+	def __init__(self, top_rule):
+		# (lhs, rhs tuple, action tuple), with the augmented start
+		# production first
+		self.productions = [(_START, (top_rule.name,), (_PASS,))]
+		self.helpers = {}
+		rules, _ = grammar_parts(top_rule)
+		for rule in rules:
+			if isinstance(rule, PrecedenceRule):
+				self._precedence_rule(rule)
+			else:
+				for red in rule.reductions:
+					self.productions.append((rule.name, self._symbols(red), (_RULE, rule.name)))
+
+	# the right-hand side of a reduction used as part of a sequence
+	def _symbols(self, red):
+		if isinstance(red, (OptionalReduction, RepetitionReduction)):
+			return (self._helper(red),)
+		symbols = []
+		for r in red.reduction:
+			if isinstance(r, Rule):
+				symbols.append(r.name)
+			elif isinstance(r, Reduction):
+				symbols += self._symbols(r)
+			else:
+				symbols.append(_terminal(r))
+		return tuple(symbols)
+
+	def _helper(self, red):
+		name = self.helpers.get(id(red))
+		if name is not None:
+			return name
+
+		# the parts of the repetition or option, without its own semantics
+		body = self._symbols(Reduction(*red.reduction))
+		if isinstance(red, OptionalReduction):
+			name = f'$opt{len(self.helpers)}'
+			self.helpers[id(red)] = name
+			self.productions.append((name, body, (_SPLICE,)))
+			self.productions.append((name, (), (_SPLICE,)))
+		else:
+			name = f'$rep{len(self.helpers)}'
+			self.helpers[id(red)] = name
+			self.productions.append((name, (), (_SPLICE,)))
+			self.productions.append((name, (name,) + body, (_REPEAT,)))
+		return name
+
+	def _precedence_rule(self, rule):
+		levels = sorted(rule.levels, key=lambda level: level.binding_power)
+		names = [rule.name] + [f'{rule.name}${level.name}' for level in levels[1:]] + [rule.operand.name]
+		for i, level in enumerate(levels):
+			this, tighter = names[i], names[i + 1]
+			action = (_BINARY, level.name, level.tail_name, level.right_assoc)
+			for op in sorted(level.operators):
+				if level.right_assoc:
+					rhs = (tighter, _terminal(op), this)
+				else:
+					rhs = (this, _terminal(op), tighter)
+				self.productions.append((this, rhs, action))
+			self.productions.append((this, (tighter,), (_PASS,)))
+
+# Parse tables plus what the driver needs to know about each production:
+# productions[p] = (lhs, length of rhs, action). In the action table a positive
+# entry is a shift to that state, a negative entry -(p + 1) a reduction by
+# production p, and 0 accepts.
+class LALRTables:
+	def __init__(self, productions, action, goto, conflicts):
+		self.productions = productions
+		self.action = action
+		self.goto = goto
+		self.conflicts = conflicts
+		# the action table split by how a token is looked up, and keyed by
+		# the integer codes tokens carry in a TokenStream
+		self.value_actions = []
+		self.kind_actions = []
+		for row in action:
+			self.value_actions.append({intern_value(t[2:]): entry for t, entry in row.items() if t.startswith('v:')})
+			self.kind_actions.append({KINDS[t[2:]]: entry for t, entry in row.items() if t.startswith('t:')})
+
+# Build the LALR(1) tables for the grammar rooted at top_rule.
+def build_tables(top_rule):
+	productions = _GrammarFlattener(top_rule).productions
+	return _LALRBuilder(productions).tables()
+
+class _LALRBuilder:
+	def __init__(self, productions):
+		self.productions = productions
+		self.by_lhs = {}
+		for p, (lhs, _, _) in enumerate(productions):
+			self.by_lhs.setdefault(lhs, []).append(p)
+		self._compute_first()
+		self._closure_cache = {}
+
+	def _compute_first(self):
+		self.first = {lhs: set() for lhs in self.by_lhs}
+		self.nullable = set()
+		changed = True
+		while changed:
+			changed = False
+			for lhs, rhs, _ in self.productions:
+				f, is_nullable = self._first_of(rhs)
+				if not f <= self.first[lhs]:
+					self.first[lhs] |= f
+					changed = True
+				if is_nullable and lhs not in self.nullable:
+					self.nullable.add(lhs)
+					changed = True
+
+	def _first_of(self, symbols):
+		f = set()
+		for symbol in symbols:
+			if _is_terminal(symbol):
+				f.add(symbol)
+				return f, False
+			f |= self.first[symbol]
+			if symbol not in self.nullable:
+				return f, False
+		return f, True
+
+	# LR(1) closure of a {(production, dot): set of lookaheads} dict
+	def _closure(self, items):
+		closure = {item: set(lookaheads) for item, lookaheads in items.items()}
+		work = list(closure)
+		while len(work) > 0:
+			p, dot = work.pop()
+			rhs = self.productions[p][1]
+			if dot == len(rhs) or _is_terminal(rhs[dot]):
+				continue
+			f, is_nullable = self._first_of(rhs[dot + 1:])
+			lookaheads = f | closure[(p, dot)] if is_nullable else f
+			for q in self.by_lhs[rhs[dot]]:
+				existing = closure.setdefault((q, 0), set())
+				if not lookaheads <= existing:
+					existing |= lookaheads
+					work.append((q, 0))
+		return closure
+
+	def _closure0(self, kernel):
+		closure = set(kernel)
+		work = list(kernel)
+		while len(work) > 0:
+			p, dot = work.pop()
+			rhs = self.productions[p][1]
+			if dot < len(rhs) and not _is_terminal(rhs[dot]):
+				for q in self.by_lhs[rhs[dot]]:
+					if (q, 0) not in closure:
+						closure.add((q, 0))
+						work.append((q, 0))
+		return closure
+
+	# the LR(0) automaton: kernels of every state and the transitions
+	# between them
+	def _lr0_states(self):
+		kernels = [frozenset([(0, 0)])]
+		index = {kernels[0]: 0}
+		transitions = []
+		i = 0
+		while i < len(kernels):
+			moves = {}
+			for p, dot in sorted(self._closure0(kernels[i])):
+				rhs = self.productions[p][1]
+				if dot < len(rhs):
+					moves.setdefault(rhs[dot], set()).add((p, dot + 1))
+			row = {}
+			for symbol, kernel in moves.items():
+				kernel = frozenset(kernel)
+				if kernel not in index:
+					index[kernel] = len(kernels)
+					kernels.append(kernel)
+				row[symbol] = index[kernel]
+			transitions.append(row)
+			i += 1
+		return kernels, transitions
+
+	# Lookaheads of every kernel item, by spontaneous generation and
+	# propagation (the method in the Dragon book, 4.7.5)
+	def _kernel_lookaheads(self, kernels, transitions):
+		lookaheads = {(i, item): set() for i, kernel in enumerate(kernels) for item in kernel}
+		lookaheads[(0, (0, 0))].add(_END)
+		propagates = {key: [] for key in lookaheads}
+
+		for i, kernel in enumerate(kernels):
+			for item in kernel:
+				if item not in self._closure_cache:
+					self._closure_cache[item] = self._closure({item: {_PROPAGATE}})
+				for (p, dot), las in self._closure_cache[item].items():
+					rhs = self.productions[p][1]
+					if dot == len(rhs):
+						continue
+					target = (transitions[i][rhs[dot]], (p, dot + 1))
+					for la in las:
+						if la == _PROPAGATE:
+							propagates[(i, item)].append(target)
+						else:
+							lookaheads[target].add(la)
+
+		changed = True
+		while changed:
+			changed = False
+			for source, targets in propagates.items():
+				las = lookaheads[source]
+				for target in targets:
+					if not las <= lookaheads[target]:
+						lookaheads[target] |= las
+						changed = True
+		return lookaheads
+
+	def _describe(self, p):
+		lhs, rhs, _ = self.productions[p]
+		return f"{lhs} ::= {' '.join(rhs) if rhs else '<empty>'}"
+
+	def tables(self):
+		kernels, transitions = self._lr0_states()
+		lookaheads = self._kernel_lookaheads(kernels, transitions)
+
+		action = []
+		goto = []
+		conflicts = []
+		for i, kernel in enumerate(kernels):
+			row = {}
+			for symbol, target in transitions[i].items():
+				if _is_terminal(symbol):
+					row[symbol] = target
+			closure = self._closure({item: lookaheads[(i, item)] for item in kernel})
+			for (p, dot), las in sorted(closure.items()):
+				if dot != len(self.productions[p][1]):
+					continue
+				entry = 0 if p == 0 else -(p + 1)
+				for la in sorted(las):
+					existing = row.get(la)
+					if existing is None:
+						row[la] = entry
+					elif existing > 0:
+						# yacc's default: prefer the shift
+						conflicts.append(f"state {i}: shift/reduce conflict on {la}, "
+								 f"shifting rather than reducing {self._describe(p)}")
+					elif existing != entry:
+						# and the earlier production
+						conflicts.append(f"state {i}: reduce/reduce conflict on {la} between "
+								 f"{self._describe(-existing - 1)} and {self._describe(p)}")
+			action.append(row)
+			goto.append({symbol: target for symbol, target in transitions[i].items()
+				     if not _is_terminal(symbol)})
+
+		productions = [(lhs, len(rhs), act) for lhs, rhs, act in self.productions]
+		return LALRTables(productions, action, goto, conflicts)
+
+# Return the LALR(1) tables for grammar.py, building them first (and reporting
+# any conflicts on stderr) if there is no up-to-date copy at path.
+def load_tables(path=TABLES_PATH):
+	fingerprint = grammar_fingerprint(_FINGERPRINT_SOURCES)
+	if os.path.exists(path):
+		with open(path, 'rb') as f:
+			cached = pickle.load(f)
+		if cached.get('fingerprint') == fingerprint:
+			return LALRTables(cached['productions'], cached['action'], cached['goto'], cached['conflicts'])
+
+	from grammar import program
+	tables = build_tables(program)
+	for conflict in tables.conflicts:
+		print(f"LALR(1) {conflict}", file=sys.stderr)
+
+	# write to a temporary file first so a concurrent compile never reads
+	# half a table
+	tmp_path = f'{path}.{os.getpid()}.tmp'
+	with open(tmp_path, 'wb') as f:
+		pickle.dump({
+			'fingerprint': fingerprint,
+			'productions': tables.productions,
+			'action': tables.action,
+			'goto': tables.goto,
+			'conflicts': tables.conflicts,
+		}, f, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp_path, path)
+	return tables
+
+# Shift-reduce parse of tokens with the given tables, returning the same tree
+# as parser.parse().
+def parse(tables, tokens):
+	productions = tables.productions
+	goto = tables.goto
+	value_actions = tables.value_actions
+	kind_actions = tables.kind_actions
+	token_values = tokens.values
+	token_kinds = tokens.kinds
+	num_tokens = len(token_values)
+
+	states = [0]
+	values = []
+	i = 0
+	while True:
+		state = states[-1]
+		if i < num_tokens:
+			entry = value_actions[state].get(token_values[i])
+			if entry is None:
+				entry = kind_actions[state].get(token_kinds[i])
+		else:
+			entry = tables.action[state].get(_END)
+
+		if entry is None:
+			if i == num_tokens:
+				raise BaseException("Invalid syntax at end of input")
+			token = tokens[i]
+			raise BaseException(f"Invalid syntax at l:{token.line} c:{token.col}: {token.value}")
+
+		if entry > 0:
+			states.append(entry)
+			values.append(Terminal(tokens[i]))
+			i += 1
+		elif entry < 0:
+			lhs, length, act = productions[-entry - 1]
+			if length > 0:
+				args = values[-length:]
+				del values[-length:]
+				del states[-length:]
+			else:
+				args = []
+			values.append(_reduce(act, args))
+			states.append(goto[states[-1]][lhs])
+		else:
+			return values[-1]
+
+def _reduce(act, args):
+	kind = act[0]
+	if kind == _PASS:
+		return args[0]
+	if kind == _SPLICE:
+		return _splice([], args)
+	if kind == _REPEAT:
+		return _splice(args[0], args[1:])
+	if kind == _RULE:
+		return Nonterminal(act[1], _splice([], args))
+
+	_, name, tail_name, right_assoc = act
+	left, op, right = args
+	tail = Nonterminal(tail_name, [op, right])
+	# further operators of a left-associative level join the same node, like
+	# the tails of a <name> ::= <operand> { <tail_name> } rule would
+	if not right_assoc and isinstance(left, Nonterminal) and left.rule_name == name:
+		left.children.append(tail)
+		left.num_terminals += tail.num_terminals
+		return left
+	return Nonterminal(name, [left, tail])
+
+# append the nodes among values (some of which are lists of nodes) to children,
+# leaving out empty matches like the backtracking parser does
+def _splice(children, values):
+	for value in values:
+		if isinstance(value, list):
+			children += value
+		elif value.num_terminals > 0:
+			children.append(value)
+	return children
+
+if __name__ == "__main__":
+	tables = load_tables()
+	print(f"{len(tables.action)} states, {len(tables.productions)} productions, {len(tables.conflicts)} conflicts")
+	for conflict in tables.conflicts:
+		print(conflict)
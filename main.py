@@ -1,7 +1,14 @@
 import argparse
+import os
+import sys
+import time
 import tokenizer
 from grammar import program
-from parser import parse
+from parser import parse, PackratCache, ParseProfiler
+import parallel
+import batch
+import compile_cache
+import passes
 from abstract_syntax_tree import to_ast
 
 # TODO: does someone use a text editor that inserts tabs rather than spaces?
@@ -9,29 +16,164 @@ from abstract_syntax_tree import to_ast
 # just need to all be on the same page there because python
 
 def main():
-	parser = argparse.ArgumentParser(description="Compile a C program. Any C program.")
+	# @file arguments are read from file, one per line
+	parser = argparse.ArgumentParser(description="Compile a C program. Any C program.", fromfile_prefix_chars="@")
 	# TODO: what was the flag we needed to use to print tokens / intermediate representations?
 	parser.add_argument("-t", "--tokens", action="store_true", help="print tokens to stdout after tokenizing", dest="print_tokens")
-	parser.add_argument("file", help="a filepath of a (single-file) C program to be compiled")
-	parser.add_argument("-p", "--parse-tree", action="store_true", help="print parse tree to stdout after parsing", dest="print_parse_tree")
+	parser.add_argument("files", nargs="+", metavar="file", help="a filepath of a (single-file) C program to be compiled; given several (or -o), they're compiled as a batch, writing each file's tokens, tree or AST to <file>.tokens, <file>.tree or <file>.ast and a summary to stderr")
+	parser.add_argument("-o", "--output-dir", help="compile as a batch, writing the outputs into this directory instead of next to each file", dest="output_dir")
+	parser.add_argument("--tokens-only", action="store_true", help="stop after tokenizing; with -t and the regex lexer, tokens are streamed from the file without reading all of it into memory", dest="tokens_only")
+	parser.add_argument("-p", "--parse-tree", action="store_true", help="print parse tree to stdout after parsing; the backtracking parser otherwise builds the AST directly, without a parse tree, which is faster (except under --time-passes or --memory-report, which report the parse and AST stages separately)", dest="print_parse_tree")
 	parser.add_argument("-a", "--abstract-syntax-tree", action="store_true", help="print abstract syntax tree to stdout after parsing", dest="print_ast")
+	parser.add_argument("--packrat", action="store_true", help="memoize rule matches per token position while parsing and print a cache report to stderr", dest="packrat")
+	parser.add_argument("--profile-parse", action="store_true", help="count attempts, backtracks and wasted tokens per grammar rule and reduction while parsing and print the worst offenders to stderr", dest="profile_parse")
+	parser.add_argument("--profile-stacks", metavar="PATH", help="with --profile-parse, also write the time spent per stack of rules to PATH as collapsed stacks, for flamegraph.pl or speedscope", dest="profile_stacks")
+	parser.add_argument("--lexer", choices=["regex", "dfa", "vectorized"], default="regex", help="tokenizer backend: the master regex (default), a DFA generated from the same token definitions (cached next to it), or the regex behind a NumPy character classification pass (needs NumPy)", dest="lexer")
+	parser.add_argument("-j", "--jobs", type=int, default=1, help="compile a batch in this many worker processes; for a single file, parse its top-level declarations in this many with the backtracking parser", dest="jobs")
+	parser.add_argument("--no-cache", action="store_true", help="always tokenize, parse and build the AST, instead of reusing (and storing) them in the compile cache", dest="no_cache")
+	parser.add_argument("--cache-dir", default=compile_cache.DEFAULT_DIR, help="directory of the compile cache (default: compile_cache next to this file)", dest="cache_dir")
+	parser.add_argument("--time-passes", action="store_true", help="print the wall and CPU time of each pass to stderr", dest="time_passes")
+	parser.add_argument("--memory-report", action="store_true", help="trace allocations (slowly) and print each pass's peak and retained memory and top allocation sites to stderr", dest="memory_report")
+	parser.add_argument("--passes-json", help="with --time-passes or --memory-report, also write the report to this file as JSON", dest="passes_json")
+	parser.add_argument("--parser", choices=["backtracking", "compiled", "lalr"], default="backtracking", help="parser backend: interpret the grammar objects (default), use a Python module generated from grammar.py, or use LALR(1) tables built from grammar.py (both cached next to it)", dest="parser")
 	
 	# parser.parse_args() should exit and print usage if a file is not given
 	args = parser.parse_args()
+	if args.packrat and args.profile_parse:
+		parser.error("--packrat and --profile-parse can't be used together")
+	if args.profile_stacks is not None and not args.profile_parse:
+		parser.error("--profile-stacks only works with --profile-parse")
+	if (args.packrat or args.profile_parse) and (args.parser != "backtracking" or args.jobs > 1):
+		parser.error("--packrat and --profile-parse only work with the backtracking parser, without -j")
+	if args.passes_json is not None and not (args.time_passes or args.memory_report):
+		parser.error("--passes-json only works with --time-passes or --memory-report")
 
-	with open(args.file) as f:
+	if len(args.files) > 1 or args.output_dir is not None:
+		compile_batch(parser, args)
+		return
+	path = args.files[0]
+
+	if args.print_tokens and args.tokens_only and args.lexer == "regex":
+		# printing tokens only needs them one at a time, in order
+		for token in tokenizer.tokenize_iter(path):
+			print_token(token)
+		return
+
+	recorder = passes.NO_RECORDER
+	if args.time_passes or args.memory_report:
+		recorder = passes.PassRecorder(memory=args.memory_report)
+	try:
+		compile_file(path, args, recorder)
+	except tokenizer.LexError as e:
+		print(e)
+		exit()
+	finally:
+		recorder.finish()
+		if recorder is not passes.NO_RECORDER:
+			passes.write_report(recorder.report(), args.passes_json)
+
+def compile_file(path, args, recorder):
+	with recorder.stage("read"), open(path) as f:
 		# read the entire source file
 		source = f.read()
 
+	# --packrat, --profile-parse, --time-passes and --memory-report are for
+	# reporting on the compile, so they always do all of it
+	reporting = args.packrat or args.profile_parse or args.time_passes or args.memory_report
+	cache = None if args.no_cache or reporting else compile_cache.CompileCache(args.cache_dir, lexer_name=args.lexer, parser_name=args.parser)
+	cached = None
+	if cache is not None:
+		with recorder.stage("cache"):
+			cached = cache.load(source)
+	if cached is not None and cached[1] is None and args.print_parse_tree:
+		# stored by a compile that went straight to the AST
+		cached = None
+	if cached is not None:
+		tokens, parse_tree, abstract_syntax_tree = cached
+	else:
+		with recorder.stage("setup"):
+			lexer, parse_tokens = batch.load_backends(args.lexer, args.parser)
 		# pass that source text to the tokenizer
-		tokens = tokenizer.tokenize(source, args.print_tokens)
+		with recorder.stage("tokenize"):
+			tokens = tokenizer.tokenize(source, lexer=lexer)
+	# the tokens the rest of the compile works on, from whichever lexer
+	if args.print_tokens:
+		with recorder.stage("output"):
+			for token in tokens:
+				print_token(token)
+	if args.tokens_only:
+		return
 
-		parse_tree = parse(program, tokens)
-		abstract_syntax_tree = to_ast(parse_tree)
+	if cached is None:
+		# unless the parse tree is wanted, the backtracking parser runs the
+		# grammar's semantic actions to build the AST as it goes, and there's
+		# no tree; except when reporting on the passes, which times and
+		# measures parsing and building the AST separately
+		fused = args.parser == "backtracking" and args.jobs <= 1 and not args.print_parse_tree and not (args.time_passes or args.memory_report)
+		parse_tree = abstract_syntax_tree = None
+		with recorder.stage("parse"):
+			if args.parser != "backtracking":
+				parse_tree = parse_tokens(tokens)
+			elif args.jobs > 1:
+				parse_tree = parallel.parse_parallel(tokens, args.jobs)
+			else:
+				memo = None
+				if args.packrat:
+					memo = PackratCache()
+				elif args.profile_parse:
+					memo = ParseProfiler(program)
+				result = parse(program, tokens, memo=memo, actions=fused)
+				if fused:
+					abstract_syntax_tree = result
+				else:
+					parse_tree = result
+				if memo is not None:
+					print(memo.report(), file=sys.stderr)
+				if args.profile_stacks is not None:
+					with open(args.profile_stacks, "w") as f:
+						f.write(memo.collapsed_stacks())
+		try:
+			if not fused:
+				with recorder.stage("ast"):
+					abstract_syntax_tree = to_ast(parse_tree)
+		finally:
+			# even if building the AST fails, the tokens and tree are good
+			if cache is not None:
+				with recorder.stage("cache"):
+					cache.store(source, tokens, parse_tree, abstract_syntax_tree)
+	if abstract_syntax_tree is None:
+		with recorder.stage("ast"):
+			abstract_syntax_tree = to_ast(parse_tree)
+	with recorder.stage("output"):
 		if args.print_parse_tree:
 			print(parse_tree)
 		if args.print_ast:
 			print(abstract_syntax_tree)
-		
+
+def print_token(token):
+	print(f"{token.typename} l:{token.line} c:{token.col} --- {token}")
+
+def compile_batch(parser, args):
+	if args.packrat or args.profile_parse or args.time_passes or args.memory_report:
+		parser.error("--packrat, --profile-parse, --time-passes and --memory-report only work on a single file")
+	outputs = []
+	if args.print_tokens:
+		outputs.append("tokens")
+	if args.print_parse_tree:
+		outputs.append("tree")
+	if args.print_ast:
+		outputs.append("ast")
+	destinations = [batch.output_path(path, "", args.output_dir) for path in args.files]
+	if len(set(destinations)) < len(destinations):
+		parser.error("two of the files would have the same outputs")
+	if args.output_dir is not None:
+		os.makedirs(args.output_dir, exist_ok=True)
+
+	start = time.perf_counter()
+	results = batch.compile_files(args.files, args.lexer, args.parser, args.jobs, outputs, args.output_dir, args.tokens_only, None if args.no_cache else args.cache_dir)
+	print(batch.format_summary(results, time.perf_counter() - start), file=sys.stderr)
+	if any(r.error is not None for r in results):
+		sys.exit(1)
+
 if __name__ == "__main__":
 	main()
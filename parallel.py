@@ -0,0 +1,123 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from grammar import program, top_level_decl
+from parser import Nonterminal, parse, drive, encode_tree, decode_tree
+from tolkien import TokenStream, LineIndex, intern_value
+
+# Parsing the top-level declarations of a program in parallel, in a pool of
+# worker processes.
+#
+# Without structs or initializers in the grammar, every top-level declaration
+# ends at a ';' or a function body's '}' outside of any brackets, and nothing
+# else at that depth does; so the token stream can be cut into declarations
+# before parsing, and each parsed on its own. The declarations are handed out
+# in a few contiguous batches per worker, as arrays of token kinds and offsets
+# into the source (which each worker is given once), and the parse trees come
+# back as nested tuples of rule names and token indexes, from which the parent
+# builds the same program tree parse() would.
+
+# batches per worker, so one slow batch doesn't leave the others idle
+_BATCHES_PER_JOB = 4
+
+# The token index each top-level declaration in tokens starts at, followed by
+# len(tokens). Anything after the last declaration is given as one more,
+# which won't parse.
+def split_declarations(tokens):
+	values = tokens.values
+	matching = tokens.matching
+	semicolon = intern_value(';')
+	open_brace = intern_value('{')
+	bounds = [0]
+	n = len(values)
+	i = 0
+	while i < n:
+		j = i + matching[i]
+		if j > i:
+			# skip to the closing bracket, which ends a function body
+			if values[i] == open_brace:
+				bounds.append(j + 1)
+			i = j + 1
+			continue
+		if values[i] == semicolon:
+			bounds.append(i + 1)
+		i += 1
+	if bounds[-1] != n:
+		bounds.append(n)
+	return bounds
+
+# Parse tokens like parse(program, tokens), in jobs worker processes.
+def parse_parallel(tokens, jobs):
+	bounds = split_declarations(tokens)
+	num_decls = len(bounds) - 1
+	if jobs <= 1 or num_decls <= 1:
+		return parse(program, tokens)
+
+	# cut the declarations into batches of about the same number of tokens
+	num_batches = min(jobs * _BATCHES_PER_JOB, num_decls)
+	batch_bounds = [0]
+	for b in range(1, num_batches):
+		k = batch_bounds[-1] + 1
+		while k < num_decls and bounds[k] < len(tokens) * b // num_batches:
+			k += 1
+		if k < num_decls:
+			batch_bounds.append(k)
+	batch_bounds.append(num_decls)
+
+	# the batches are slices of the offsets
+	tokens.settle()
+	batches = []
+	for b in range(len(batch_bounds) - 1):
+		first = bounds[batch_bounds[b]]
+		stop = bounds[batch_bounds[b + 1]]
+		batches.append((
+			tokens.kinds[first:stop],
+			tokens.starts[first:stop],
+			tokens.ends[first:stop],
+			[bound - first for bound in bounds[batch_bounds[b]:batch_bounds[b + 1] + 1]],
+		))
+
+	decls = []
+	with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(tokens.source,)) as pool:
+		for b, encoded in enumerate(pool.map(_parse_batch, batches)):
+			if encoded is None:
+				raise BaseException("Invalid syntax at *shrug*")
+			base = bounds[batch_bounds[b]]
+			for tree in encoded:
+				decls.append(decode_tree(tree, tokens, base))
+	return Nonterminal(program.name, decls)
+
+# the source being parsed, in a worker process
+_source = None
+_lines = None
+
+def _init_worker(source):
+	global _source, _lines
+	_source = source
+	_lines = LineIndex(source)
+
+# Parse one batch of declarations in a worker; returns their encoded trees,
+# or None if one of them doesn't parse.
+def _parse_batch(batch):
+	kinds, starts, ends, bounds = batch
+	tokens = TokenStream(_source, _lines)
+	tokens.kinds = kinds
+	tokens.starts = starts
+	tokens.ends = ends
+	# value ids are only meaningful in the process that interned them
+	tokens.values = array('I', [intern_value(_source[s:e]) for s, e in zip(starts, ends)])
+	tokens.matching = array('i', [0]) * len(kinds)
+	encoded = []
+	for k in range(len(bounds) - 1):
+		decl = _parse_declaration(tokens, bounds[k], bounds[k + 1])
+		if decl is None:
+			return None
+		encoded.append(encode_tree(decl))
+	return encoded
+
+# The first top_level_decl match covering exactly tokens[start:stop], which is
+# the one a full parse ends up with, or None.
+def _parse_declaration(tokens, start, stop):
+	for match, length in drive(top_level_decl.descend(tokens, start)):
+		if length == stop - start:
+			return match[0]
+	return None
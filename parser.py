@@ -1,101 +1,185 @@
-from tolkien import Token, TYPES
+from tolkien import Token, TYPES, KINDS, KIND_TYPES, intern_value
 from typing import Callable
+from functools import partial
+import time
 
+# Parse trees are built out of a lot of these, so they have __slots__ rather
+# than a __dict__ each. Empty matches never make it into a tree: a rule that
+# matched nothing is only ever a Nonterminal without children, and a reduction
+# leaves it out (see Reduction._reduce), so there's nothing to prune afterwards
+# and a leaf is always a Terminal with a token.
 class Node:
+	__slots__ = ()
+
+	# one line per node, in preorder, indented by its depth with '|'s (with an
+	# explicit stack, so a tree can be as deep as memory allows)
 	def __str__(self):
-		return self._to_string(0)
-	
-	def _to_string(self, depth):
-		string = '|' * depth
-		string = string + self._getname() + '\n'
-		for child in self.children:
-			string = string + child._to_string(depth + 1)
-		return string
+		lines = []
+		stack = [(self, 0)]
+		while stack:
+			node, depth = stack.pop()
+			lines.append('|' * depth + node._getname() + '\n')
+			for child in reversed(node.children):
+				stack.append((child, depth + 1))
+		return ''.join(lines)
 
-	
-	# TODO: below is a method to retroactively remove empty matches since
-	# they complicate AST pruning (it leaves the empty match at the root,
-	# thus when called on the <program> nonterminal still returns a parse
-	# tree for an empty program), but it would be cleaner to avoid adding
-	# empty terminals to the parse tree to start with (by e.g. using a
-	# different return value to signify an empty match, or just letting
-	# Terminal(None) signify an empty match but never adding it to the tree)
-	def prune_empty(self):
-		# empty Terminals (for which self.children == []) are pruned at a higher level
-		
-		i = 0
-		while i < len(self.children):
-			# we don't have to update num_terminals since we're only
-			# removing "empty" subtrees
-			if self.children[i].num_terminals > 0:
-				self.children[i].prune_empty()
-				i += 1
-			else:
-				self.children.pop(i)
-		return
-				
+# num_terminals is the number of tokens under the node. A parser knows it from
+# the length of the match, and passes it in so it isn't summed over the
+# children again.
 class Nonterminal(Node):
-	def __init__(self, rule_name = "", children = []):
+	__slots__ = ('rule_name', 'children', 'num_terminals')
+
+	def __init__(self, rule_name = "", children = None, num_terminals = None):
+		if children is None:
+			children = []
 		self.children = children
-		self.num_terminals = 0
 		self.rule_name = rule_name
-		for child in self.children:
-			assert isinstance(child, Node)
-			self.num_terminals += child.num_terminals
+		if num_terminals is None:
+			num_terminals = 0
+			for child in children:
+				assert isinstance(child, Node)
+				num_terminals += child.num_terminals
+		self.num_terminals = num_terminals
 			
 	def _getname(self):
 		return '<' + self.rule_name + '>'
 
 	
 class Terminal(Node):
+	__slots__ = ('token',)
+	# the same for every Terminal, so kept on the class
+	children = ()
+	num_terminals = 1
+
 	def __init__(self, token):
-		self.children = []
-		if token is None:
-			self.num_terminals = 0
-		else:
-			assert isinstance(token, Token)
-			self.num_terminals = 1
+		assert isinstance(token, Token)
 		self.token = token
 		
 	def _getname(self):
-		if self.token is None:
-			return ''
 		return self.token.value
 
 # TODO: tie 3 address code constructs to AST nodes such that we can use that
 # association to easily convert trees into sections of 3AC. 
 class ASTNode(Node):
-	def __init__(self, name='', children = []):
+	__slots__ = ('name', 'children')
+
+	def __init__(self, name='', children = None):
 		self.name = name
-		self.children = children
+		self.children = [] if children is None else children
 
 	def _getname(self):
 		return self.name
 
+# A parse tree as plain data, for sending to another process or storing: a
+# flat list of its nodes in preorder, a Terminal as the index of its token and
+# a Nonterminal as (rule name, number of children). Flat, so that neither this
+# nor pickling it recurses as deep as the tree goes.
+def encode_tree(node):
+	encoded = []
+	stack = [node]
+	while stack:
+		node = stack.pop()
+		if isinstance(node, Terminal):
+			encoded.append(node.token.index)
+		else:
+			encoded.append((node.rule_name, len(node.children)))
+			stack.extend(reversed(node.children))
+	return encoded
+
+# The tree encode_tree encoded, with the token at index i being
+# tokens[base + i]. Going through the nodes backwards, every node's children
+# have been built by the time it's reached: the last ones on the stack, first
+# child last.
+def decode_tree(encoded, tokens, base=0):
+	stack = []
+	for item in reversed(encoded):
+		if isinstance(item, int):
+			stack.append(Terminal(Token(tokens, base + item)))
+			continue
+		rule_name, num_children = item
+		children = stack[len(stack) - num_children:]
+		del stack[len(stack) - num_children:]
+		children.reverse()
+		stack.append(Nonterminal(rule_name, children))
+	return stack[0]
+
+# A Reduction that is one of a Rule's alternatives can have a semantic action,
+# which parse(actions=True) calls with what the reduction matched to get the
+# value the Rule's match stands for, instead of building a Nonterminal: a list
+# of the values of its parts, with every terminal as its Token, every rule as
+# its value and the parts of nested reductions spliced in (leaving out rules
+# that matched nothing, like a tree does). Without an action, a reduction of
+# one part has that part's value, and any other has None.
+#
+# Actions run as soon as a match is found, so they also run for matches that
+# are backtracked out of later; they must only build new values, never change
+# the ones they're given.
 class Reduction:
-	def __init__(self, *reduction):
+	def __init__(self, *reduction, action=None):
 		self.reduction = reduction
+		self.action = _default_action if action is None else action
+		# a plain reduction of a lone rule matches exactly what the rule
+		# does, so (without a memo to record it in) reducing it is just
+		# descending into the rule
+		self.only_rule = None
+		if type(self) is Reduction and len(reduction) == 1 and isinstance(reduction[0], Rule):
+			self.only_rule = reduction[0]
+		# terminals as the integers they're compared by in a TokenStream:
+		# interned value ids for literal terminals, kinds for TYPES
+		self.codes = tuple(_terminal_code(r) for r in reduction)
+		# filled in by compute_first_sets()
+		self.first = frozenset()
+		self.nullable = False
 		
 	# Returns a generator over all possible reduction matches under all
 	# possible derivation choices of any rules within the reduction.  The
 	# generator iterates over tuples of:
-	# (0) lists of Nodes corresponding to individually matched rules,
-	# reductions, or terminals contained within this Reduction.
+	# (0) match lists (see match_list()) of Nodes corresponding to
+	# individually matched rules, reductions, or terminals contained within
+	# this Reduction.
 	# and 
 	# (1) the number of terminals consumed to produce (err.. reduce?)
 	# the match.
+	# With actions, the match lists hold Tokens and values (see above)
+	# instead of Nodes.
 	#
-	# TODO: figure out how to memoize the results of reduce() and descend()
-	# on the same token set (first thought is whenever the generator for a
-	# particular length of tokens is iterated, also store its results in a
-	# list and re-iterate through that list rather than creating any new
-	# generators (new calls to descend() or reduce()) for any particular
-	# length of tokens.
-	def reduce(self, tokens):
+	# The token list is shared, never copied or modified, by the whole
+	# parse; start is the index of the first token this Reduction should
+	# match, and consumed lengths are relative to it.
+	#
+	# If a PackratCache is given as memo, the results for this Reduction at
+	# the current token position are shared with every other caller that
+	# reduces it at the same position (see PackratCache).
+	#
+	# The generator is a parse generator (see drive()).
+	def reduce(self, tokens, start=0, memo=None, actions=False):
+		if memo is None:
+			if self.only_rule is not None:
+				return self.only_rule.descend(tokens, start, None, actions)
+			return self._reduce(tokens, start, memo, actions)
+		return memo.lookup(self, tokens, start, self._reduce, actions)
+
+	def _reduce(self, tokens, start, memo, actions):
 			
-		#We match the empty token (i.e., epsilon)
+		#We match the empty token (i.e., epsilon), which is the empty
+		#match list
 		if len(self.reduction) == 0:
-			yield [Terminal(None)], 0
+			yield None, 0
+		elif len(self.reduction) == 1 and not isinstance(self.reduction[0], Reduction):
+			# a lone rule or terminal (most of the grammar): no
+			# backtracking of our own to do, and its match is
+			# already a list
+			r = self.reduction[0]
+			if isinstance(r, Rule):
+				g = r.descend(tokens, start, memo, actions)
+				while True:
+					result = yield g
+					if result is None:
+						break
+					yield result
+			elif start < len(tokens) and \
+					(tokens.values if isinstance(r, str) else tokens.kinds)[start] == self.codes[0]:
+				yield [tokens[start] if actions else Terminal(tokens[start])], 1
 		else:
 			# Iterate through the parts of the reduction, saving our
 			# place every time we come across a rule or nested
@@ -111,17 +195,19 @@ class Reduction:
 			
 			i = 0
 			match_state = []
+			num_tokens = len(tokens)
+			values = tokens.values
+			kinds = tokens.kinds
 			# current token
 			current = 0
 			# generator holder
 			g = None
-			# build a running match (list of Nonterminals,
-			# Terminals) as we go, and save our place at any
-			# opportunity to backtrack. Since we only append to the
-			# match_builder from any point on, we can save the place
-			# by saving its current length (and discarding anything
-			# beyond that length upon backtracking.
-			match_builder = []
+			# build a running match (a match list, see match_list())
+			# as we go, and save our place at any opportunity to
+			# backtrack. Match lists are never modified, so the
+			# place is just the match so far, and going back to it
+			# discards everything after.
+			match_builder = None
 			
 			while True:
 				r = self.reduction[i]
@@ -134,51 +220,56 @@ class Reduction:
 				# match empty rules.
 				if isinstance(r, Rule):
 					if g is None:
-						g = r.descend(tokens[current:])
+						g = r.descend(tokens, start + current, memo, actions)
 					
-					result = next(g, None)
+					result = yield g
 					if result is None:
 						if len(match_state) > 0:
-							i, current, mb_len, g = match_state.pop()
-							match_builder = match_builder[:mb_len]
+							i, current, match_builder, g = match_state.pop()
 							continue
 						else:
 							break
 					else:
-						match_state.append((i, current, len(match_builder), g))
+						match_state.append((i, current, match_builder, g))
 						m, m_len = result
-						match_builder += m
+						# a rule's match is its one Nonterminal,
+						# which is left out if it's empty
+						if m_len:
+							match_builder = (match_builder, m[0])
 						current += m_len
 						i += 1
 						g = None
 				
 				elif isinstance(r, Reduction):
 					if g is None:
-						g = r.reduce(tokens[current:])
-					result = next(g, None)
+						g = r.reduce(tokens, start + current, memo, actions)
+					result = yield g
 					if result is None:
 						if len(match_state) > 0:
-							i, current, mb_len, g = match_state.pop()
-							match_builder = match_builder[:mb_len]
+							i, current, match_builder, g = match_state.pop()
 							continue
 						else:
 							break
 					else:
-						match_state.append((i, current, len(match_builder), g))
+						match_state.append((i, current, match_builder, g))
 						m, m_len = result
-						match_builder += m
+						if m_len:
+							match_builder = (match_builder, m)
 						current += m_len
 						i += 1
 						g = None
 						
-				elif current < len(tokens) and self._match_terminal(tokens[current], r):
-					match_builder.append(Terminal(tokens[current]))
+				# match either a literal value or (r being an Enum with
+				# token typename values) a token type, by their codes
+				elif start + current < num_tokens and \
+						(values if isinstance(r, str) else kinds)[start + current] == self.codes[i]:
+					token = tokens[start + current]
+					match_builder = (match_builder, token if actions else Terminal(token))
 					current += 1
 					i += 1
 				else:
 					if len(match_state) > 0:
-						i, current, mb_len, g = match_state.pop()
-						match_builder = match_builder[:mb_len]
+						i, current, match_builder, g = match_state.pop()
 						continue
 					else:
 						break
@@ -186,73 +277,118 @@ class Reduction:
 				if i == len(self.reduction):
 					yield match_builder, current
 					if len(match_state) > 0:
-						i, current, mb_len, g = match_state.pop()
-						match_builder = match_builder[:mb_len]
+						i, current, match_builder, g = match_state.pop()
 						continue
 					else:
 						break
 				
-	#Convenience function to match either token types or literal values
-	def _match_terminal(self, token, r):
-		if isinstance(r, str):
-			return token.value == r
-		else:
-			# else r is an Enum with token typename values
-			return token.typename == r.value
+def _default_action(values):
+	return values[0] if len(values) == 1 else None
+
+def _terminal_code(r):
+	if isinstance(r, str):
+		return intern_value(r)
+	if isinstance(r, TYPES):
+		return KINDS[r.value]
+	return None
 
 class OptionalReduction(Reduction):
-	def reduce(self, tokens):
-		g = super().reduce(tokens)
+	def _reduce(self, tokens, start, memo, actions):
+		g = super()._reduce(tokens, start, memo, actions)
 		while True:
-			result = next(g, None)
+			result = yield g
 			if result is None:
-				yield [Terminal(None)], 0
+				yield None, 0
 				break
 			else:
 				yield result
 
 class RepetitionReduction(Reduction):
-	def reduce(self, tokens):
-		# we have to do the same kind of backtracking in repetitions
-		match_builder = []
-		match_state = []
-		current = 0
-		g = None
+	def _reduce(self, tokens, start, memo, actions):
+		return repeat(partial(Reduction._reduce, self, memo=memo, actions=actions), tokens, start)
 
-		while True:
-			while current < len(tokens):
-				if g is None:
-					g = super().reduce(tokens[current:])
-				
-				result = next(g, None)
-				if result is None:
-					if len(match_state) > 0:
-						current, mb_len, g = match_state.pop()
-						match_builder = match_builder[:mb_len]
-						continue
-					else:
-						break
-				else:
-					match_state.append((current, len(match_builder), g))
-					g = None
-						
-					match_i, len_i = result
+# The matching behind RepetitionReduction: yields every way of matching body
+# one or more times from tokens[start] (growing matches first), then the empty
+# match. body(tokens, start) returns a parse generator over matches the way
+# Reduction.reduce does.
+def repeat(body, tokens, start):
+	# we have to do the same kind of backtracking in repetitions
+	match_builder = None
+	match_state = []
+	num_tokens = len(tokens)
+	current = 0
+	g = None
 
-					# NOTE: ensure the empty string is not matched
-					# inside a repetition
-					assert(len_i > 0)
+	while start + current < num_tokens:
+		if g is None:
+			g = body(tokens, start + current)
 
-					match_builder += match_i
-					current += len_i
-
-					yield match_builder, current
-					
-			if len(match_builder) == 0:
-				yield [Terminal(None)], 0
-				break
+		result = yield g
+		if result is None:
+			if len(match_state) > 0:
+				current, match_builder, g = match_state.pop()
+				continue
 			else:
 				break
-			
+		else:
+			match_state.append((current, match_builder, g))
+			g = None
+
+			match_i, len_i = result
+
+			# NOTE: ensure the empty string is not matched
+			# inside a repetition
+			assert(len_i > 0)
+
+			match_builder = (match_builder, match_i)
+			current += len_i
+
+			yield match_builder, current
+
+	if match_builder is None:
+		yield None, 0
+
+# Reductions yield their matches as match lists: persistent linked lists that
+# share everything but their last part, so extending a match or going back to
+# an earlier one never copies anything. A match list is None (nothing matched
+# yet, or the empty match) or a pair (rest, last), where last is a Node, or a
+# nested match list or plain list of Nodes (what a nested reduction matched).
+# With actions, Tokens and values (any of which may be None) take the place of
+# Nodes. This returns its Nodes as one new list, which is only done once a
+# Nonterminal is built from it.
+def match_list(match):
+	if type(match) is list:
+		return match
+	if match is None:
+		return []
+	# most matches are one or two plain Nodes
+	rest, last = match
+	if isinstance(last, Node):
+		if rest is None:
+			return [last]
+		first_rest, first = rest
+		if first_rest is None and isinstance(first, Node):
+			return [first, last]
+	nodes = []
+	# the rests of the nested match lists still to go through, innermost
+	# last; the Nodes are collected last to first
+	pending = []
+	while True:
+		while match is not None:
+			match, last = match
+			if type(last) is tuple:
+				pending.append(match)
+				match = last
+			elif type(last) is list:
+				nodes.extend(reversed(last))
+			else:
+				nodes.append(last)
+		if not pending:
+			break
+		match = pending.pop()
+	nodes.reverse()
+	return nodes
+
 #Simply an ordered list of Reductions, where each reduction is equivalent to an
 #alternate form of a grammer rule.  i.e. Rule ::= Reduction0 | Reduction1 ...
 #
@@ -270,21 +406,581 @@ class Rule:
 	def __init__(self, name):
 		self.name = name
 		self.reductions = []
+		# FIRST set, nullable flag and lookahead dispatch tables, filled
+		# in by compute_first_sets(). Until then every reduction is tried.
+		self.first = frozenset()
+		self.nullable = False
+		self.first_values = None
+		self.value_dispatch = {}
+		self.type_dispatch = []
+		self.nullable_reductions = ()
 	
 	#If the leftmost tokens match any of the Reductions,
 	#returns a Nonterminal node with corresponding to this Rule
 	#and with children corresponding to the matching Reduction.
-	def descend(self, tokens):
-		if self.name == 'top_level_decl':
-			pass
-		for r in self.reductions:
-			for subtree, length in r.reduce(tokens):
-				yield [Nonterminal(self.name, subtree)], length
+	#
+	#Like Reduction.reduce, matching starts at tokens[start] and lengths
+	#are relative to start.
+	#
+	#With actions, the match is the value of the Rule (see Reduction)
+	#instead of a Nonterminal.
+	#
+	#Like Reduction.reduce, this returns a parse generator (see drive()).
+	def descend(self, tokens, start=0, memo=None, actions=False):
+		if memo is None:
+			return self._descend(tokens, start, memo, actions)
+		return memo.lookup(self, tokens, start, self._descend, actions)
+
+	def _descend(self, tokens, start, memo, actions):
+		for r in self._viable_reductions(tokens, start):
+			g = r.reduce(tokens, start, memo, actions)
+			while True:
+				result = yield g
+				if result is None:
+					break
+				subtree, length = result
+				# an empty match can still hold the empty
+				# Nonterminals of rules that matched nothing
+				children = match_list(subtree) if length else []
+				if actions:
+					yield [r.action(children)], length
+				else:
+					yield [Nonterminal(self.name, children, length)], length
+
+	# Only the reductions that can start with the next token (or that can
+	# match the empty string) can succeed, so look them up instead of trying
+	# every one. Literal terminals such as 'int' are matched by (interned)
+	# value, and their entries are filled in on first sight since a given
+	# token text always has the same kind; any other token is dispatched on
+	# its kind.
+	def _viable_reductions(self, tokens, start):
+		if self.first_values is None:
+			return self.reductions
+		if start >= len(tokens.values):
+			return self.nullable_reductions
+
+		value_id = tokens.values[start]
+		viable = self.value_dispatch.get(value_id)
+		if viable is None:
+			kind = tokens.kinds[start]
+			if value_id in self.first_values:
+				value = tokens[start].value
+				viable = tuple(r for r in self.reductions
+					if r.nullable or value in r.first or KIND_TYPES[kind] in r.first)
+				self.value_dispatch[value_id] = viable
+			else:
+				viable = self.type_dispatch[kind]
+		return viable
+
+# One precedence level of binary operators for a PrecedenceRule. Operators with
+# a higher binding power bind tighter. Matches at this level produce the same
+# nodes as the rules
+#   <name> ::= <operand> { <tail_name> }
+#   <tail_name> ::= <op> <operand>
+# would, i.e. a Nonterminal named name whose children are the left operand
+# followed by one tail_name Nonterminal per operator.
+class OperatorLevel:
+	def __init__(self, name, tail_name, binding_power, operators, right_assoc=False):
+		self.name = name
+		self.tail_name = tail_name
+		self.binding_power = binding_power
+		self.operators = frozenset(operators)
+		self.right_assoc = right_assoc
+
+# Map the (interned value id of) each operator of the given OperatorLevels to
+# its level.
+def operator_table(levels):
+	operators = {}
+	for level in levels:
+		for op in level.operators:
+			op = intern_value(op)
+			assert op not in operators
+			operators[op] = level
+	return operators
+
+# A Rule for binary expressions over an operator table, parsed by precedence
+# climbing instead of one Rule (and one generator frame) per precedence level.
+#
+# A match yields a single node, but unlike a plain Rule it isn't wrapped in a
+# Nonterminal named after this Rule: an expression without operators is just
+# the operand's node, and otherwise the node is named after the loosest level
+# matched (see OperatorLevel).
+#
+# Alternatives are produced like the equivalent cascade of Rules would: for
+# each alternative of the operand, every way of stopping after an operator's
+# right-hand side is yielded, longest match first.
+#
+# With actions, the value of a match is the operand's value, with every
+# operator after it folded in from left to right by action(operator token,
+# left value, right value), the way abstract_syntax_tree.py reads the nodes.
+class PrecedenceRule(Rule):
+	def __init__(self, name, operand, levels, action=None):
+		super().__init__(name)
+		self.operand = operand
+		self.levels = list(levels)
+		self.operators = operator_table(self.levels)
+		self.action = action
+		self._fold = partial(_fold_precedence, action)
+		# lets compute_first_sets() see through to the operand
+		self.reductions = [Reduction(operand)]
+
+	def _descend(self, tokens, start, memo, actions):
+		operand = partial(self.operand.descend, memo=memo, actions=actions)
+		return climb(operand, self.operators, tokens, start, 0, self._fold if actions else _build_precedence)
+
+# Precedence climbing for PrecedenceRule, as a parse generator (see drive()).
+# Yields every match starting at tokens[start] that only uses operators with a
+# binding power of at least min_bp outside of its operands. operand(tokens,
+# start) returns a parse generator over the operand matches the way
+# Rule.descend does, and operators maps each operator to its OperatorLevel.
+# build(first operand, operators and right-hand sides) makes a match out of
+# them, a node by default (see _build_precedence).
+def climb(operand, operators, tokens, start, min_bp, build=None):
+	if build is None:
+		build = _build_precedence
+	num_tokens = len(tokens)
+	operands = operand(tokens, start)
+	while True:
+		result = yield operands
+		if result is None:
+			return
+		node, length = result
+		first = node[0]
+		# the operators and right-hand sides matched so far, as a linked
+		# list (previous, level, operator token, rhs node) so choice points
+		# can share it
+		tails = None
+		# operators after a right-hand side must bind looser than the one
+		# before it, or that right-hand side would have taken them
+		max_bp = None
+		# choice points (tails, length, level, operator token, generator
+		# over right-hand sides)
+		match_state = []
+
+		while True:
+			pos = start + length
+			level = None
+			if pos < num_tokens:
+				level = operators.get(tokens.values[pos])
+
+			if level is not None and level.binding_power >= min_bp \
+					and (max_bp is None or level.binding_power <= max_bp):
+				rhs_bp = level.binding_power if level.right_assoc else level.binding_power + 1
+				g = climb(operand, operators, tokens, pos + 1, rhs_bp, build)
+				match_state.append((tails, length, level, tokens[pos], g))
+			else:
+				yield [build(first, tails)], length
+
+			# advance the innermost choice point to its next right-hand
+			# side; once it runs out, stopping just before its operator is
+			# the last alternative left there
+			while len(match_state) > 0:
+				prev_tails, prev_length, level, op, g = match_state[-1]
+				result = yield g
+				if result is None:
+					match_state.pop()
+					yield [build(first, prev_tails)], prev_length
+					continue
+				rhs, rhs_len = result
+				tails = (prev_tails, level, op, rhs[0])
+				length = prev_length + 1 + rhs_len
+				max_bp = level.binding_power - 1 if level.right_assoc else level.binding_power
+				break
+			else:
+				# on to the operand's next alternative
+				break
+
+# Turn the first operand and the operators/right-hand sides matched after it
+# into nodes, one per run of operators of the same level.
+def _build_precedence(first, tails):
+	matched = []
+	while tails is not None:
+		tails, level, op, rhs = tails
+		matched.append((level, op, rhs))
+	matched.reverse()
+
+	node = first
+	num_terminals = first.num_terminals
+	i = 0
+	while i < len(matched):
+		level = matched[i][0]
+		children = [node]
+		while i < len(matched) and matched[i][0] is level:
+			_, op, rhs = matched[i]
+			children.append(Nonterminal(level.tail_name, [Terminal(op), rhs], 1 + rhs.num_terminals))
+			num_terminals += 1 + rhs.num_terminals
+			i += 1
+		node = Nonterminal(level.name, children, num_terminals)
+	return node
+
+# The value of the same, with actions: the first operand's value with each
+# operator applied to it in turn by action. Without an action, any operator
+# makes the value None, like a reduction without one.
+def _fold_precedence(action, first, tails):
+	if tails is None:
+		return first
+	if action is None:
+		return None
+	matched = []
+	while tails is not None:
+		tails, _, op, rhs = tails
+		matched.append((op, rhs))
+	value = first
+	for op, rhs in reversed(matched):
+		value = action(op, value, rhs)
+	return value
+
+# Every Rule and Reduction reachable from top_rule, as two lists.
+def grammar_parts(top_rule):
+	rules = []
+	reductions = []
+	seen = set()
+	stack = [top_rule]
+	while len(stack) > 0:
+		part = stack.pop()
+		if id(part) in seen:
+			continue
+		seen.add(id(part))
+		if isinstance(part, Rule):
+			rules.append(part)
+			stack.extend(reversed(part.reductions))
+		elif isinstance(part, Reduction):
+			reductions.append(part)
+			stack.extend(r for r in reversed(part.reduction) if isinstance(r, (Rule, Reduction)))
+	return rules, reductions
+
+# Compute the FIRST set and nullable flag of every Rule and Reduction
+# reachable from top_rule, and build each Rule's lookahead dispatch tables.
+# FIRST sets hold the grammar's terminals as written: literal strings and TYPES
+# members. Call once the grammar is complete.
+def compute_first_sets(top_rule):
+	rules, reductions = grammar_parts(top_rule)
+
+	first = {id(part): set() for part in rules + reductions}
+	nullable = {id(part): False for part in rules + reductions}
+
+	# the usual fixed point: keep propagating until nothing changes
+	changed = True
+	while changed:
+		changed = False
+		for red in reductions:
+			f = first[id(red)]
+			size = len(f)
+			is_nullable = True
+			for r in red.reduction:
+				if isinstance(r, (Rule, Reduction)):
+					f |= first[id(r)]
+					if not nullable[id(r)]:
+						is_nullable = False
+						break
+				else:
+					f.add(r)
+					is_nullable = False
+					break
+			# optional parts and repetitions may always match nothing
+			if isinstance(red, (OptionalReduction, RepetitionReduction)):
+				is_nullable = True
+			if len(f) != size or is_nullable != nullable[id(red)]:
+				nullable[id(red)] = is_nullable
+				changed = True
+		for rule in rules:
+			f = first[id(rule)]
+			size = len(f)
+			is_nullable = nullable[id(rule)]
+			for red in rule.reductions:
+				f |= first[id(red)]
+				is_nullable = is_nullable or nullable[id(red)]
+			if len(f) != size or is_nullable != nullable[id(rule)]:
+				nullable[id(rule)] = is_nullable
+				changed = True
+
+	for part in rules + reductions:
+		part.first = frozenset(first[id(part)])
+		part.nullable = nullable[id(part)]
+
+	for rule in rules:
+		rule.nullable_reductions = tuple(r for r in rule.reductions if r.nullable)
+		rule.first_values = frozenset(intern_value(t) for t in rule.first if isinstance(t, str))
+		rule.value_dispatch = {}
+		rule.type_dispatch = [tuple(r for r in rule.reductions if r.nullable or t in r.first)
+			for t in KIND_TYPES]
+
+# The replayable result sequence of one (rule or reduction, position) pair.
+# The underlying generator is only advanced when a consumer asks for a result
+# nobody has asked for yet, so alternatives are still produced lazily and in
+# the same order as without memoization.
+class _MemoEntry:
+	def __init__(self, generator):
+		self.generator = generator
+		self.results = []
+
+	def replay(self):
+		i = 0
+		while True:
+			if i == len(self.results):
+				if self.generator is None:
+					return
+				result = yield self.generator
+				if result is None:
+					self.generator = None
+					return
+				self.results.append(result)
+			yield self.results[i]
+			i += 1
+
+# Packrat memo table for descend() and reduce(), keyed by (rule or reduction
+# identity, absolute token index). Every rule or reduction is expanded at most
+# once per token position, and later attempts at the same position replay the
+# recorded alternatives instead of re-deriving them.
+class PackratCache:
+	def __init__(self):
+		self.table = {}
+		self.hits = 0
+		self.misses = 0
+		# per rule name: [hits, misses]
+		self.rule_counts = {}
+
+	def begin(self, tokens):
+		self.table.clear()
+
+	def lookup(self, owner, tokens, start, produce, actions):
+		key = (id(owner), start)
+		entry = self.table.get(key)
+		hit = entry is not None
+		if hit:
+			self.hits += 1
+		else:
+			self.misses += 1
+			entry = _MemoEntry(produce(tokens, start, self, actions))
+			self.table[key] = entry
+
+		if isinstance(owner, Rule):
+			counts = self.rule_counts.setdefault(owner.name, [0, 0])
+			counts[0 if hit else 1] += 1
+
+		return entry.replay()
+
+	def report(self):
+		lookups = self.hits + self.misses
+		rate = 100.0 * self.hits / lookups if lookups else 0.0
+		lines = [f"packrat cache: {lookups} lookups, {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), {len(self.table)} entries"]
+		counts = sorted(self.rule_counts.items(), key=lambda item: -item[1][0])
+		for name, (hits, misses) in counts:
+			lines.append(f"  {name:<28} hits {hits:>9} misses {misses:>9}")
+		return '\n'.join(lines)
+
+
+# What a ParseProfiler counts for one Rule or Reduction.
+class _ProfileStats:
+	__slots__ = ('attempts', 'successes', 'failures', 'matches', 'backtracks', 'wasted_tokens', 'seconds')
+
+	def __init__(self):
+		self.attempts = 0
+		self.successes = 0
+		self.failures = 0
+		self.matches = 0
+		self.backtracks = 0
+		self.wasted_tokens = 0
+		self.seconds = 0.0
+
+# Backtracking profiler, passed to parse() in place of a PackratCache: every
+# descend() and reduce() goes through lookup(), which wraps the generator it
+# returns to count, per Rule and per Reduction,
+# - attempts: times it was tried at some position (each creating a generator;
+#   a repetition's body generators are part of the repetition's attempt)
+# - successes and failures: attempts that matched at least once, and never
+# - matches: alternatives yielded, counting ones found after backtracking
+# - backtracks: times its caller came back for another alternative, i.e. a
+#   choice point popped off a match_state stack
+# - wasted tokens: the tokens covered by the matches given up that way,
+#   unless a longer match came next (which is how a repetition grows, so that
+#   is counted as extending the match rather than redoing it)
+# - seconds: time spent in its own generator, not counting the ones it called
+# The same self time is also kept per stack of rules and reductions, for a
+# flamegraph.
+class ParseProfiler:
+	def __init__(self, top_rule):
+		self.stats = {}
+		# id(part) -> (frame name, description, part)
+		self.labels = {}
+		rules, _ = grammar_parts(top_rule)
+		for rule in rules:
+			self.labels[id(rule)] = (rule.name, f'<{rule.name}>', rule)
+			if isinstance(rule, PrecedenceRule):
+				continue
+			for k, red in enumerate(rule.reductions):
+				self._label_reduction(red, f'{rule.name}/{k}', f'<{rule.name}> ::=')
+		# the stack of generators being advanced: [path id, seconds spent in
+		# generators they advanced]
+		self._stack = []
+		# path id -> (parent path id, frame name), and back
+		self._paths = [(None, None)]
+		self._path_ids = {}
+		self._path_seconds = [0.0]
+
+	def _label_reduction(self, red, name, context):
+		description = f'{context} {_describe_reduction(red)}'
+		self.labels[id(red)] = (name, description, red)
+		for j, part in enumerate(red.reduction):
+			if isinstance(part, Reduction):
+				self._label_reduction(part, f'{name}.{j}', description + ' >')
+
+	def begin(self, tokens):
+		pass
+
+	def lookup(self, owner, tokens, start, produce, actions):
+		stats = self.stats.get(id(owner))
+		if stats is None:
+			stats = self.stats[id(owner)] = _ProfileStats()
+			if id(owner) not in self.labels:
+				name = getattr(owner, 'name', None) or type(owner).__name__
+				self.labels[id(owner)] = (name, name, owner)
+		return self._profiled(stats, self.labels[id(owner)][0], produce(tokens, start, self, actions))
+
+	def _profiled(self, stats, name, g):
+		stats.attempts += 1
+		stack = self._stack
+		# length of the match last yielded, None before the first
+		length = None
+		while True:
+			parent = stack[-1][0] if stack else 0
+			path = self._path_ids.get((parent, name))
+			if path is None:
+				path = self._path_ids[(parent, name)] = len(self._paths)
+				self._paths.append((parent, name))
+				self._path_seconds.append(0.0)
+			frame = [path, 0.0]
+			stack.append(frame)
+			t0 = time.perf_counter()
+			# (not in a try/finally: a generator that's abandoned would
+			# run it on being closed)
+			result = yield g
+			elapsed = time.perf_counter() - t0
+			stack.pop()
+			stats.seconds += elapsed - frame[1]
+			self._path_seconds[path] += elapsed - frame[1]
+			if stack:
+				stack[-1][1] += elapsed
+			if result is None:
+				if length is None:
+					stats.failures += 1
+				else:
+					stats.wasted_tokens += length
+				return
+			if length is None:
+				stats.successes += 1
+			elif result[1] <= length:
+				stats.wasted_tokens += length
+			stats.matches += 1
+			length = result[1]
+			yield result
+			# the caller backtracked into us: that match was no good
+			stats.backtracks += 1
+
+	# The parts with the most wasted tokens first, as a table; limit caps the
+	# number of rows.
+	def report(self, limit=40):
+		rows = sorted(self.stats.items(), key=lambda item: (-item[1].wasted_tokens, -item[1].backtracks, -item[1].seconds))
+		total = sum(stats.seconds for stats in self.stats.values())
+		lines = [f"parse profile: {sum(s.attempts for s in self.stats.values())} attempts, "
+			f"{sum(s.backtracks for s in self.stats.values())} backtracks, {total:.3f}s in rules and reductions",
+			f"  {'attempts':>9} {'success':>9} {'fail':>9} {'matches':>9} {'backtrack':>9} {'wasted':>9} {'self s':>8}  rule or reduction"]
+		for part_id, stats in rows[:limit]:
+			_, description, _ = self.labels[part_id]
+			lines.append(f"  {stats.attempts:>9} {stats.successes:>9} {stats.failures:>9} {stats.matches:>9} "
+				f"{stats.backtracks:>9} {stats.wasted_tokens:>9} {stats.seconds:>8.3f}  {description}")
+		if len(rows) > limit:
+			lines.append(f"  ... and {len(rows) - limit} more")
+		return '\n'.join(lines)
+
+	# Self time per stack, in microseconds, in the collapsed stack format
+	# flamegraph.pl and speedscope read: "frame;frame;frame count" lines.
+	def collapsed_stacks(self):
+		lines = []
+		for path in range(1, len(self._paths)):
+			micros = round(self._path_seconds[path] * 1e6)
+			if micros == 0:
+				continue
+			frames = []
+			p = path
+			while p:
+				p, name = self._paths[p]
+				frames.append(name)
+			frames.reverse()
+			lines.append(f"{';'.join(frames)} {micros}")
+		return '\n'.join(lines) + '\n'
+
+# A reduction in roughly the notation of the grammar, e.g.
+# <unary_expression> <assignment_op> <assignment_expression>
+def _describe_reduction(red):
+	parts = []
+	for part in red.reduction:
+		if isinstance(part, Rule):
+			parts.append(f'<{part.name}>')
+		elif isinstance(part, OptionalReduction):
+			parts.append(f'[ {_describe_reduction(part)} ]')
+		elif isinstance(part, RepetitionReduction):
+			parts.append(f'{{ {_describe_reduction(part)} }}')
+		elif isinstance(part, Reduction):
+			parts.append(f'( {_describe_reduction(part)} )')
+		elif isinstance(part, str):
+			parts.append(repr(part))
+		else:
+			parts.append(part.value)
+	return ' '.join(parts) if parts else "''"
+
+
+# Parse generators (what descend(), reduce() and everything they use return)
+# never advance each other themselves, so however deeply the source nests,
+# parsing it doesn't nest Python calls: for the next match of another parse
+# generator g, one does `result = yield g`, and gets back g's next match, or
+# None once g has run out. Matches themselves are yielded as (match, length)
+# tuples; anything else yielded is such a request.
+#
+# This runs them: it's an iterator over the matches of the parse generator g,
+# keeping the generators being advanced on a stack of its own.
+def drive(g):
+	stack = [g]
+	value = None
+	while True:
+		try:
+			out = stack[-1].send(value)
+		except StopIteration:
+			stack.pop()
+			if not stack:
+				return
+			value = None
+			continue
+		if type(out) is not tuple:
+			# a request: run the generator asked for
+			stack.append(out)
+			value = None
+		elif len(stack) > 1:
+			# a match for the generator that asked for it
+			stack.pop()
+			value = out
+		else:
+			yield out
+			value = None
+
+# Pass a PackratCache as memo to parse in packrat mode; its hit/miss counters
+# are left in place afterwards for reporting.
+#
+# With actions, the grammar's semantic actions are run instead of building a
+# parse tree (see Reduction), and what's returned is the top rule's value: for
+# grammar.program, the AST.
+def parse(top_rule, tokens, memo=None, actions=False, **kwargs):
 
+	if memo is not None:
+		memo.begin(tokens)
 
-def parse(top_rule, tokens, **kwargs):
+	return parse_from(top_rule.descend(tokens, 0, memo, actions), tokens)
 
-	g = top_rule.descend(tokens)
+# Drive a parse generator over matches of the top rule (as returned by
+# Rule.descend) until one covers all of the tokens, and return its parse tree
+# (or value).
+def parse_from(g, tokens):
+	g = drive(g)
 	result = next(g, None)
 	# the repetition that is the top rule will return each time it matches a
 	# new repetition, so keep doing that until it's matched the whole
@@ -300,5 +996,4 @@ def parse(top_rule, tokens, **kwargs):
 	if result is None:
 		raise BaseException("Invalid syntax at *shrug*")
 	
-	result[0][0].prune_empty()
 	return result[0][0]
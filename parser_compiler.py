@@ -0,0 +1,303 @@
+import hashlib
+import importlib.util
+import os
+from parser import Rule, Reduction, OptionalReduction, RepetitionReduction
+from parser import PrecedenceRule, grammar_parts
+from tolkien import TYPES
+
+# Compiles the Rule/Reduction graph of grammar.py into a Python module with one
+# generator function per rule, so parsing doesn't have to interpret the grammar
+# objects (isinstance checks, generic backtracking loops) for every element.
+#
+# The generated functions match exactly like Rule.descend and
+# Reduction.reduce: same alternatives, in the same order, building the same
+# Nonterminal/Terminal trees. The differences are all in how they get there:
+# - each rule only tries the reductions its lookahead token can start (see
+#   compute_first_sets())
+# - terminals are compared inline, and reductions made of a single terminal
+#   don't create a generator at all
+# - sequences backtrack through plain nested for loops, so only the rules and
+#   nested reductions (which may have several matches) are choice points
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+GENERATED_PATH = os.path.join(_HERE, 'grammar_compiled.py')
+
+# the generated module depends on all of these, so it's regenerated whenever
+# one of them changes
+_FINGERPRINT_SOURCES = ['grammar.py', 'parser.py', 'parser_compiler.py', 'tolkien.py']
+
+_HEADER = '# generated by parser_compiler.py from grammar.py, do not edit\n'
+
+# Hash of the given source files (relative to this directory), for telling
+# whether something generated from them is stale.
+def grammar_fingerprint(sources=_FINGERPRINT_SOURCES):
+	h = hashlib.sha256()
+	for name in sources:
+		with open(os.path.join(_HERE, name), 'rb') as f:
+			h.update(f.read())
+	return h.hexdigest()
+
+# Return the compiled parser module for grammar.py, generating it first if
+# there is no up-to-date copy at path. The module's parse(tokens) is a drop-in
+# for parser.parse(program, tokens).
+def load_compiled_parser(path=GENERATED_PATH):
+	fingerprint = grammar_fingerprint()
+	stamp = f'# fingerprint: {fingerprint}\n'
+
+	current = False
+	if os.path.exists(path):
+		with open(path) as f:
+			current = f.readline() == _HEADER and f.readline() == stamp
+
+	if not current:
+		# grammar.py builds the grammar at import time, so only import it
+		# when it's actually needed
+		from grammar import program
+		source = _HEADER + stamp + compile_grammar(program)
+		# write to a temporary file first so a concurrent compile never
+		# imports half a module
+		tmp_path = f'{path}.{os.getpid()}.tmp'
+		with open(tmp_path, 'w') as f:
+			f.write(source)
+		os.replace(tmp_path, path)
+
+	spec = importlib.util.spec_from_file_location('grammar_compiled', path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+# Return the source of a parser module for the grammar rooted at top_rule.
+# compute_first_sets() must have been run on it.
+def compile_grammar(top_rule):
+	return _GrammarCompiler(top_rule).source()
+
+class _GrammarCompiler:
+	def __init__(self, top_rule):
+		self.top_rule = top_rule
+		self.rules, reductions = grammar_parts(top_rule)
+		# nested reductions get their own functions, named by position in
+		# the grammar
+		self.reduction_names = {}
+		for r in reductions:
+			self.reduction_names[id(r)] = f'_reduction_{len(self.reduction_names)}'
+		self.constants = []
+		self.constant_names = {}
+
+	def source(self):
+		body = []
+		for rule in self.rules:
+			body += self._rule(rule)
+		nested = set()
+		for rule in self.rules:
+			if isinstance(rule, PrecedenceRule):
+				continue
+			for red in rule.reductions:
+				if type(red) is Reduction:
+					for r in red.reduction:
+						self._collect_nested(r, nested)
+				else:
+					self._collect_nested(red, nested)
+		for red in self._ordered(nested):
+			body += self._nested_reduction(red)
+
+		lines = [
+			'from parser import Nonterminal, Terminal, OperatorLevel',
+			'from parser import operator_table, climb, repeat, match_list, parse_from',
+			'from tolkien import KINDS, intern_value',
+			'',
+		]
+		lines += self.constants
+		lines += ['']
+		lines += body
+		lines += [
+			'def parse(tokens):',
+			f'\treturn parse_from(rule_{self.top_rule.name}(tokens, 0), tokens)',
+			'',
+		]
+		return '\n'.join(lines)
+
+	def _collect_nested(self, r, nested):
+		if isinstance(r, Reduction) and id(r) not in nested:
+			nested.add(id(r))
+			for part in r.reduction:
+				self._collect_nested(part, nested)
+
+	def _ordered(self, nested):
+		_, reductions = grammar_parts(self.top_rule)
+		return [r for r in reductions if id(r) in nested]
+
+	# module-level constant holding the result of the expression source
+	def _constant(self, source):
+		if source not in self.constant_names:
+			name = f'_C{len(self.constant_names)}'
+			self.constant_names[source] = name
+			self.constants.append(f'{name} = {source}')
+		return self.constant_names[source]
+
+	def _rule(self, rule):
+		if isinstance(rule, PrecedenceRule):
+			return self._precedence_rule(rule)
+
+		lines = [
+			f'def rule_{rule.name}(tokens, start):',
+			'\tvalues = tokens.values',
+			'\tkinds = tokens.kinds',
+			'\tnum_tokens = len(values)',
+			'\tif start < num_tokens:',
+			'\t\tvalue = values[start]',
+			'\t\tkind = kinds[start]',
+			'\telse:',
+			'\t\tvalue = kind = None',
+		]
+		for red in rule.reductions:
+			lines += self._rule_reduction(rule, red)
+		# a generator function needs a yield even if nothing can match
+		lines += ['\treturn', '\tyield', '']
+		return lines
+
+	# one alternative of a rule, inlined into the rule's function behind a
+	# lookahead check
+	def _rule_reduction(self, rule, red):
+		parts = red.reduction
+		wrap = lambda children, length: f'[Nonterminal({rule.name!r}, {children}, {length})]'
+
+		# (nested) Optional and Repetition reductions have their own
+		# semantics, so call them instead of inlining their parts
+		if type(red) is not Reduction:
+			lines = self._for_matches('\t', 'm', 'n', f'{self.reduction_names[id(red)]}(tokens, start)', '')
+			lines.append(f'\t\tyield {wrap("match_list(m)", "n")}, n')
+			return self._guarded(red, lines)
+
+		if len(parts) == 0:
+			return [f'\tyield {wrap("[]", "0")}, 0']
+
+		# a lone terminal: no generator, no backtracking
+		if len(parts) == 1 and not isinstance(parts[0], (Rule, Reduction)):
+			return [
+				f'\tif {self._terminal_test("value", "kind", parts[0])}:',
+				f'\t\tyield {wrap("[Terminal(tokens[start])]", "1")}, 1',
+			]
+
+		lines = self._sequence(parts, 1, lambda children, length: f'yield {wrap(children, length)}, {length}')
+		return self._guarded(red, lines)
+
+	def _guarded(self, red, lines):
+		if red.nullable:
+			return lines
+		tests = []
+		values = sorted(t for t in red.first if isinstance(t, str))
+		types = sorted(t.value for t in red.first if isinstance(t, TYPES))
+		if len(values) == 1:
+			tests.append(f'value == {self._value_code(values[0])}')
+		elif len(values) > 1:
+			tests.append(f'value in {self._constant(f"frozenset(map(intern_value, {values!r}))")}')
+		if len(types) == 1:
+			tests.append(f'kind == {self._kind_code(types[0])}')
+		elif len(types) > 1:
+			tests.append(f'kind in {self._constant(f"frozenset(KINDS[t] for t in {types!r})")}')
+		if len(tests) == 0:
+			return []
+		return [f'\tif {" or ".join(tests)}:'] + ['\t' + line for line in lines]
+
+	# terminals are compared by their integer codes in the TokenStream: the
+	# interned id of literal values, the kind of TYPES
+	def _terminal_test(self, value, kind, r):
+		if isinstance(r, str):
+			return f'{value} == {self._value_code(r)}'
+		return f'{kind} == {self._kind_code(r.value)}'
+
+	def _value_code(self, text):
+		return self._constant(f'intern_value({text!r})')
+
+	def _kind_code(self, typename):
+		return self._constant(f'KINDS[{typename!r}]')
+
+	# Nested loops matching parts in order from start; every complete match
+	# is passed to emit as (children list expression, length expression).
+	def _sequence(self, parts, depth, emit):
+		lines = ['\t' * depth + 'p0 = start']
+		children = []
+		for i, r in enumerate(parts):
+			indent = '\t' * (depth + i)
+			if isinstance(r, Rule):
+				call = f'rule_{r.name}'
+			elif isinstance(r, Reduction):
+				call = self.reduction_names[id(r)]
+			else:
+				test = self._terminal_test(f'values[p{i}]', f'kinds[p{i}]', r)
+				lines += [
+					f'{indent}if p{i} < num_tokens and {test}:',
+					f'{indent}\tt{i} = Terminal(tokens[p{i}])',
+					f'{indent}\tp{i + 1} = p{i} + 1',
+				]
+				children.append(f't{i}')
+				continue
+			lines += self._for_matches(indent, f'm{i}', f'n{i}', f'{call}(tokens, p{i})', i)
+			lines.append(f'{indent}\tp{i + 1} = p{i} + n{i}')
+			# a nested repetition's matches are match lists, and a
+			# rule that matched nothing is left out
+			if not isinstance(r, Rule):
+				children.append(f'*match_list(m{i})')
+			elif r.nullable:
+				children.append(f'*(m{i} if n{i} else ())')
+			else:
+				children.append(f'*m{i}')
+		indent = '\t' * (depth + len(parts))
+		lines.append(indent + emit(f'[{", ".join(children)}]', f'p{len(parts)} - start'))
+		return lines
+
+	# The head of a loop over the matches of the parse generator call
+	# returns, into match and length: parse generators ask for each other's
+	# matches by yielding the generator (see parser.drive()) rather than
+	# iterating over them. The body goes one tab in from indent.
+	def _for_matches(self, indent, match, length, call, suffix):
+		return [
+			f'{indent}g{suffix} = {call}',
+			f'{indent}while True:',
+			f'{indent}\tr{suffix} = yield g{suffix}',
+			f'{indent}\tif r{suffix} is None:',
+			f'{indent}\t\tbreak',
+			f'{indent}\t{match}, {length} = r{suffix}',
+		]
+
+	def _nested_reduction(self, red):
+		name = self.reduction_names[id(red)]
+		if isinstance(red, RepetitionReduction):
+			lines = [
+				f'def {name}(tokens, start):',
+				f'\treturn repeat({name}_body, tokens, start)',
+				'',
+				f'def {name}_body(tokens, start):',
+			]
+		else:
+			lines = [f'def {name}(tokens, start):']
+
+		if len(red.reduction) == 0:
+			lines.append('\tyield [], 0')
+		else:
+			lines += [
+				'\tvalues = tokens.values',
+				'\tkinds = tokens.kinds',
+				'\tnum_tokens = len(values)',
+			]
+			lines += self._sequence(red.reduction, 1, lambda children, length: f'yield {children}, {length}')
+
+		if isinstance(red, OptionalReduction):
+			lines.append('\tyield [], 0')
+		lines.append('')
+		return lines
+
+	def _precedence_rule(self, rule):
+		levels = f'_operators_{rule.name}'
+		lines = [f'{levels} = operator_table([']
+		for level in rule.levels:
+			lines.append(f'\tOperatorLevel({level.name!r}, {level.tail_name!r}, '
+				     f'{level.binding_power!r}, {sorted(level.operators)!r}, {level.right_assoc!r}),')
+		lines.append('])')
+		self.constants += lines
+		return [
+			f'def rule_{rule.name}(tokens, start):',
+			f'\treturn climb(rule_{rule.operand.name}, {levels}, tokens, start, 0)',
+			'',
+		]
@@ -0,0 +1,123 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Measuring the passes of a compile for main.py's --time-passes and
+# --memory-report: wall and CPU time, and with tracemalloc the peak memory,
+# the memory still held afterwards and where it was allocated, for each pass.
+#
+# main.py wraps each pass in `with recorder.stage(name):`. Without either flag
+# the recorder is NO_RECORDER, whose stage() hands back the same do-nothing
+# context manager every time, so the passes run exactly as they would without
+# the hooks.
+
+# allocation sites reported per pass
+TOP_SITES = 5
+
+class _NoRecorder:
+	def stage(self, name):
+		return _NO_STAGE
+
+	def report(self):
+		return None
+
+	def finish(self):
+		pass
+
+_NO_STAGE = nullcontext()
+NO_RECORDER = _NoRecorder()
+
+class PassRecorder:
+	def __init__(self, memory=False):
+		self.memory = memory
+		# one dict per pass run, in order
+		self.passes = []
+		self._snapshot = None
+		if memory:
+			tracemalloc.start()
+			self._snapshot = tracemalloc.take_snapshot()
+
+	@contextmanager
+	def stage(self, name):
+		record = {'name': name}
+		self.passes.append(record)
+		if self.memory:
+			before, _ = tracemalloc.get_traced_memory()
+			tracemalloc.reset_peak()
+		wall = time.perf_counter()
+		cpu = time.process_time()
+		try:
+			yield
+		except BaseException:
+			record['failed'] = True
+			raise
+		finally:
+			record['wall_seconds'] = time.perf_counter() - wall
+			record['cpu_seconds'] = time.process_time() - cpu
+			if self.memory:
+				current, peak = tracemalloc.get_traced_memory()
+				record['peak_bytes'] = peak - before
+				record['retained_bytes'] = current - before
+				snapshot = tracemalloc.take_snapshot()
+				record['top_sites'] = _top_sites(snapshot, self._snapshot)
+				self._snapshot = snapshot
+
+	def finish(self):
+		if self.memory:
+			tracemalloc.stop()
+
+	# The measurements as plain data, for JSON.
+	def report(self):
+		return {
+			'passes': self.passes,
+			'total': {
+				'wall_seconds': sum(p['wall_seconds'] for p in self.passes),
+				'cpu_seconds': sum(p['cpu_seconds'] for p in self.passes),
+			},
+		}
+
+# The allocation sites that grew most from old to new, as plain data.
+def _top_sites(new, old):
+	# the snapshots themselves, and this module, aren't part of the compile
+	filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+	stats = new.filter_traces(filters).compare_to(old.filter_traces(filters), 'lineno')
+	sites = []
+	for stat in stats[:TOP_SITES]:
+		if stat.size_diff <= 0:
+			break
+		frame = stat.traceback[0]
+		sites.append({'site': f'{frame.filename}:{frame.lineno}', 'bytes': stat.size_diff, 'blocks': stat.count_diff})
+	return sites
+
+# The report as a table, for people.
+def format_report(report):
+	memory = any('peak_bytes' in p for p in report['passes'])
+	header = f"{'pass':<10}{'wall s':>10}{'cpu s':>10}"
+	if memory:
+		header += f"{'peak KiB':>12}{'retained KiB':>14}"
+	lines = [header]
+	for p in report['passes']:
+		line = f"{p['name']:<10}{p['wall_seconds']:>10.4f}{p['cpu_seconds']:>10.4f}"
+		if memory:
+			line += f"{p['peak_bytes'] / 1024:>12.1f}{p['retained_bytes'] / 1024:>14.1f}"
+		if p.get('failed'):
+			line += "  (failed)"
+		lines.append(line)
+	total = report['total']
+	lines.append(f"{'total':<10}{total['wall_seconds']:>10.4f}{total['cpu_seconds']:>10.4f}")
+	if memory:
+		lines.append('')
+		lines.append('allocations still held after each pass, by site:')
+		for p in report['passes']:
+			for site in p['top_sites']:
+				lines.append(f"  {p['name']:<10}{site['bytes'] / 1024:>10.1f} KiB {site['blocks']:>8} blocks  {site['site']}")
+	return '\n'.join(lines)
+
+# Print the report to stderr, and write it as JSON to json_path if given.
+def write_report(report, json_path=None):
+	print(format_report(report), file=sys.stderr)
+	if json_path is not None:
+		with open(json_path, 'w') as f:
+			json.dump(report, f, indent=1)
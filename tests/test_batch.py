@@ -0,0 +1,74 @@
+import os
+import pytest
+import tokenizer
+import batch
+from grammar import program
+from parser import parse
+from abstract_syntax_tree import to_ast
+from benchmarks.generator import generate_program
+
+# What compiling source on its own writes for each kind of output.
+def expected_outputs(source):
+	tokens = tokenizer.tokenize(source)
+	tree = parse(program, tokens)
+	return {
+		'tokens': ''.join(f"{token.typename} l:{token.line} c:{token.col} --- {token}\n" for token in tokens),
+		'tree': str(tree),
+		'ast': str(to_ast(tree)),
+	}
+
+def write_sources(directory, count):
+	paths = []
+	for k in range(count):
+		path = directory / f'file{k}.c'
+		path.write_text(generate_program(functions=3, ast_compatible=True, seed=k))
+		paths.append(str(path))
+	return paths
+
+# A directory for outputs, made like main.py makes it.
+def output_dir(directory, name):
+	path = str(directory / name)
+	os.makedirs(path)
+	return path
+
+def read_outputs(path, output_dir):
+	outputs = {}
+	for kind in ('tokens', 'tree', 'ast'):
+		with open(batch.output_path(path, kind, output_dir)) as f:
+			outputs[kind] = f.read()
+	return outputs
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_outputs_match_single_compiles(tmp_path, jobs):
+	paths = write_sources(tmp_path, 4)
+	out = output_dir(tmp_path, 'out')
+	results = batch.compile_files(paths, jobs=jobs, outputs=('tokens', 'tree', 'ast'), output_dir=out)
+	assert [r.path for r in results] == paths
+	for path, result in zip(paths, results):
+		assert result.error is None
+		with open(path) as f:
+			assert read_outputs(path, out) == expected_outputs(f.read())
+
+def test_failing_file_doesnt_stop_the_others(tmp_path):
+	paths = write_sources(tmp_path, 2)
+	bad = tmp_path / 'bad.c'
+	bad.write_text('int f(int a) { a = "1; }\n')
+	paths.insert(1, str(bad))
+	results = batch.compile_files(paths, outputs=('ast',), output_dir=output_dir(tmp_path, 'out'))
+	assert [r.error is None for r in results] == [True, False, True]
+	assert results[1].error.startswith('LexError:')
+	summary = batch.format_summary(results, 1.0)
+	assert '3 files, 1 failed' in summary
+
+def test_cache_hits_match_misses(tmp_path):
+	paths = write_sources(tmp_path, 3)
+	cache_dir = str(tmp_path / 'cache')
+	outputs = ('tokens', 'tree', 'ast')
+	first_dir = output_dir(tmp_path, 'first')
+	second_dir = output_dir(tmp_path, 'second')
+	first = batch.compile_files(paths, outputs=outputs, output_dir=first_dir, cache_dir=cache_dir)
+	second = batch.compile_files(paths, outputs=outputs, output_dir=second_dir, cache_dir=cache_dir)
+	assert not any(r.cached for r in first)
+	assert all(r.cached for r in second)
+	for path in paths:
+		assert read_outputs(path, second_dir) == read_outputs(path, first_dir)
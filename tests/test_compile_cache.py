@@ -0,0 +1,75 @@
+import os
+import pickle
+import zlib
+import compile_cache
+import tokenizer
+from grammar import program
+from parser import parse
+from abstract_syntax_tree import to_ast
+from compile_cache import CompileCache
+from benchmarks.generator import generate_program
+
+def cache_size(directory):
+	return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+def test_eviction_scans_rarely_and_keeps_the_bound(tmp_path, monkeypatch):
+	scans = []
+	scandir = os.scandir
+	def counting_scandir(path):
+		scans.append(path)
+		return scandir(path)
+	monkeypatch.setattr(compile_cache.os, 'scandir', counting_scandir)
+
+	cache = CompileCache(str(tmp_path), max_bytes=20000)
+	for k in range(200):
+		source = f'int f{k}(int a) {{ return a + {k}; }}\n'
+		cache.store(source, tokenizer.tokenize(source), None, None)
+		assert cache_size(tmp_path) <= cache.max_bytes
+	assert len(scans) < 20
+	# the most recent entries are the ones kept
+	assert cache.load(source) is not None
+	first = 'int f0(int a) { return a + 0; }\n'
+	assert cache.load(first) is None
+
+def compile_source(source):
+	tokens = tokenizer.tokenize(source)
+	tree = parse(program, tokens)
+	return tokens, tree, to_ast(tree)
+
+def token_tuples(tokens):
+	return [(t.typename, t.value, t.offset, t.line, t.col) for t in tokens]
+
+def test_hit_matches_miss(tmp_path):
+	source = generate_program(functions=20, ast_compatible=True, seed=3)
+	tokens, tree, ast = compile_source(source)
+	cache = CompileCache(str(tmp_path))
+	assert cache.load(source) is None
+	cache.store(source, tokens, tree, ast)
+
+	cached_tokens, cached_tree, cached_ast = cache.load(source)
+	assert token_tuples(cached_tokens) == token_tuples(tokens)
+	assert list(cached_tokens.matching) == list(tokens.matching)
+	assert str(cached_tree) == str(tree)
+	assert str(cached_ast) == str(ast)
+
+def test_entry_without_tree_or_ast(tmp_path):
+	source = 'int f(int a) { a = a + 1; }\n'
+	tokens = tokenizer.tokenize(source)
+	cache = CompileCache(str(tmp_path))
+	cache.store(source, tokens, None, None)
+	cached_tokens, cached_tree, cached_ast = cache.load(source)
+	assert token_tuples(cached_tokens) == token_tuples(tokens)
+	assert cached_tree is None and cached_ast is None
+
+def test_backends_have_entries_of_their_own(tmp_path):
+	source = 'int f(int a) { a = a + 1; }\n'
+	CompileCache(str(tmp_path)).store(source, *compile_source(source))
+	assert CompileCache(str(tmp_path), parser_name="lalr").load(source) is None
+
+def test_entry_that_doesnt_decode_is_a_miss(tmp_path):
+	source = 'int f(int a) { a = a + 1; }\n'
+	cache = CompileCache(str(tmp_path))
+	cache.store(source, *compile_source(source))
+	with open(cache._path(source), 'wb') as f:
+		f.write(zlib.compress(pickle.dumps({'tokens': None})))
+	assert cache.load(source) is None
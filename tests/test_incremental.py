@@ -0,0 +1,88 @@
+import random
+import re
+import pytest
+import tokenizer
+from grammar import program
+from parser import parse
+from abstract_syntax_tree import to_ast
+from incremental import IncrementalParse
+from benchmarks.generator import generate_program
+
+def full_ast(source):
+	return str(to_ast(parse(program, tokenizer.tokenize(source))))
+
+def test_unterminated_quote_then_closed():
+	session = IncrementalParse('int f(int a) { a = 1; }\n')
+	with pytest.raises(tokenizer.LexError) as e:
+		session.edit(19, 0, '"')
+	assert e.value.source == 'int f(int a) { a = "1; }\n'
+	assert session.source == 'int f(int a) { a = "1; }\n'
+	assert session.tree is None
+
+	# still half-typed: the edit lands in the buffer as it is now
+	with pytest.raises(tokenizer.LexError):
+		session.edit(20, 0, 'x')
+	assert session.source == 'int f(int a) { a = "x1; }\n'
+
+	session.edit(22, 0, '"')
+	assert session.source == 'int f(int a) { a = "x1"; }\n'
+	assert str(session.ast()) == full_ast(session.source)
+
+# Edits (offset, deleted, inserted) to source, mostly ones that keep it a
+# program: statements and declarations added or removed, names and numbers
+# changed, and now and then a character or two typed anywhere.
+def random_edit(rng, source):
+	kind = rng.random()
+	if kind < 0.25:
+		# a statement at the start of a function body
+		offset = rng.choice([k + 1 for k, c in enumerate(source) if c == '{'] or [0])
+		return offset, 0, rng.choice([' a = b;', ' x = x + 1;', ' y *= (a - 2);', ' ;'])
+	if kind < 0.4:
+		# a whole function, between two
+		offset = rng.choice([0] + [k + 2 for k, c in enumerate(source) if source.startswith('}\n', k)])
+		return offset, 0, rng.choice(['int h(int q) { q = 1; }\n', 'int g;\n'])
+	if kind < 0.55:
+		# a statement removed
+		ends = [k + 1 for k, c in enumerate(source) if c == ';']
+		if ends:
+			end = rng.choice(ends)
+			start = max(source.rfind(c, 0, end - 1) for c in ';{}') + 1
+			return start, end - start, ''
+	if kind < 0.8:
+		# a name or number replaced
+		words = [m for m in re.finditer(r'\w+', source)]
+		if words:
+			m = rng.choice(words)
+			return m.start(), len(m[0]), rng.choice(['a', 'b2', 'longer_name', '7', '1234'])
+	offset = rng.randrange(len(source) + 1)
+	return offset, min(rng.choice([0, 1, 2]), len(source) - offset), rng.choice(['', ' ', 'x', ';', '(', '}', '"', '+'])
+
+def test_edit_sequences_match_full_parse():
+	rng = random.Random(0)
+	for session in range(30):
+		source = generate_program(functions=4, statements=3, expression_depth=2, ast_compatible=True, seed=session)
+		incremental = IncrementalParse(source)
+		undo = None
+		for _ in range(20):
+			if undo is not None and rng.random() < 0.7:
+				# like fixing a typo: take back the edit that broke it
+				offset, deleted, inserted = undo
+			else:
+				offset, deleted, inserted = random_edit(rng, source)
+			undo = offset, len(inserted), source[offset:offset + deleted]
+			source = source[:offset] + inserted + source[offset + deleted:]
+			try:
+				expected = parse(program, tokenizer.tokenize(source))
+			except BaseException:
+				expected = None
+			try:
+				incremental.edit(offset, deleted, inserted)
+			except BaseException:
+				assert expected is None
+			assert incremental.source == source
+			if expected is None:
+				assert incremental.tree is None
+				continue
+			undo = None
+			assert str(incremental.tree) == str(expected)
+			assert str(incremental.ast()) == str(to_ast(expected))
@@ -0,0 +1,117 @@
+import os
+import random
+import re
+import pytest
+import tokenizer
+import dfa_lexer
+import vectorized_lexer
+from benchmarks.generator import generate_program
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+def read(name):
+	with open(os.path.join(_HERE, '..', name)) as f:
+		return f.read()
+
+# Source with every kind of token, but no 0x, 0b or 0o literals (see
+# test_dfa_reads_radix_prefixes_whole).
+MIXED = ('#include <stdio.h>\n'
+	'/* a comment\n over two lines with * and / in it */\n'
+	"int main() { // \xfcber\n"
+	"\tchar c = '\\n'; char *s = \"a \\\"quoted\\\" \\x41 string\";\n"
+	"\tlong n = 1'000'000; float f = 1.5 + .25 + 3.;\n"
+	'\tif (n >= 10 && n != 3) { n <<= 1; n >>= 2; n++; } else return n;\n'
+	'\twhile (!n || ~n) break;\u3000\xa0\n'
+	'\tswitch (n) { case 1: n ^= n % 2 ? n : -n; }\n'
+	'}\n')
+
+FRAGMENTS = ['int', 'if', 'else', 'x', 'y1', '_z', '0', '12', "1'2", '3.5', '.5', '"s"', "'c'", '"', "'",
+	'/*', '*/', '//', '#', '\n', ' ', '\t', '\xa0', '+', '-', '*', '/', '=', '==', '<', '<<', '<=', '&&', '|',
+	'(', ')', '[', ']', '{', '}', ';', ',', '.', '?', ':', '!', '~', '@', '$', '\\', '\xe9']
+
+# Random runs of FRAGMENTS, leaving out the ones with a radix prefix.
+def fuzz_sources(count, seed=0):
+	rng = random.Random(seed)
+	for _ in range(count):
+		source = ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randrange(1, 40)))
+		if not re.search('0[xXbBoO]', source):
+			yield source
+
+def token_tuples(tokens):
+	return [(t.typename, t.value, t.offset, t.line, t.col) for t in tokens]
+
+# The tokens of source, or the type of error tokenizing it raises.
+def outcome(source, lexer):
+	try:
+		return token_tuples(tokenizer.tokenize(source, lexer=lexer))
+	except tokenizer.LexError as e:
+		return type(e)
+
+def lexers():
+	result = [pytest.param(dfa_lexer.load_lexer(), id='dfa')]
+	if vectorized_lexer.numpy is not None:
+		result.append(pytest.param(vectorized_lexer.VectorizedLexer(), id='vectorized'))
+	return result
+
+@pytest.fixture(params=lexers())
+def lexer(request):
+	return request.param
+
+@pytest.mark.parametrize('source', [
+	MIXED,
+	read('helloworld.c'),
+	read('selectionSort.c'),
+	generate_program(functions=30, seed=1),
+	'',
+	'   \n',
+])
+def test_agrees_with_tokenize(lexer, source):
+	assert outcome(source, lexer) == outcome(source, None)
+
+def test_fuzz_agrees_with_tokenize(lexer):
+	for source in fuzz_sources(2000):
+		assert outcome(source, lexer) == outcome(source, None), source
+
+def test_errors_agree(lexer):
+	for source in ['int a = "1;\n', 'int a @ 1;\n', 'f(]', 'f(']:
+		with pytest.raises(tokenizer.LexError) as regex_error:
+			tokenizer.tokenize(source)
+		with pytest.raises(tokenizer.LexError) as lexer_error:
+			tokenizer.tokenize(source, lexer=lexer)
+		assert type(lexer_error.value) is type(regex_error.value)
+		assert str(lexer_error.value) == str(regex_error.value)
+
+# The one documented difference: the DFA takes the longest token, where the
+# master regex takes the first alternative that matches.
+def test_dfa_reads_radix_prefixes_whole():
+	lexer = dfa_lexer.load_lexer()
+	assert [t.value for t in tokenizer.tokenize('0x1F', lexer=lexer)] == ['0x1F']
+	assert [t.value for t in tokenizer.tokenize('0x1F')] == ['0', 'x1F']
+
+# Tiny windows, so that runs, comments and tokens keep crossing their edges.
+@pytest.mark.skipif(vectorized_lexer.numpy is None, reason="needs NumPy")
+@pytest.mark.parametrize('window,max_window', [(1, 1), (3, 8), (5, 64)])
+def test_vectorized_windows_agree_with_tokenize(monkeypatch, window, max_window):
+	monkeypatch.setattr(vectorized_lexer, '_WINDOW', window)
+	monkeypatch.setattr(vectorized_lexer, '_MAX_WINDOW', max_window)
+	lexer = vectorized_lexer.VectorizedLexer()
+	long_runs = 'int ' + 'a' * 200 + ' =' + ' ' * 100 + '\xa0 1;\n/* ' + 'x ' * 50 + '*/\n'
+	for source in [MIXED, long_runs, generate_program(functions=5, seed=1)]:
+		assert outcome(source, lexer) == outcome(source, None)
+
+# Re-lexing after an edit only classifies the characters near it.
+@pytest.mark.skipif(vectorized_lexer.numpy is None, reason="needs NumPy")
+def test_vectorized_retokenize_classifies_near_the_edit(monkeypatch):
+	lexer = vectorized_lexer.VectorizedLexer()
+	source = generate_program(functions=500, seed=2) + '// caf\xe9\n'
+	tokens = tokenizer.tokenize(source, lexer=lexer)
+	classified = []
+	run_ends = vectorized_lexer.run_ends
+	def counting_run_ends(source, pos=0, stop=None):
+		ends = run_ends(source, pos, stop)
+		classified.append(ends[-1] - pos)
+		return ends
+	monkeypatch.setattr(vectorized_lexer, 'run_ends', counting_run_ends)
+	offset = len(source) // 2
+	tokenizer.retokenize(tokens, offset, 0, ' ', lexer=lexer)
+	assert sum(classified) <= 4 * vectorized_lexer._WINDOW
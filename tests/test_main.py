@@ -0,0 +1,17 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from benchmarks.generator import generate_program
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+@pytest.mark.parametrize('flag', ['--time-passes', '--memory-report'])
+def test_passes_report_parse_and_ast_separately(tmp_path, flag):
+	path = tmp_path / 'program.c'
+	path.write_text(generate_program(functions=3, ast_compatible=True))
+	report = tmp_path / 'passes.json'
+	subprocess.run([sys.executable, MAIN, str(path), flag, '--passes-json', str(report)], check=True, capture_output=True)
+	names = [p['name'] for p in json.loads(report.read_text())['passes']]
+	assert 'parse' in names and 'ast' in names
@@ -0,0 +1,31 @@
+import pytest
+import tokenizer
+from grammar import program
+from parser import parse
+from parallel import parse_parallel, split_declarations
+from benchmarks.generator import generate_program
+
+@pytest.mark.parametrize('source', [
+	generate_program(functions=12, seed=0),
+	generate_program(functions=12, ast_compatible=True, chain_length=10, seed=1),
+	'int a;\n',
+	'',
+])
+def test_matches_parse(source):
+	tokens = tokenizer.tokenize(source)
+	assert str(parse_parallel(tokens, 3)) == str(parse(program, tokens))
+
+def test_split_declarations():
+	source = 'int a;\nint f(int b) { b = (1); }\nint g(int c);\n'
+	tokens = tokenizer.tokenize(source)
+	bounds = split_declarations(tokens)
+	decls = [' '.join(t.value for t in list(tokens)[start:stop]) for start, stop in zip(bounds, bounds[1:])]
+	assert decls == ['int a ;', 'int f ( int b ) { b = ( 1 ) ; }', 'int g ( int c ) ;']
+
+def test_syntax_error_raises():
+	source = generate_program(functions=12, seed=2) + 'int f(int a) { a = ; }\n'
+	tokens = tokenizer.tokenize(source)
+	with pytest.raises(BaseException):
+		parse(program, tokens)
+	with pytest.raises(BaseException):
+		parse_parallel(tokens, 3)
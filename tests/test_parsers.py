@@ -0,0 +1,67 @@
+from functools import partial
+import pytest
+import tokenizer
+import lalr
+from grammar import program
+from parser import parse, PackratCache
+from parser_compiler import load_compiled_parser
+from abstract_syntax_tree import to_ast
+from benchmarks.generator import generate_program
+
+# (name, tokens -> parse tree) for every backend that builds a tree, besides
+# the backtracking parser they're checked against
+def tree_parsers():
+	return [
+		pytest.param(load_compiled_parser().parse, id='compiled'),
+		pytest.param(partial(lalr.parse, lalr.load_tables()), id='lalr'),
+		pytest.param(lambda tokens: parse(program, tokens, memo=PackratCache()), id='packrat'),
+	]
+
+# programs the AST builders handle, at a few shapes
+AST_PROGRAMS = [
+	generate_program(functions=8, ast_compatible=True, seed=seed, **shape)
+	for seed, shape in enumerate([
+		{},
+		{'expression_depth': 6},
+		{'chain_length': 15},
+		{'chain_length': 8, 'chain_operators': ['-', '/', '<', '==']},
+		{'nesting': 4, 'unary_nesting': 4},
+	])
+]
+
+# programs with declarations, calls and indexing too
+PROGRAMS = AST_PROGRAMS + [generate_program(functions=8, seed=seed) for seed in range(3)]
+
+INVALID = [
+	'int f(int a) int { }\n',
+	'int f(int a) { a = ; }\n',
+	'int f(int a) { a = 1 }\n',
+	'int a = 1 int b;\n',
+]
+
+@pytest.fixture(params=tree_parsers())
+def parse_tokens(request):
+	return request.param
+
+@pytest.mark.parametrize('source', PROGRAMS)
+def test_tree_matches_backtracking(parse_tokens, source):
+	tokens = tokenizer.tokenize(source)
+	assert str(parse_tokens(tokens)) == str(parse(program, tokens))
+
+@pytest.mark.parametrize('source', AST_PROGRAMS)
+def test_ast_matches_backtracking(parse_tokens, source):
+	tokens = tokenizer.tokenize(source)
+	assert str(to_ast(parse_tokens(tokens))) == str(to_ast(parse(program, tokens)))
+
+@pytest.mark.parametrize('source', AST_PROGRAMS)
+def test_fused_ast_matches_backtracking(source):
+	tokens = tokenizer.tokenize(source)
+	assert str(parse(program, tokens, actions=True)) == str(to_ast(parse(program, tokens)))
+
+@pytest.mark.parametrize('source', INVALID)
+def test_syntax_errors_raise(parse_tokens, source):
+	tokens = tokenizer.tokenize(source)
+	with pytest.raises(BaseException):
+		parse(program, tokens)
+	with pytest.raises(BaseException):
+		parse_tokens(tokens)
@@ -0,0 +1,75 @@
+import random
+import pytest
+import tokenizer
+import dfa_lexer
+from benchmarks.generator import generate_program
+
+INSERTS = ['', ' ', '\n', 'x', 'int ', '1', ';', '=', '+', '<', '<=', 'a = b;', '(a)', '{ }', '[1]', 'f(x[2]);',
+	'/* ( */', '// {\n', '\xa0']
+# mostly kept out, so that many edits are to a stream whose brackets pair up
+RARE_INSERTS = ["'", '"', '/*', '*/', '//', '#', '(', ')', '{', '}', '[', ']', '@', '\xe9']
+
+# Random edits (offset, deleted, inserted) to a source of length size.
+def random_edit(rng, size):
+	offset = rng.randrange(size + 1)
+	deleted = min(rng.choice([0, 0, 1, 2, 5]), size - offset)
+	inserted = rng.choice(RARE_INSERTS if rng.random() < 0.1 else INSERTS)
+	return offset, deleted, inserted
+
+def token_tuples(tokens):
+	return [(t.typename, t.value, t.offset, t.line, t.col) for t in tokens]
+
+# What tokenizing source comes to: its tokens and bracket pairs, and the
+# error's type and message if it raised.
+def outcome(tokens, error=None):
+	result = (None, None) if error is None else (type(error), str(error))
+	if tokens is not None:
+		result += (token_tuples(tokens), list(tokens.matching))
+	return result
+
+def tokenize_outcome(source, lexer):
+	try:
+		return outcome(tokenizer.tokenize(source, lexer=lexer))
+	except tokenizer.LexError as e:
+		return outcome(e.tokens, e)
+
+# Make a number of random edits to source one after another, checking each against
+# tokenizing the edited source in full.
+def check_edits(rng, source, edits, lexer, reuse):
+	tokens = tokenizer.tokenize(source, lexer=lexer)
+	for _ in range(edits):
+		offset, deleted, inserted = random_edit(rng, len(source))
+		edited = source[:offset] + inserted + source[offset + deleted:]
+		try:
+			new_tokens, first, old_stop, new_stop = tokenizer.retokenize(tokens, offset, deleted, inserted, lexer=lexer, reuse=reuse)
+			result = outcome(new_tokens)
+		except tokenizer.LexError as e:
+			assert e.source == edited
+			new_tokens = e.tokens
+			result = outcome(e.tokens, e)
+		assert result == tokenize_outcome(edited, lexer), (offset, deleted, inserted)
+		if new_tokens is not None:
+			# an edit that leaves text that isn't a token isn't made
+			source = edited
+			tokens = new_tokens
+
+@pytest.mark.parametrize('lexer', [None, dfa_lexer.load_lexer()], ids=['regex', 'dfa'])
+@pytest.mark.parametrize('reuse', [False, True])
+def test_edits_match_full_tokenize(lexer, reuse):
+	rng = random.Random(0)
+	for session in range(50):
+		check_edits(rng, generate_program(functions=3, seed=session), 12, lexer, reuse)
+
+def test_tokens_follow_edits():
+	source = 'int f(int a) { a = 1; }\nint g(int b) { b = 2; }\n'
+	tokens = tokenizer.tokenize(source)
+	before = tokens[2]
+	after = tokens[-3]
+	tokenizer.retokenize(tokens, source.index('g'), 1, 'longer_name', reuse=True)
+	assert (before.value, before.offset) == ('(', 5)
+	assert (after.value, after.offset) == ('2', source.index('2') + len('longer_name') - 1)
+
+def test_edit_out_of_range():
+	tokens = tokenizer.tokenize('int a;\n')
+	with pytest.raises(IndexError):
+		tokenizer.retokenize(tokens, 5, 3, '')
@@ -0,0 +1,20 @@
+import locale
+import re
+import sys
+import tokenizer
+
+def token_tuples(tokens):
+	return [(t.typename, t.value, t.offset, t.line, t.col) for t in tokens]
+
+def test_space_chars_are_what_str_regex_matches():
+	spaces = ''.join(chr(c) for c in range(sys.maxunicode + 1) if re.match(r'\s', chr(c)))
+	assert tokenizer._SPACE_CHARS == spaces
+
+def test_non_ascii_agrees_with_tokenize(tmp_path):
+	source = ('int f(int a) {\xa0a = 1; }\n'
+		'/* caf\xe9 — na\xefve */ int g(int b)\u3000{\n'
+		'\treturn b + 1;\x1c// \xfcber\n'
+		'}\n')
+	path = tmp_path / 'unicode.c'
+	path.write_text(source, encoding=locale.getpreferredencoding(False))
+	assert token_tuples(tokenizer.tokenize_iter(path)) == token_tuples(tokenizer.tokenize(source))
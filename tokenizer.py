@@ -1,32 +1,63 @@
 import argparse
+import locale
+import mmap
+import os
+from array import array
 from tolkien import *
-from valid_pars import *
-def tokenize(source, print_tokens = False):
-	reg = re.compile(rf'(?P<multicomment>{multicomment})|'+\
-			 rf'(?P<comment>{comment})|'+\
-			 rf'(?P<preprocessor>{preprocessor})|'+\
-			 rf'(?P<literal>{literal})|'+\
-			 r'(?P<operator>' + ALL_OPERATORS.regexstring + ')|'+\
-			 rf'(?P<identifier>{identifier})|'+\
-			 rf'(?P<whitespace>\s+)')
-
-	lc = linecol(source)
-	pos = 0
-	last = 0
-	tokens = []
-	
+# The master token regex.
+_TOKEN_PATTERN = '|'.join(f'(?P<{typename}>{pattern})' for typename, pattern in TOKEN_DEFINITIONS)
+TOKEN_REGEX = re.compile(_TOKEN_PATTERN)
+
+# Every character \s matches in a str (the ones str.isspace() is true for).
+# On bytes \s only matches ASCII whitespace, and not all of that.
+_SPACE_CHARS = '\t\n\v\f\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+
+# encoding -> the master regex for bytes in it
+_TOKEN_REGEXES_BYTES = {}
+
+# The master regex for the bytes of text in encoding, which is what
+# tokenize_iter() scans. The token definitions are plain ASCII, so they work on
+# bytes as they are, except for whitespace: that's spelled out as the encoded
+# forms of the characters in _SPACE_CHARS, so the tokens are the same as
+# TOKEN_REGEX finds in the decoded text.
+def _token_regex_bytes(encoding):
+	reg = _TOKEN_REGEXES_BYTES.get(encoding)
+	if reg is not None:
+		return reg
+	single = []
+	multi = []
+	for c in _SPACE_CHARS:
+		try:
+			encoded = c.encode(encoding)
+		except UnicodeEncodeError:
+			continue
+		if len(encoded) == 1:
+			single.append(re.escape(encoded))
+		else:
+			multi.append(re.escape(encoded))
+	whitespace = b'(?:' + b'|'.join([b'[' + b''.join(single) + b']'] + multi) + b')+'
+	pattern = b'|'.join(b'(?P<%s>%s)' % (typename.encode('ascii'), whitespace if typename == 'whitespace' else pattern.encode('ascii')) for typename, pattern in TOKEN_DEFINITIONS)
+	reg = _TOKEN_REGEXES_BYTES[encoding] = re.compile(pattern)
+	return reg
+
+# Yields (typename, text, start) for each token of source the parser gets to
+# see, found with the master regex, starting at offset pos (which has to be
+# where a token starts).
+def _scan_regex(source, lines, pos=0):
+	reg = TOKEN_REGEX
+	last = pos
+
 	# n.b. "match" is apparently a keyword in python 3.10
 	while m := reg.search(source, pos):
 		start = m.start()
 		pos = m.end()
 		if start != last:
-			line, col = lc[pos]
+			line, col = lines.linecol(pos)
 			# TODO: error handling
-			raise Exception(f"found something that doesn't look like a token at l:{line} c:{col}:\n"+\
+			raise LexError(f"found something that doesn't look like a token at l:{line} c:{col}:\n"+\
 				f"{source[last:start]}")
 		last = pos
 		
-		line, col = lc[pos]
 		typename = m.lastgroup
 		if typename not in ALL_TYPES:
 			raise Exception(f"matched token with typename {typename},"+\
@@ -38,34 +69,371 @@ def tokenize(source, print_tokens = False):
 			typename = 'keyword'
 
 		if typename not in IGNORED_TYPES:
-			tokens.append(Token(m[0], typename, line, col))
+			yield typename, m[0], start
 
-        #Parenthesis error handling
-	#Still need to implement index for error
-	str = ''.join(f"{token}" for token in tokens)
+# Returns a TokenStream; token positions are only resolved to lines and columns
+# when they're read (for an error message, or print_tokens). Brackets are
+# matched as the tokens are produced, filling in tokens.matching.
+#
+# lexer picks what finds the tokens: the master regex by default, or anything
+# with a scan(source, lines, pos=0) method that yields tokens like _scan_regex
+# does (see dfa_lexer.py).
+#
+# Text that isn't a token raises a LexError, and a bracket without a partner a
+# BracketError holding all of the tokens.
+def tokenize(source, print_tokens = False, lexer = None):
+	scan = _scan_regex if lexer is None else lexer.scan
 
-	if(valid_pars(str) == False):
-		print("Syntax error: Parenthesis/Brackets do not match")
-		exit()
+	lines = LineIndex(source)
+	tokens = TokenStream(source, lines)
+	matching = tokens.matching
+	# token indexes of the brackets still waiting to be closed
+	open_brackets = []
+	# whether a closing bracket has been found without a partner; the
+	# brackets are paired again at the end, for the error
+	unpaired = False
 
+	try:
+		for typename, text, start in scan(source, lines):
+			tokens.append(text, typename, start)
+			if typename == 'operator' and not unpaired:
+				if text in BRACKETS:
+					open_brackets.append(len(matching) - 1)
+				elif text in CLOSING_BRACKETS:
+					index = len(matching) - 1
+					if not open_brackets or BRACKETS[tokens[open_brackets[-1]].value] != text:
+						unpaired = True
+						continue
+					opening = open_brackets.pop()
+					matching[opening] = index - opening
+					matching[index] = opening - index
+	except LexError as e:
+		e.source = source
+		raise
+
+	if unpaired or open_brackets:
+		tokens.balanced = False
+		raise BracketError(_pair_all(tokens), tokens)
 
-	
 	if print_tokens:
 		print('\n'.join(f"{token.typename} l:{token.line} c:{token.col} --- {token}" for token in tokens))
 	return tokens
 
+# A bracket without a partner, the first one found. tokens is the whole
+# TokenStream (from retokenize(), the edited one), with the brackets that
+# couldn't be paired left unpaired.
+class BracketError(LexError):
+	def __init__(self, message, tokens):
+		super().__init__(message, tokens.source, tokens)
+
+# The error message for a closing bracket at token index that doesn't match
+# the innermost open one (or, with index None, the end of the file while
+# brackets are still open).
+def _bracket_message(tokens, index, open_brackets):
+	if index is not None:
+		closing = tokens[index]
+		message = f"Syntax error: unmatched '{closing}' at l:{closing.line} c:{closing.col}"
+		if open_brackets:
+			opening = tokens[open_brackets[-1]]
+			message += f" (innermost open bracket is '{opening}' at l:{opening.line} c:{opening.col})"
+	else:
+		opening = tokens[open_brackets[-1]]
+		message = f"Syntax error: '{opening}' at l:{opening.line} c:{opening.col} is never closed"
+	return message
+
+# How far past its end the text can decide a token: 0 followed by x' is only
+# the literal 0 once the next character turns out not to be a hex digit.
+_LOOKAHEAD = 3
+
+# Returns (new tokens, first, old_stop, new_stop) for the source of tokens
+# after replacing deleted characters at offset with inserted: tokens[first:
+# old_stop] were replaced by new tokens[first:new_stop], the rest are the same
+# tokens (shifted, after the edit). tokens gets the edit as its successor, and
+# keeps its contents, unless reuse is True: then the new tokens are made out
+# of its arrays, which saves copying them, and tokens is released (see
+# TokenStream.release).
+#
+# If the edit leaves a bracket without a partner, this raises a BracketError
+# holding the new tokens (which still get to be the successor), marked as not
+# balanced; editing those again pairs up all their brackets anew. If it leaves
+# text that isn't a token, this raises a LexError holding the edited source,
+# and tokens is left as it was.
+#
+# Only the tokens from just before the edit up to where the token boundaries
+# line up with the old ones again are lexed; that can still be far away when
+# the edit opens or closes a comment. The tokens after those are kept as they
+# are: their offsets are left owing the shift (see TokenStream), and their
+# bracket pairs are relative. Apart from moving arrays along, the rest of the
+# work grows with how far the edit is from the one before, not with the size
+# of the source.
+def retokenize(tokens, offset, deleted, inserted, lexer = None, reuse = False):
+	scan = _scan_regex if lexer is None else lexer.scan
+
+	old_source = tokens.source
+	if not 0 <= offset <= offset + deleted <= len(old_source):
+		raise IndexError("edit out of range of the source")
+	source = old_source[:offset] + inserted + old_source[offset + deleted:]
+	delta = len(inserted) - deleted
+	lines = tokens.lines.edited(offset, deleted, inserted)
+	gap = tokens.gap
+	shift = tokens.shift
+	num_tokens = len(tokens)
+
+	# tokens ending far enough before the edit can't change...
+	first = bisect_offsets(tokens.ends, gap, shift, offset - _LOOKAHEAD)
+	# ...except a /* that never got closed (and so was read as / and then
+	# * or *=), which the edit may have closed
+	edit_end = offset + len(inserted)
+	if '*/' in source[max(offset - 1, 0):edit_end + 1]:
+		slash = intern_value('/')
+		values = tokens.values
+		i = 0
+		while True:
+			try:
+				i = values.index(slash, i, first)
+			except ValueError:
+				break
+			if old_source.startswith('*', tokens.end(i)):
+				first = i
+				break
+			i += 1
+	pos = tokens.end(first - 1) if first > 0 else 0
+
+	# lex until a token starts after the edit exactly where one started
+	# before it: from there on the text, and so the tokens, are the same
+	lexed = TokenStream(source, lines)
+	old_stop = first
+	try:
+		for typename, text, start in scan(source, lines, pos):
+			if start >= edit_end:
+				old_start = start - delta
+				while old_stop < num_tokens and tokens.start(old_stop) < old_start:
+					old_stop += 1
+				if old_stop < num_tokens and tokens.start(old_stop) == old_start:
+					break
+			lexed.append(text, typename, start)
+		else:
+			old_stop = num_tokens
+	except LexError as e:
+		e.source = source
+		raise
+	new_stop = first + len(lexed)
+
+	# the brackets open before the first new token, and the closing brackets
+	# after the last one of those open before it, by the old pairs
+	balanced = tokens.balanced
+	if balanced:
+		open_brackets = _open_before(tokens, first)
+		closing = _closing_after(tokens, first, old_stop, len(open_brackets))
+
+	new_tokens = TokenStream(source, lines)
+	if reuse:
+		new_tokens.kinds = tokens.kinds
+		new_tokens.starts = tokens.starts
+		new_tokens.ends = tokens.ends
+		new_tokens.values = tokens.values
+		new_tokens.matching = tokens.matching
+	else:
+		new_tokens.kinds = tokens.kinds[:]
+		new_tokens.starts = tokens.starts[:]
+		new_tokens.ends = tokens.ends[:]
+		new_tokens.values = tokens.values[:]
+		new_tokens.matching = tokens.matching[:]
+	new_tokens.kinds[first:old_stop] = lexed.kinds
+	splice_offsets(new_tokens.starts, gap, shift, first, old_stop, lexed.starts)
+	splice_offsets(new_tokens.ends, gap, shift, first, old_stop, lexed.ends)
+	new_tokens.values[first:old_stop] = lexed.values
+	new_tokens.matching[first:old_stop] = lexed.matching
+	new_tokens.gap = new_stop
+	new_tokens.shift = shift + delta
+
+	# brackets are paired up in order, like tokenize() does, starting with
+	# the ones open before the first new token; the first one that can't be
+	# is the error
+	error = None
+	if balanced:
+		operator = KINDS['operator']
+		for index in range(first, new_stop):
+			if new_tokens.kinds[index] != operator:
+				continue
+			text = value_text(new_tokens.values[index])
+			if text in BRACKETS:
+				open_brackets.append(index)
+			elif text in CLOSING_BRACKETS:
+				message = _pair_bracket(new_tokens, index, open_brackets)
+				error = error or message
+		new_tokens.open_at = (new_stop, list(open_brackets))
+		# the brackets paired up after the new tokens stay paired, the
+		# closing brackets that were paired with earlier ones are matched
+		# again with the ones open now
+		for index in closing:
+			message = _pair_bracket(new_tokens, index + new_stop - old_stop, open_brackets)
+			error = error or message
+		if open_brackets:
+			error = error or _bracket_message(new_tokens, None, open_brackets)
+	if not balanced or error is not None:
+		# the old pairs can't be relied on, or some of them have been
+		# half undone: pair them all again
+		error = _pair_all(new_tokens)
+	tokens.successor = (new_tokens, first, old_stop, new_stop)
+	if reuse:
+		tokens.release()
+	if error is not None:
+		new_tokens.balanced = False
+		raise BracketError(error, new_tokens)
+	return new_tokens, first, old_stop, new_stop
+
+# The indexes of the brackets still open before token index stop, outermost
+# first, in a balanced stream. Worked out from tokens.open_at, going over the
+# tokens in between but jumping over every bracketed region among them.
+def _open_before(tokens, stop):
+	matching = tokens.matching
+	known, known_open = tokens.open_at
+	if stop >= known:
+		result = list(known_open)
+		i = known
+		while i < stop:
+			partner = i + matching[i]
+			if partner > i:
+				if partner < stop:
+					i = partner + 1
+					continue
+				result.append(i)
+			elif partner < i:
+				result.pop()
+			i += 1
+		return result
+
+	# the ones open before known that were opened before stop, and the
+	# ones closed in between that were
+	result = [i for i in known_open if i < stop]
+	closed = []
+	i = stop
+	while i < known:
+		partner = i + matching[i]
+		if i < partner < known:
+			i = partner + 1
+			continue
+		if partner < i:
+			closed.append(partner)
+		i += 1
+	closed.reverse()
+	return result + closed
+
+# The indexes of the closing brackets, from token index stop on, of the
+# brackets open before stop in a balanced stream; num_open were open before
+# first, and tokens[first:stop] opened and closed the rest.
+def _closing_after(tokens, first, stop, num_open):
+	matching = tokens.matching
+	i = first
+	while i < stop:
+		partner = i + matching[i]
+		if partner > i:
+			if partner < stop:
+				i = partner + 1
+				continue
+			num_open += 1
+		elif partner < i:
+			num_open -= 1
+		i += 1
+	closing = []
+	while len(closing) < num_open:
+		partner = i + matching[i]
+		if partner > i:
+			i = partner + 1
+			continue
+		if partner < i:
+			closing.append(i)
+		i += 1
+	return closing
+
+# Pair the closing bracket at token index with the innermost open one, or
+# leave it unpaired and return the error message if they don't match.
+def _pair_bracket(tokens, index, open_brackets):
+	text = tokens[index].value
+	if not open_brackets or BRACKETS[tokens[open_brackets[-1]].value] != text:
+		return _bracket_message(tokens, index, open_brackets)
+	opening = open_brackets.pop()
+	tokens.matching[opening] = index - opening
+	tokens.matching[index] = opening - index
+	return None
 
-def linecol(source):
-	positions = []
-	lines = source.split('\n')
+# Pair up all the brackets of tokens from scratch, like tokenize() does but
+# going on past the first error. Returns its message, or None.
+def _pair_all(tokens):
+	tokens.matching = array('i', [0]) * len(tokens)
+	tokens.open_at = (0, [])
+	open_brackets = []
+	error = None
+	operator = KINDS['operator']
+	for index, kind in enumerate(tokens.kinds):
+		if kind != operator:
+			continue
+		text = value_text(tokens.values[index])
+		if text in BRACKETS:
+			open_brackets.append(index)
+		elif text in CLOSING_BRACKETS:
+			message = _pair_bracket(tokens, index, open_brackets)
+			error = error or message
+	if open_brackets:
+		error = error or _bracket_message(tokens, None, open_brackets)
+	return error
 
-	for i, line in enumerate(lines):
-		for j in range(len(line)):
-			positions.append((i, j))
-			
-		positions.append((i, len(line)))
-	
-	return positions
+# Yields the tokens of the file at path one at a time, as StreamedTokens, without
+# reading the file into memory: the regex runs directly over an mmap of it, so
+# only the pages being scanned need to be resident, and nothing is kept once a
+# token has been yielded. Since there are no buffer windows, a comment or string
+# literal can't be cut in half by one. Lines, columns and offsets are tracked by
+# counting newlines and characters as the scan passes them; characters, not
+# bytes, so they agree with tokenize() on the same file, which is decoded the
+# way open() decodes it (with the locale's encoding).
+#
+# Unlike tokenize(), this doesn't match brackets: there's no TokenStream to
+# keep the pairs in.
+def tokenize_iter(path):
+	encoding = locale.getpreferredencoding(False)
+	with open(path, 'rb') as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			# an empty file can't be mapped, and has no tokens anyway
+			return
+		buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
+	with buf:
+		reg = _token_regex_bytes(encoding)
+		pos = 0
+		last = 0
+		line = 0
+		line_start = 0
+		offset = 0
+		col = 0
+		while m := reg.search(buf, pos):
+			start = m.start()
+			pos = m.end()
+			if start != last:
+				skipped = buf[last:start]
+				line += skipped.count(b'\n') + m[0].count(b'\n')
+				line_start = buf.rfind(b'\n', 0, pos) + 1
+				col = len(buf[line_start:pos].decode(encoding, errors='replace'))
+				raise LexError(f"found something that doesn't look like a token at l:{line} c:{col}:\n"+\
+					f"{skipped.decode(encoding, errors='replace')}")
+			last = pos
 
+			text = m[0]
+			token_offset = offset
+			length = len(text) if text.isascii() else len(text.decode(encoding))
+			offset += length
+			newlines = text.count(b'\n')
+			if newlines:
+				line += newlines
+				tail = text[text.rindex(b'\n') + 1:]
+				col = len(tail) if tail.isascii() else len(tail.decode(encoding))
+			else:
+				col += length
 
+			typename = m.lastgroup
+			if typename in IGNORED_TYPES:
+				continue
+			value = text.decode(encoding)
+			if typename == 'identifier' and value in KEYWORDS:
+				typename = 'keyword'
+			yield StreamedToken(value, typename, token_offset, line, col)
@@ -2,6 +2,9 @@
 #to understand how to use tokens, but not the tokenizer itself
 
 import re
+from array import array
+from contextlib import contextmanager
+from bisect import bisect_right
 from enum import Enum
 
 _REGEX_ESCAPES = {
@@ -193,12 +196,314 @@ multicomment = r'/\*(?s:.*?)\*/'
 #not supported yet
 preprocessor = r'#.*?(?m:$)'
 
+# Every kind of token the tokenizer matches, in the order they're tried: where
+# two could match at the same place, the earlier one wins.
+TOKEN_DEFINITIONS = [
+	('multicomment', multicomment),
+	('comment', comment),
+	('preprocessor', preprocessor),
+	('literal', literal),
+	('operator', ALL_OPERATORS.regexstring),
+	('identifier', identifier),
+	('whitespace', r'\s+'),
+]
+
+# Offsets into a source string (of newlines, or of tokens) are kept in arrays
+# in a way that lets an edit move all the ones after it at once: the offsets
+# from index gap on are stored shift short of what they are. An edit adds how
+# far it moved the text after it to the shift, and moves the gap to itself;
+# only the offsets between the old gap and the new one are rewritten one by
+# one, which is few when one edit follows another nearby, like typing does.
+# A new array owes nothing (gap 0, shift 0).
+
+# The number of offsets in values no greater than x, like bisect_right on the
+# offsets proper.
+def bisect_offsets(values, gap, shift, x):
+	if gap < len(values) and values[gap] + shift <= x:
+		return bisect_right(values, x - shift, gap)
+	return bisect_right(values, x, 0, gap)
+
+# Replace the offsets values[first:stop] with middle (an array of offsets of
+# the same type, which owe nothing), in place, for an edit that moved the
+# ones after them by delta: they're left owing shift + delta from first +
+# len(middle) on, the new gap.
+def splice_offsets(values, gap, shift, first, stop, middle):
+	if shift and gap < first:
+		values[gap:first] = array(values.typecode, [value + shift for value in values[gap:first]])
+	elif shift and stop < gap:
+		values[stop:gap] = array(values.typecode, [value - shift for value in values[stop:gap]])
+	values[first:stop] = middle
+
+# Maps offsets in a source string to (line, column) pairs, both counted from 0.
+# Only the offsets of the newlines are stored, so it's a few bytes per line
+# rather than per character.
+class LineIndex:
+	def __init__(self, source):
+		self.newlines = array('i')
+		pos = source.find('\n')
+		while pos != -1:
+			self.newlines.append(pos)
+			pos = source.find('\n', pos + 1)
+		self.gap = 0
+		self.shift = 0
+
+	# The LineIndex of the source after replacing deleted characters at offset
+	# with inserted; the newlines after the edit are left owing the shift.
+	def edited(self, offset, deleted, inserted):
+		first = bisect_offsets(self.newlines, self.gap, self.shift, offset - 1)
+		stop = bisect_offsets(self.newlines, self.gap, self.shift, offset + deleted - 1)
+		middle = array('i')
+		pos = inserted.find('\n')
+		while pos != -1:
+			middle.append(offset + pos)
+			pos = inserted.find('\n', pos + 1)
+		result = LineIndex('')
+		result.newlines = self.newlines[:]
+		splice_offsets(result.newlines, self.gap, self.shift, first, stop, middle)
+		result.gap = first + len(middle)
+		result.shift = self.shift + len(inserted) - deleted
+		return result
+
+	def linecol(self, offset):
+		line = bisect_offsets(self.newlines, self.gap, self.shift, offset - 1)
+		if line == 0:
+			return line, offset
+		newline = self.newlines[line - 1]
+		if line - 1 >= self.gap:
+			newline += self.shift
+		return line, offset - newline - 1
+
+	# Pay the newlines what they're owed, for code that reads them directly.
+	def settle(self):
+		end = len(self.newlines)
+		splice_offsets(self.newlines, self.gap, self.shift, end, end, array('i'))
+		self.shift = 0
+
+# Operator tokens that open a bracketed region, and the token closing each.
+BRACKETS = {'(': ')', '[': ']', '{': '}'}
+CLOSING_BRACKETS = frozenset(BRACKETS.values())
+
+# Token kinds as small integers, so the parser can compare kinds without
+# comparing typename strings. Only the kinds that make it into a TokenStream.
+KINDS = {t.value: kind for kind, t in enumerate(TYPES)}
+KIND_TYPES = list(TYPES)
+
+# Interned token texts: every distinct text gets a small integer id, shared by
+# all token streams (and the grammar's terminals) in the process, so the parser
+# can compare texts by id.
+#
+# The table only grows on its own: every identifier and literal tokenized
+# stays in it. A process that compiles one source after another scopes each
+# compile with value_scope() (batch.py's workers do). An IncrementalParse
+# session can't, since its ids have to outlive every edit; it adds at most the
+# distinct texts of the tokens each edit re-lexes, which is what typing a new
+# name costs.
+_VALUE_IDS = {}
+_VALUES = []
+
+def intern_value(text):
+	value_id = _VALUE_IDS.get(text)
+	if value_id is None:
+		value_id = len(_VALUES)
+		_VALUE_IDS[text] = value_id
+		_VALUES.append(text)
+	return value_id
+
+def value_text(value_id):
+	return _VALUES[value_id]
+
+# The texts first interned while this is active are dropped from the table
+# when it ends, and their ids handed out again later, so nothing holding those
+# ids (token streams, and the Tokens and trees made from them) may be used
+# afterwards. What was interned before it, like the grammar's terminals,
+# stays. Scopes nest.
+@contextmanager
+def value_scope():
+	mark = len(_VALUES)
+	try:
+		yield
+	finally:
+		for text in _VALUES[mark:]:
+			del _VALUE_IDS[text]
+		del _VALUES[mark:]
+
+# The tokens of one source file as parallel typed arrays: kind codes, start and
+# end offsets, and interned value ids. Indexing it gives a Token, a lightweight
+# view made on demand. The offsets are stored like those of a LineIndex, from
+# gap on owing shift, so read them with start() and end() (or settle() them
+# first).
+#
+# matching pairs up brackets: for the token index of a bracket it holds how far
+# ahead its partner is (behind, for a closing bracket), and 0 for every other
+# token, so a balanced region (an argument list, a function body) can be
+# skipped in one step; kept relative, the pairs after an edit don't change. The
+# tokenizer fills it in as it goes. balanced is False if an edit left brackets
+# without partners (see tokenizer.retokenize); matching only holds the pairs
+# that could be made then. open_at is (index, the indexes of the brackets
+# still open before it), somewhere the tokenizer found out, so finding the
+# ones open somewhere nearby doesn't take going back to the start.
+#
+# successor is set when the stream is edited (see tokenizer.retokenize), to
+# (new stream, first, old_stop, new_stop): tokens[first:old_stop] were
+# replaced by new stream[first:new_stop], and the others carried over.
+class TokenStream:
+	def __init__(self, source, lines):
+		self.source = source
+		self.lines = lines
+		self.kinds = array('B')
+		self.starts = array('i')
+		self.ends = array('i')
+		self.values = array('I')
+		self.matching = array('i')
+		self.gap = 0
+		self.shift = 0
+		self.balanced = True
+		self.open_at = (0, [])
+		self.successor = None
+
+	def append(self, text, typename, start):
+		self.kinds.append(KINDS[typename])
+		self.starts.append(start)
+		self.ends.append(start + len(text))
+		self.values.append(intern_value(text))
+		self.matching.append(0)
+
+	def start(self, index):
+		if index < self.gap:
+			return self.starts[index]
+		return self.starts[index] + self.shift
+
+	def end(self, index):
+		if index < self.gap:
+			return self.ends[index]
+		return self.ends[index] + self.shift
+
+	# Pay the offsets (these and the LineIndex's) what they're owed, for code
+	# that reads starts, ends and the newlines directly.
+	def settle(self):
+		end = len(self.starts)
+		splice_offsets(self.starts, self.gap, self.shift, end, end, array('i'))
+		splice_offsets(self.ends, self.gap, self.shift, end, end, array('i'))
+		self.shift = 0
+		self.lines.settle()
+
+	# Drop the contents of a stream that has been edited, for a holder of its
+	# Tokens that has no more use for the ones the edit replaced: the others
+	# still find their way to the edited stream (see Token), but the stream
+	# doesn't keep its copy of the source and its arrays alive any more.
+	def release(self):
+		assert self.successor is not None
+		self.source = self.lines = None
+		self.kinds = self.starts = self.ends = self.values = self.matching = None
+		self.open_at = None
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += len(self.kinds)
+		if not 0 <= index < len(self.kinds):
+			raise IndexError("token index out of range")
+		return Token(self, index)
+
+	def __iter__(self):
+		for index in range(len(self.kinds)):
+			yield Token(self, index)
+
+# A view of one token in a TokenStream. Its line and column are looked up in
+# the stream's LineIndex when asked for; like the tokenizer always has, they
+# give the position just past the end of the token.
+#
+# If the stream has been edited since, a token that carried over to the edited
+# stream reads it there instead (and moves to it, so following an edit only
+# happens once). A token the edit replaced keeps reading the old stream.
 class Token:
-	def __init__(self, text, typename, line, col):
-		self.value = text
+	__slots__ = ('stream', 'index')
+
+	def __init__(self, stream, index):
+		self.stream = stream
+		self.index = index
+
+	# Move to the latest stream this token carried over to.
+	def follow_edits(self):
+		stream = self.stream
+		index = self.index
+		while stream.successor is not None:
+			next_stream, first, old_stop, new_stop = stream.successor
+			if index >= old_stop:
+				index += new_stop - old_stop
+			elif index >= first:
+				break
+			stream = next_stream
+		self.stream = stream
+		self.index = index
+
+	@property
+	def value(self):
+		if self.stream.successor is not None:
+			self.follow_edits()
+		return _VALUES[self.stream.values[self.index]]
+
+	@property
+	def typename(self):
+		if self.stream.successor is not None:
+			self.follow_edits()
+		return KIND_TYPES[self.stream.kinds[self.index]].value
+
+	@property
+	def kind(self):
+		if self.stream.successor is not None:
+			self.follow_edits()
+		return self.stream.kinds[self.index]
+
+	@property
+	def offset(self):
+		if self.stream.successor is not None:
+			self.follow_edits()
+		return self.stream.start(self.index)
+
+	@property
+	def line(self):
+		if self.stream.successor is not None:
+			self.follow_edits()
+		return self.stream.lines.linecol(self.stream.end(self.index))[0]
+
+	@property
+	def col(self):
+		if self.stream.successor is not None:
+			self.follow_edits()
+		return self.stream.lines.linecol(self.stream.end(self.index))[1]
+
+	def __str__(self):
+		return self.value
+
+# A token that stands on its own rather than in a TokenStream, for consumers
+# that only read tokens once, in order (see tokenizer.tokenize_iter). Same
+# attributes as Token, counted in characters like Token's.
+class StreamedToken:
+	__slots__ = ('value', 'typename', 'offset', 'line', 'col')
+
+	def __init__(self, value, typename, offset, line, col):
+		self.value = value
 		self.typename = typename
+		self.offset = offset
 		self.line = line
 		self.col = col
-	
+
+	@property
+	def kind(self):
+		return KINDS[self.typename]
+
 	def __str__(self):
 		return self.value
+
+# Text that can't be made into tokens: something that doesn't look like one,
+# or (see tokenizer.BracketError) a bracket without a partner. source is the
+# text that was being tokenized, which from tokenizer.retokenize is the edited
+# source, and tokens the TokenStream made of it, if there is one.
+class LexError(SyntaxError):
+	def __init__(self, message, source=None, tokens=None):
+		super().__init__(message)
+		self.source = source
+		self.tokens = tokens
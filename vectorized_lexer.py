@@ -0,0 +1,178 @@
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from tokenizer import TOKEN_REGEX
+from tolkien import ALL_TYPES, IGNORED_TYPES, KEYWORDS, ALL_OPERATORS, LexError, literal
+
+# NumPy is optional: without it, VectorizedLexer can't be used but everything
+# else works.
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# A lexer that classifies every character of the source up front, in one
+# vectorized pass, instead of leaving all of it to the master regex. Most of a
+# C file is whitespace, identifiers and comments, and those are the tokens the
+# regex is slowest to find: it tries every other alternative first. With the
+# classification, a whitespace or identifier token is just the run of
+# whitespace or word characters it starts, and a comment ends at the next */
+# or newline. Of the rest, a token starting with a digit or quote can only be
+# a literal and one starting with most operator characters only an operator,
+# so those are matched with just that part of the master regex; the few
+# ambiguous ones ('.', an unterminated comment, errors) go through all of it.
+# The tokens are exactly the ones tokenizer._scan_regex finds.
+#
+# The characters are classified a window at a time, starting where the scan
+# does, each window twice the size of the one before: a scan that stops after
+# a few tokens, like tokenizer.retokenize's, only classifies the text near
+# where it started, and one over a whole file takes a few passes.
+
+# character classes
+_OTHER = 0
+_SPACE = 1
+_WORD = 2
+
+# what re's \s and [a-zA-Z0-9_] match among the ASCII characters
+_SPACE_CHARS = frozenset(chr(c) for c in range(128) if re.fullmatch(r'\s', chr(c)))
+_WORD_CHARS = frozenset(chr(c) for c in range(128) if re.fullmatch(r'[a-zA-Z0-9_]', chr(c)))
+_WORD_START = frozenset(c for c in _WORD_CHARS if not c.isdigit())
+_LITERAL_START = frozenset('0123456789"\'')
+# '.' can also start a float literal, '/' a comment
+_OPERATOR_START = frozenset(op[0] for op in ALL_OPERATORS) - {'.', '/'}
+
+_LITERAL_REGEX = re.compile(literal)
+
+# Lookup table from character code to class; every non-ASCII character is
+# clipped to code 128, which is _OTHER.
+def _class_table():
+	table = numpy.zeros(129, dtype=numpy.uint8)
+	for c in _SPACE_CHARS:
+		table[ord(c)] = _SPACE
+	for c in _WORD_CHARS:
+		table[ord(c)] = _WORD
+	return table
+
+# size of the first window classified, and the most a window grows to when
+# the last one didn't hold a run
+_WINDOW = 4096
+_MAX_WINDOW = 1 << 20
+
+# The offsets at which each run of same-class characters in source[pos:stop]
+# ends, in increasing order, the last being stop (len(source) by default).
+def run_ends(source, pos=0, stop=None):
+	if pos or stop is not None:
+		source = source[pos:stop]
+	if source.isascii():
+		codes = numpy.frombuffer(source.encode('ascii'), dtype=numpy.uint8)
+	else:
+		codes = numpy.minimum(numpy.frombuffer(source.encode('utf-32-le'), dtype=numpy.uint32), 128)
+	classes = _class_table()[codes]
+	ends = numpy.flatnonzero(classes[1:] != classes[:-1]) + 1 + pos
+	result = array('I', ends.astype(numpy.uint32).tobytes())
+	result.append(pos + len(source))
+	return result
+
+class VectorizedLexer:
+	def __init__(self):
+		if numpy is None:
+			raise ImportError("the vectorized lexer needs NumPy")
+
+	# Yields (typename, text, start) like tokenizer._scan_regex, including
+	# its errors.
+	def scan(self, source, lines, pos=0):
+		reg = TOKEN_REGEX
+		operator_match = ALL_OPERATORS.regexcomp.match
+		literal_match = _LITERAL_REGEX.match
+		keywords = frozenset(KEYWORDS)
+		n = len(source)
+		# the run ends of the window of characters classified, which ends
+		# at stop
+		size = _WINDOW
+		stop = min(pos + size, n)
+		ends = run_ends(source, pos, stop)
+		# index in ends of the run pos is in
+		run = 0
+		while pos < n:
+			if pos >= stop:
+				# past the window (a comment can skip far): classify
+				# the next one from here
+				size = min(size * 2, _MAX_WINDOW)
+				stop = min(pos + size, n)
+				ends = run_ends(source, pos, stop)
+				run = 0
+			elif ends[run] <= pos:
+				run += 1
+				if ends[run] <= pos:
+					# a comment can skip many runs
+					run = bisect_right(ends, pos, run)
+			c = source[pos]
+			if c in _WORD_START or c in _SPACE_CHARS:
+				end = ends[run]
+				while end == stop < n:
+					# the run may go on past the window: classify
+					# a bigger one from here (past _MAX_WINDOW if
+					# the run is that long)
+					size *= 2
+					stop = min(pos + size, n)
+					ends = run_ends(source, pos, stop)
+					run = 0
+					end = ends[0]
+			if c in _WORD_START:
+				text = source[pos:end]
+				yield ('keyword' if text in keywords else 'identifier'), text, pos
+				pos = end
+				continue
+			if c in _SPACE_CHARS:
+				# \s+ also takes in any non-ASCII whitespace that follows
+				if end == n or not source[end].isspace():
+					pos = end
+					continue
+			elif c == '/' or c == '#':
+				if source.startswith('/*', pos):
+					end = source.find('*/', pos + 2)
+					if end != -1:
+						pos = end + 2
+						continue
+				elif c == '#' or source.startswith('//', pos):
+					end = source.find('\n', pos)
+					pos = n if end == -1 else end
+					continue
+
+			elif c in _OPERATOR_START:
+				end = operator_match(source, pos).end()
+				yield 'operator', source[pos:end], pos
+				pos = end
+				continue
+			elif c in _LITERAL_START:
+				m = literal_match(source, pos)
+				if m is not None:
+					end = m.end()
+					yield 'literal', m[0], pos
+					pos = end
+					continue
+
+			m = reg.search(source, pos)
+			if m is None:
+				return
+			start = m.start()
+			end = m.end()
+			if start != pos:
+				line, col = lines.linecol(end)
+				raise LexError(f"found something that doesn't look like a token at l:{line} c:{col}:\n"+\
+					f"{source[pos:start]}")
+			typename = m.lastgroup
+			if typename not in ALL_TYPES:
+				raise Exception(f"matched token with typename {typename},"+\
+					"which either means reg has a typo in one of the ?P<typenames>"+\
+					"or reg.search() didn't find a match and returned None.")
+			if typename == 'identifier' and m[0] in KEYWORDS:
+				typename = 'keyword'
+			if typename not in IGNORED_TYPES:
+				yield typename, m[0], start
+			pos = end
+
+if __name__ == "__main__":
+	import dfa_lexer
+	dfa_lexer.benchmark(sys.argv[1:], {'regex': None, 'dfa': dfa_lexer.load_lexer(), 'vectorized': VectorizedLexer()})